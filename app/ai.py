@@ -2,24 +2,105 @@ import os
 import json
 
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from enum import Enum
+from functools import lru_cache
+
+import openai
+import anthropic
+import requests
 
 from openai import OpenAI
 from anthropic import Anthropic
 from pydantic import BaseModel
-from typing import Type, Dict
-
-from .constants import GPT_4o_MINI, SONNET_3_5, DEVELOPER, USER
+from typing import Optional, Type, Dict, Any
+
+from .constants import (
+    GPT_4o_MINI,
+    SONNET_3_5,
+    HAIKU_3_5,
+    GPT_4o,
+    DEVELOPER,
+    USER,
+    LLM_RENDER_PROFILE,
+)
 from .prompts import OUTPUT_LANGUAGE_PROMPT, ANTHROPIC_SYSTEM_PROMPT, ANTHROPIC_STRUCTURED_OUTPUT_PROMPT
 from .utils import handle_exceptions
+from .context import current_timeout
+from .render import RENDER_PROFILES, estimate_image_tokens
 import tiktoken
 
-enc = tiktoken.encoding_for_model(GPT_4o_MINI)
+# Exceptions raised when a call runs out of its time budget
+TIMEOUT_EXCEPTIONS = (
+    TimeoutError,
+    requests.Timeout,
+    openai.APITimeoutError,
+    anthropic.APITimeoutError,
+)
+
+
+def _request_timeout(timeout: Optional[float], not_given):
+    """
+    Get the timeout of a provider request: the explicit one, or the time left to the current pipeline stage.
+
+    Args:
+        timeout (float): Explicit timeout in seconds
+        not_given: The "not given" sentinel of the provider SDK, which then applies its default timeout
+
+    Returns:
+        The timeout to pass to the SDK
+    """
+    timeout = timeout if timeout is not None else current_timeout()
+    return not_given if timeout is None else timeout
+
 
 class LLMProvider(str, Enum):
     OPENAI = "openai"
     ANTHROPIC = "anthropic"
 
+
+@lru_cache(maxsize=None)
+def _encoding() -> tiktoken.Encoding:
+    # Loaded on first use, as tiktoken downloads it the first time
+    return tiktoken.encoding_for_model(GPT_4o_MINI)
+
+
+MODEL_PROVIDERS = {
+    GPT_4o_MINI: LLMProvider.OPENAI,
+    GPT_4o: LLMProvider.OPENAI,
+    HAIKU_3_5: LLMProvider.ANTHROPIC,
+    SONNET_3_5: LLMProvider.ANTHROPIC,
+}
+
+
+def estimate_tokens(messages: list[Dict[str, Any]]) -> int:
+    """
+    Estimate the input tokens of messages, before the provider counts them.
+    Images are assumed rendered with the LLM render profile.
+
+    Args:
+        messages (list[Dict[str, Any]]): Messages in OpenAI or Anthropic format
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    profile = RENDER_PROFILES[LLM_RENDER_PROFILE]
+    image_tokens = estimate_image_tokens(profile.width, profile.height)
+
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(_encoding().encode(content))
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(_encoding().encode(part["text"]))
+            else:
+                tokens += image_tokens
+    return tokens
+
+
 class LLMClient(ABC):
     """
     Abstract class for a Language Model client
@@ -29,22 +110,39 @@ class LLMClient(ABC):
         self.client = client
         self.input_token = 0
         self.output_token = 0
+        # Input and output tokens of each model, which have their own prices
+        self.model_tokens: Dict[str, list[int]] = defaultdict(lambda: [0, 0])
     
     def get_total_tokens(self):
         return self.input_token, self.output_token
 
+    def get_model_tokens(self) -> Dict[str, tuple[int, int]]:
+        return {model: tuple(tokens) for model, tokens in self.model_tokens.items()}
+
+    def _count_tokens(self, model: str, input_tokens: int, output_tokens: int) -> None:
+        self.input_token += input_tokens
+        self.output_token += output_tokens
+        self.model_tokens[model][0] += input_tokens
+        self.model_tokens[model][1] += output_tokens
+
     def reset_token_count(self):
         self.input_tokens = 0
         self.output_tokens = 0
 
     @abstractmethod
-    def completion(self, messages: list[Dict[str, str]], max_tokens: int = 100) -> str:
+    def completion(
+        self,
+        messages: list[Dict[str, str]],
+        max_tokens: int = 100,
+        timeout: Optional[float] = None,
+    ) -> str:
         """
         Generate a completion from the language model
         
         Args:
             messages (list[Dict[str, str]]): List of messages to generate completion from
             max_tokens (int): Maximum tokens to generate in the completion
+            timeout (float): Request timeout in seconds, defaults to the time left to the current pipeline stage
         
         Returns
             str: Completion generated from the language model
@@ -52,7 +150,13 @@ class LLMClient(ABC):
         pass
 
     @abstractmethod
-    def structured_completion(self, messages: list[Dict[str, str]], response_format: Type[BaseModel], max_tokens: int = 100) -> BaseModel:
+    def structured_completion(
+        self,
+        messages: list[Dict[str, str]],
+        response_format: Type[BaseModel],
+        max_tokens: int = 100,
+        timeout: Optional[float] = None,
+    ) -> BaseModel:
         """
         Generate a structured completion from the language model
 
@@ -60,6 +164,7 @@ class LLMClient(ABC):
             messages (list[Dict[str, str]]): List of messages to generate completion from
             response_format (Type[BaseModel]): Pydantic model to validate the response
             max_tokens (int): Maximum tokens to generate in the completion
+            timeout (float): Request timeout in seconds, defaults to the time left to the current pipeline stage
         Returns:
             BaseModel: Pydantic model of the completion generated from the language model
         """
@@ -74,6 +179,33 @@ class OpenAIClient(LLMClient):
     def __init__(self):
         super().__init__(OpenAI(api_key=os.environ.get("OPENAI_API_KEY")))
 
+    def _convert_to_openai_format(
+        self, messages: list[Dict[str, Any]]
+    ) -> list[Dict[str, Any]]:
+        """
+        Convert the Anthropic base64 image blocks of messages to OpenAI image_url blocks,
+        so calls built for Anthropic can fail over to OpenAI
+
+        Args:
+            messages (list[Dict[str, Any]]): List of messages, edited in place
+        Returns:
+            list[Dict[str, Any]]: The messages in OpenAI format
+        """
+        for message in messages:
+            if isinstance(message["content"], str):
+                continue
+            for i, part in enumerate(message["content"]):
+                if part.get("type") == "image" and part["source"]["type"] == "base64":
+                    source = part["source"]
+                    message["content"][i] = {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{source['media_type']};base64,{source['data']}"
+                        },
+                    }
+
+        return messages
+
     @handle_exceptions(default_return="")
     def completion(
         self,
@@ -81,7 +213,9 @@ class OpenAIClient(LLMClient):
         model: str = GPT_4o_MINI,
         max_tokens: int = 100,
         temperature: int = 1,
+        timeout: Optional[float] = None,
     ) -> str:
+        self._convert_to_openai_format(messages)
         messages.insert(0, {"role": DEVELOPER, "content": OUTPUT_LANGUAGE_PROMPT})
         messages.insert(1, {"role": DEVELOPER, "content": ANTHROPIC_SYSTEM_PROMPT})
 
@@ -90,9 +224,11 @@ class OpenAIClient(LLMClient):
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
+            timeout=_request_timeout(timeout, openai.NOT_GIVEN),
+        )
+        self._count_tokens(
+            model, response.usage.prompt_tokens, response.usage.completion_tokens
         )
-        self.input_token += response.usage.prompt_tokens
-        self.output_token += response.usage.completion_tokens
         return response.choices[0].message.content
 
     @handle_exceptions(default_return=None)
@@ -104,8 +240,10 @@ class OpenAIClient(LLMClient):
         max_tokens: int = 100,
         max_completion_tokens: int = None,
         temperature: int = 1,
+        timeout: Optional[float] = None,
     ) -> BaseModel:
         """ """
+        self._convert_to_openai_format(messages)
         messages.insert(0, {"role": DEVELOPER, "content": OUTPUT_LANGUAGE_PROMPT})
         messages.insert(1, {"role": DEVELOPER, "content": ANTHROPIC_SYSTEM_PROMPT})
 
@@ -116,10 +254,12 @@ class OpenAIClient(LLMClient):
             max_completion_tokens=max_completion_tokens,
             temperature=temperature,
             response_format=response_format,
+            timeout=_request_timeout(timeout, openai.NOT_GIVEN),
         )
 
-        self.input_token += response.usage.prompt_tokens
-        self.output_token += response.usage.completion_tokens
+        self._count_tokens(
+            model, response.usage.prompt_tokens, response.usage.completion_tokens
+        )
         return response.choices[0].message.parsed
 
 
@@ -149,20 +289,29 @@ class AnthropicClient(LLMClient):
 
 
     @handle_exceptions(default_return="")
-    def completion(self, messages: list[Dict[str, str]], max_tokens: int = 100, temperature=.9) -> str:
+    def completion(
+        self,
+        messages: list[Dict[str, str]],
+        model: str = SONNET_3_5,
+        max_tokens: int = 100,
+        temperature=0.9,
+        timeout: Optional[float] = None,
+    ) -> str:
         self._convert_to_anthropic_format(messages)
 
         messages.insert(0, {"role": USER, "content": OUTPUT_LANGUAGE_PROMPT})
         response = self.client.messages.create(
-            model=SONNET_3_5,
+            model=model,
             system=ANTHROPIC_SYSTEM_PROMPT,
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
+            timeout=_request_timeout(timeout, anthropic.NOT_GIVEN),
         )
 
-        self.input_token += response.usage.input_tokens
-        self.output_token += response.usage.output_tokens
+        self._count_tokens(
+            model, response.usage.input_tokens, response.usage.output_tokens
+        )
 
         return response.content[0].text
     
@@ -174,6 +323,7 @@ class AnthropicClient(LLMClient):
         model: str = SONNET_3_5,
         max_tokens: int = 1024,
         temperature: float = .9,
+        timeout: Optional[float] = None,
     ) -> BaseModel:
         messages = self._convert_to_anthropic_format(messages)
 
@@ -188,11 +338,13 @@ class AnthropicClient(LLMClient):
             messages=messages,
             max_tokens=max_tokens,
             system=ANTHROPIC_SYSTEM_PROMPT,
-            temperature=temperature
+            temperature=temperature,
+            timeout=_request_timeout(timeout, anthropic.NOT_GIVEN),
         )
 
-        self.input_token += response.usage.input_tokens
-        self.output_token += response.usage.output_tokens
+        self._count_tokens(
+            model, response.usage.input_tokens, response.usage.output_tokens
+        )
 
         # Parse the response into JSON and then into the Pydantic model
         try:
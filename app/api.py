@@ -1,7 +1,120 @@
 import json
+import logging
+import math
+import re
 
+from collections import Counter
 from dataclasses import dataclass
+from datetime import date, datetime
 from typing import Dict, List, Optional
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from .constants import KNOWN_APIS_PATH
+from .models import VisualizationType
+
+# Parameter groups that are filtered by relevance, all other groups are always kept
+VARIABLE_PARAMETER_GROUPS = ("hourly_parameters", "daily_parameters")
+MAX_RELEVANT_PARAMETERS = 10
+RELEVANCE_THRESHOLD = 0.4
+ENDPOINT_DESCRIPTION_WEIGHT = 0.3
+
+# URL query keys holding comma separated variables, mapped to the catalog group they are checked against
+VARIABLE_QUERY_KEYS = {
+    "hourly": "hourly_parameters",
+    "daily": "daily_parameters",
+    "current": "hourly_parameters",
+}
+COORDINATE_QUERY_KEYS = ("latitude", "longitude")
+COORDINATE_DECIMALS = 4
+
+STOP_WORDS = {
+    "a",
+    "an",
+    "and",
+    "at",
+    "by",
+    "for",
+    "from",
+    "in",
+    "is",
+    "it",
+    "of",
+    "on",
+    "or",
+    "the",
+    "to",
+    "with",
+    "data",
+    "chart",
+    "visualization",
+    "axis",
+    "line",
+    "lines",
+    "showing",
+    "show",
+    "over",
+    "between",
+    "each",
+    "per",
+    "e",
+    "g",
+    "x",
+    "y",
+}
+
+# Everyday words used in conversations mapped to the vocabulary of the API catalog
+QUERY_SYNONYMS = {
+    "heat": ["temperature"],
+    "hot": ["temperature"],
+    "hotter": ["temperature"],
+    "warm": ["temperature"],
+    "warmer": ["temperature"],
+    "warming": ["temperature"],
+    "cold": ["temperature"],
+    "colder": ["temperature"],
+    "mild": ["temperature"],
+    "milder": ["temperature"],
+    "summer": ["temperature"],
+    "winter": ["temperature"],
+    "pollution": ["pm10", "pm2_5", "particulate", "aqi", "nitrogen", "ozone"],
+    "polluted": ["pm10", "pm2_5", "particulate", "aqi"],
+    "smog": ["pm10", "pm2_5", "ozone"],
+    "rainfall": ["precipitation", "rain"],
+    "rainy": ["precipitation", "rain"],
+    "snow": ["snowfall"],
+    "windy": ["wind"],
+    "sunny": ["sunshine", "radiation", "uv"],
+    "sun": ["sunshine", "radiation", "uv"],
+    "humid": ["humidity"],
+    "drought": ["soil", "moisture", "precipitation", "evapotranspiration"],
+    "dry": ["soil", "moisture", "precipitation"],
+    "future": ["projection", "climate", "model"],
+    "projections": ["projection", "climate", "model"],
+    "allergy": ["pollen"],
+    "allergies": ["pollen"],
+}
+
+
+def _tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase tokens, ignoring stop words.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list[str]: The tokens
+    """
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in STOP_WORDS or len(token) < 2:
+            continue
+        tokens.append(token)
+        # Naive plural stemming so "temperatures" matches "temperature"
+        if len(token) > 3 and token.endswith("s"):
+            tokens.append(token[:-1])
+    return tokens
+
 
 @dataclass
 class Endpoint:
@@ -9,11 +122,85 @@ class Endpoint:
     url: str
     description: str
     parameters: Optional[Dict[str, str]] = None
+    # Spacing in degrees of the dataset grid, requested coordinates are snapped to it
+    grid_resolution: Optional[float] = None
 
     def __str__(self):
         return f"{self.url}: {self.description} \n Parameters: {self.parameters}"
 
 
+class CatalogIndex:
+    """TF-IDF index over the variable parameters of API endpoints"""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        self.documents: list[tuple[str, str, str]] = []
+        self.term_frequencies: list[Counter] = []
+
+        for endpoint in endpoints:
+            endpoint_terms = Counter(_tokenize(endpoint.description))
+            for group in VARIABLE_PARAMETER_GROUPS:
+                for name, description in (
+                    (endpoint.parameters or {}).get(group, {}).items()
+                ):
+                    terms = Counter({name: 1.0})
+                    terms.update(_tokenize(name.replace("_", " ")))
+                    terms.update(_tokenize(description))
+                    for term, count in endpoint_terms.items():
+                        terms[term] += count * ENDPOINT_DESCRIPTION_WEIGHT
+
+                    self.documents.append((endpoint.url, group, name))
+                    self.term_frequencies.append(terms)
+
+        document_frequencies = Counter(
+            term for terms in self.term_frequencies for term in terms
+        )
+        n_documents = len(self.documents)
+        self.idf = {
+            term: math.log((1 + n_documents) / (1 + frequency)) + 1
+            for term, frequency in document_frequencies.items()
+        }
+
+    def search(
+        self, query: str, limit: int = MAX_RELEVANT_PARAMETERS
+    ) -> list[tuple[str, str, str]]:
+        """
+        Find the parameters relevant to a query.
+
+        Args:
+            query (str): Free text query (topic of interest, visualization details...)
+            limit (int): Maximum number of parameters to return
+
+        Returns:
+            list[tuple[str, str, str]]: (endpoint url, parameter group, parameter name) of the matches
+        """
+        query_terms = Counter()
+        for token in _tokenize(query):
+            query_terms[token] += 1
+            for synonym in QUERY_SYNONYMS.get(token, []):
+                query_terms[synonym] += 1
+
+        scores = []
+        for document, terms in zip(self.documents, self.term_frequencies):
+            score = sum(
+                weight * terms[term] * self.idf.get(term, 0)
+                for term, weight in query_terms.items()
+                if term in terms
+            )
+            if score > 0:
+                scores.append((score, document))
+
+        if not scores:
+            return []
+
+        scores.sort(key=lambda item: item[0], reverse=True)
+        best_score = scores[0][0]
+        return [
+            document
+            for score, document in scores[:limit]
+            if score >= best_score * RELEVANCE_THRESHOLD
+        ]
+
+
 class API():
     """Represents an API with its endpoints"""
     name: str
@@ -22,20 +209,256 @@ class API():
     def __init__(self, name: str):
         self.name = name
         self.endpoints = []
+        self._index: Optional[CatalogIndex] = None
+        self._serialization_cache: dict[tuple, str] = {}
 
         if name == "OpenMeteo":
-            with open('known_apis.json', 'r') as file:
+            with open(KNOWN_APIS_PATH, "r") as file:
                 parameters = json.load(file)
             
             for endpoint in parameters:
                 self.endpoints.append(Endpoint(
                     url=endpoint['url'],
                     description=endpoint['description'],
-                    parameters=endpoint['parameters']
+                    parameters=endpoint['parameters'],
+                    grid_resolution=endpoint.get('grid_resolution'),
                 ))
 
     def __str__(self):
-        endpoint_str = "\n".join([str(endpoint) for endpoint in self.endpoints])
-        return f"{self.name} API \n Endpoints: {endpoint_str}"
+        return self._serialize(None)
+
+    @property
+    def index(self) -> CatalogIndex:
+        if self._index is None:
+            self._index = CatalogIndex(self.endpoints)
+        return self._index
+
+    def _serialize(self, selection: Optional[tuple]) -> str:
+        """
+        Serialize the catalog, restricted to a selection of variable parameters.
+
+        Args:
+            selection (tuple): Sorted (endpoint url, parameter group, parameter name) entries to keep, None keeps everything
+
+        Returns:
+            str: The serialized catalog
+        """
+        if selection in self._serialization_cache:
+            return self._serialization_cache[selection]
+
+        endpoints = self.endpoints
+        if selection is not None:
+            selected_urls = {url for url, _, _ in selection}
+            endpoints = []
+            for endpoint in self.endpoints:
+                if endpoint.url not in selected_urls:
+                    continue
+
+                parameters = {}
+                for group, values in (endpoint.parameters or {}).items():
+                    if group in VARIABLE_PARAMETER_GROUPS:
+                        values = {
+                            name: description
+                            for name, description in values.items()
+                            if (endpoint.url, group, name) in selection
+                        }
+                        if not values:
+                            continue
+                    parameters[group] = values
+
+                endpoints.append(
+                    Endpoint(
+                        url=endpoint.url,
+                        description=endpoint.description,
+                        parameters=parameters,
+                        grid_resolution=endpoint.grid_resolution,
+                    )
+                )
+
+        endpoint_str = "\n".join([str(endpoint) for endpoint in endpoints])
+        serialized = f"{self.name} API \n Endpoints: {endpoint_str}"
+        self._serialization_cache[selection] = serialized
+        return serialized
+
+    def relevant_catalog(
+        self,
+        topic_of_interest: str,
+        visualization_type: Optional[VisualizationType] = None,
+    ) -> str:
+        """
+        Serialize only the endpoints and parameters relevant to a visualization.
+        Required and optional parameters of the selected endpoints are always kept.
+        Falls back to the full catalog when nothing matches.
+
+        Args:
+            topic_of_interest (str): The topic of interest of the user
+            visualization_type (VisualizationType): The visualization details
+
+        Returns:
+            str: The serialized catalog
+        """
+        query = f"{topic_of_interest} {visualization_type or ''}"
+        matches = self.index.search(query)
+
+        if not matches:
+            return str(self)
+
+        return self._serialize(tuple(sorted(matches)))
+
+    def get_endpoint(self, url: str) -> Optional[Endpoint]:
+        """
+        Find the known endpoint serving an URL, ignoring its query string.
+
+        Args:
+            url (str): The URL to match
+
+        Returns:
+            Endpoint: The matching endpoint, None if unknown
+        """
+        parts = urlsplit(url.strip())
+        base_url = f"{parts.scheme}://{parts.netloc}{parts.path}".rstrip("/")
+        return next(
+            (endpoint for endpoint in self.endpoints if endpoint.url == base_url), None
+        )
+
+    def validate_url(self, url: str) -> str:
+        """
+        Validate an API URL against the known endpoints and return its canonical form.
+        The host and path must match a known endpoint, required parameters must be present and dates must be in order.
+        Variables missing from the catalog are dropped, the URL is only rejected when none is left.
+        The canonical URL has sorted parameters, sorted variables and coordinates snapped to the dataset grid,
+        so nearby coordinates served by the same grid cell share the same URL.
+
+        Args:
+            url (str): The URL to validate
+
+        Returns:
+            str: The canonical URL
+
+        Raises:
+            ValueError: If the URL is not valid for any known endpoint
+        """
+        endpoint = self.get_endpoint(url)
+        if endpoint is None:
+            raise ValueError(f"Unknown endpoint for URL {url}")
+
+        catalog = endpoint.parameters or {}
+        query = dict(parse_qsl(urlsplit(url.strip()).query, keep_blank_values=True))
+
+        missing = [
+            name
+            for name in catalog.get("required_parameters", {})
+            if not query.get(name)
+        ]
+        if missing:
+            raise ValueError(
+                f"Missing required parameters {missing} for {endpoint.url}"
+            )
+
+        for key, group in VARIABLE_QUERY_KEYS.items():
+            if key not in query:
+                continue
+
+            variables = sorted(
+                {
+                    variable.strip()
+                    for variable in query[key].split(",")
+                    if variable.strip()
+                }
+            )
+            known = [
+                variable for variable in variables if variable in catalog.get(group, {})
+            ]
+            if not known:
+                raise ValueError(
+                    f"Unknown {key} variables {variables or query[key]!r} for {endpoint.url}"
+                )
+            if len(known) < len(variables):
+                unknown = [variable for variable in variables if variable not in known]
+                logging.warning(
+                    f"Dropping unknown {key} variables {unknown} for {endpoint.url}"
+                )
+            query[key] = ",".join(known)
+
+        for key in COORDINATE_QUERY_KEYS:
+            if key in query:
+                query[key] = ",".join(
+                    _normalize_coordinate(value, key, endpoint.grid_resolution)
+                    for value in query[key].split(",")
+                )
+
+        _check_interval(query, "start_date", "end_date", date.fromisoformat)
+        _check_interval(query, "start_hour", "end_hour", datetime.fromisoformat)
+
+        return f"{endpoint.url}?{urlencode(sorted(query.items()), safe=',:/')}"
+
+
+def _normalize_coordinate(
+    value: str, name: str, grid_resolution: Optional[float] = None
+) -> str:
+    """
+    Normalize a latitude or longitude so equivalent coordinates produce the same string.
+
+    Args:
+        value (str): The coordinate as found in the URL
+        name (str): latitude or longitude
+        grid_resolution (float): Spacing in degrees of the dataset grid the coordinate is snapped to, None to keep it
+
+    Returns:
+        str: The normalized coordinate
+
+    Raises:
+        ValueError: If the coordinate isn't a number or is out of range
+    """
+    try:
+        coordinate = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name} {value!r}")
+
+    limit = 90 if name == "latitude" else 180
+    if not -limit <= coordinate <= limit:
+        raise ValueError(f"{name} {coordinate} out of range")
+
+    if grid_resolution:
+        coordinate = max(
+            -limit, min(limit, round(coordinate / grid_resolution) * grid_resolution)
+        )
+
+    normalized = (
+        f"{round(coordinate, COORDINATE_DECIMALS):.{COORDINATE_DECIMALS}f}".rstrip(
+            "0"
+        ).rstrip(".")
+    )
+    return "0" if normalized == "-0" else normalized
+
+
+def _check_interval(query: dict, start_key: str, end_key: str, parse) -> None:
+    """
+    Check that the start and end of a time interval are valid and in order.
+
+    Args:
+        query (dict): The URL query parameters
+        start_key (str): Key of the interval start
+        end_key (str): Key of the interval end
+        parse (Callable): Parser of the interval bounds
+
+    Raises:
+        ValueError: If a bound can't be parsed or the bounds are reversed
+    """
+    bounds = {}
+    for key in (start_key, end_key):
+        if key in query:
+            try:
+                bounds[key] = parse(query[key])
+            except ValueError:
+                raise ValueError(f"Invalid {key} {query[key]!r}")
+
+    if len(bounds) == 1:
+        raise ValueError(f"{start_key} and {end_key} must be provided together")
+    if bounds and bounds[start_key] > bounds[end_key]:
+        raise ValueError(
+            f"{start_key} {query[start_key]} is after {end_key} {query[end_key]}"
+        )
+
 
-OpenMeteoAPI = API("OpenMeteo")
\ No newline at end of file
+OpenMeteoAPI = API("OpenMeteo")
@@ -0,0 +1,362 @@
+import argparse
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from .constants import GPT_4o_MINI, BATCH_WORKERS, BATCH_OUTPUT_DIR, BATCH_POLL_INTERVAL
+from .context import PipelineContext
+from .main import (
+    build_classification_messages,
+    classify_visualization_need,
+    generate_visualization,
+)
+from .models import VisualizationNeed
+from .prompts import (
+    VISUALIZATION_NEED_PROMPT,
+    OUTPUT_LANGUAGE_PROMPT,
+    ANTHROPIC_SYSTEM_PROMPT,
+)
+from .ai import openai_client
+
+
+@dataclass
+class BatchItem:
+    """A message of the dataset to process"""
+
+    conversation_id: int
+    message_index: int
+    persona: str
+    message: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.conversation_id}-{self.message_index}"
+
+
+class BatchBackend(ABC):
+    """
+    Backend classifying the messages of a batch
+    """
+
+    @abstractmethod
+    def classify(self, items: list[BatchItem]) -> dict[str, VisualizationNeed]:
+        """
+        Classify the visualization need of messages.
+
+        Args:
+            items (list[BatchItem]): The messages to classify
+
+        Returns:
+            dict[str, VisualizationNeed]: Classification of each message by item key
+        """
+        pass
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Stand-in backend classifying messages concurrently, through the pre-classifier gate and regular requests
+    """
+
+    def __init__(self, workers: int = BATCH_WORKERS):
+        self.workers = workers
+
+    def classify(self, items: list[BatchItem]) -> dict[str, VisualizationNeed]:
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                item.key: executor.submit(classify_visualization_need, item.message)
+                for item in items
+            }
+
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logging.error(f"Error classifying {key}: {str(e)}")
+        return results
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Backend submitting all classifications as a single OpenAI batch job.
+    Batch jobs are cheaper than regular requests but complete asynchronously.
+    """
+
+    def __init__(
+        self,
+        model: str = GPT_4o_MINI,
+        poll_interval: float = BATCH_POLL_INTERVAL,
+        max_tokens: int = 20,
+    ):
+        self.model = model
+        self.poll_interval = poll_interval
+        self.max_tokens = max_tokens
+
+    def _build_request(self, item: BatchItem) -> dict:
+        messages = [
+            {"role": "developer", "content": OUTPUT_LANGUAGE_PROMPT},
+            {"role": "developer", "content": ANTHROPIC_SYSTEM_PROMPT},
+            *build_classification_messages(item.message, VISUALIZATION_NEED_PROMPT),
+        ]
+        return {
+            "custom_id": item.key,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": messages,
+                "max_tokens": self.max_tokens,
+                "temperature": 0.8,
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": VisualizationNeed.__name__,
+                        "schema": VisualizationNeed.model_json_schema(),
+                    },
+                },
+            },
+        }
+
+    def classify(self, items: list[BatchItem]) -> dict[str, VisualizationNeed]:
+        client = openai_client.client
+        payload = "\n".join(json.dumps(self._build_request(item)) for item in items)
+        batch_file = client.files.create(
+            file=("classification.jsonl", io.BytesIO(payload.encode("utf-8"))),
+            purpose="batch",
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logging.info(
+            f"Submitted classification batch {batch.id} with {len(items)} messages"
+        )
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.poll_interval)
+            batch = client.batches.retrieve(batch.id)
+
+        if batch.status != "completed" or batch.output_file_id is None:
+            raise ValueError(
+                f"Classification batch {batch.id} ended with status {batch.status}"
+            )
+
+        results = {}
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            record = json.loads(line)
+            try:
+                content = record["response"]["body"]["choices"][0]["message"]["content"]
+                results[record["custom_id"]] = VisualizationNeed.model_validate_json(
+                    content
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(
+                    f"Invalid batch result for {record.get('custom_id')}: {str(e)}"
+                )
+        return results
+
+
+BATCH_BACKENDS = {
+    "local": LocalBatchBackend,
+    "openai": OpenAIBatchBackend,
+}
+
+
+def process_item(item: BatchItem, topic_of_interest: str, output_dir: str) -> dict:
+    """
+    Generate and save the visualization of a message.
+    Module level so it can run in a process pool.
+
+    Args:
+        item (BatchItem): The message to process
+        topic_of_interest (str): The topic of interest found by the classification
+        output_dir (str): Directory where outputs are written
+
+    Returns:
+        dict: Metrics of the item
+    """
+    item_dir = os.path.join(output_dir, item.key)
+    os.makedirs(item_dir, exist_ok=True)
+
+    # Batch runs are offline, they are not bound by the request deadline but are sampled for profiling
+    context = PipelineContext.with_timeout(None)
+    start = time.perf_counter()
+    fig, description = generate_visualization(
+        item.message, item.persona, topic_of_interest, context
+    )
+    generation_time = time.perf_counter() - start
+
+    with open(os.path.join(item_dir, "figure.json"), "w") as file:
+        file.write(fig.to_json())
+    png = fig.to_image(format="png", engine="kaleido", width=800)
+    with open(os.path.join(item_dir, "figure.png"), "wb") as file:
+        file.write(png)
+    with open(os.path.join(item_dir, "explanation.md"), "w") as file:
+        file.write(description)
+
+    return {
+        "generation_time": generation_time,
+        "total_time": time.perf_counter() - start,
+        "png_bytes": len(png),
+        "stage_timings": context.stage_timings,
+        "degradations": context.degradations,
+        "metrics": context.metrics,
+        "profile": context.profiler.path if context.profiler is not None else None,
+    }
+
+
+class BatchRunner:
+    """
+    Process every message of a conversation dataset shaped like mock.json.
+    Progress is checkpointed after each item so interrupted runs resume where they stopped.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = BATCH_OUTPUT_DIR,
+        workers: int = BATCH_WORKERS,
+        executor: str = "thread",
+        backend: Optional[BatchBackend] = None,
+    ):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.executor = executor
+        self.backend = backend or LocalBatchBackend(workers)
+        self.checkpoint_path = os.path.join(output_dir, "checkpoint.json")
+        self._lock = threading.Lock()
+        self.checkpoint: dict[str, dict] = {}
+
+    def _load_checkpoint(self) -> None:
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as file:
+                self.checkpoint = json.load(file)
+
+    def _save(self, key: str, record: dict) -> None:
+        """Record the progress of an item and atomically rewrite the checkpoint"""
+        with self._lock:
+            self.checkpoint[key] = {**self.checkpoint.get(key, {}), **record}
+            temporary_path = f"{self.checkpoint_path}.tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(self.checkpoint, file, indent=2)
+            os.replace(temporary_path, self.checkpoint_path)
+
+            with open(os.path.join(self.output_dir, "metrics.jsonl"), "a") as file:
+                file.write(json.dumps({"key": key, **record}) + "\n")
+
+    def _create_executor(self) -> Executor:
+        if self.executor == "process":
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def run(self, dataset_path: str) -> dict[str, dict]:
+        """
+        Process a dataset.
+
+        Args:
+            dataset_path (str): Path of the conversation dataset
+
+        Returns:
+            dict[str, dict]: Checkpoint record of every item
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._load_checkpoint()
+
+        with open(dataset_path, "r") as file:
+            conversations = json.load(file)
+
+        items = [
+            BatchItem(
+                conversation["conversation_id"],
+                index,
+                message["persona"],
+                message["message"],
+            )
+            for conversation in conversations
+            for index, message in enumerate(conversation["messages"])
+        ]
+
+        # Classify every message not classified by a previous run in a single backend batch
+        unclassified = [
+            item
+            for item in items
+            if "need_visualization" not in self.checkpoint.get(item.key, {})
+        ]
+        if unclassified:
+            classifications = self.backend.classify(unclassified)
+            for item in unclassified:
+                viz_need = classifications.get(item.key)
+                if viz_need is not None:
+                    self._save(
+                        item.key,
+                        {
+                            "need_visualization": viz_need.need_visualization,
+                            "topic_of_interest": viz_need.topic_of_interest,
+                        },
+                    )
+
+        pending = [
+            item
+            for item in items
+            if self.checkpoint.get(item.key, {}).get("need_visualization")
+            and self.checkpoint[item.key].get("status") != "done"
+        ]
+        logging.info(
+            f"{len(pending)} visualizations to generate out of {len(items)} messages"
+        )
+
+        with self._create_executor() as executor:
+            futures = {
+                executor.submit(
+                    process_item,
+                    item,
+                    self.checkpoint[item.key]["topic_of_interest"],
+                    self.output_dir,
+                ): item
+                for item in pending
+            }
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    self._save(
+                        item.key, {"status": "done", **asdict(item), **future.result()}
+                    )
+                except Exception as e:
+                    logging.error(
+                        f"Error processing {item.key}: {str(e)}", exc_info=True
+                    )
+                    self._save(item.key, {"status": "failed", "error": str(e)})
+
+        return self.checkpoint
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Regenerate the visualizations of a conversation dataset"
+    )
+    parser.add_argument("--dataset", default="mock.json")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--backend", choices=list(BATCH_BACKENDS), default="local")
+    args = parser.parse_args()
+
+    backend = (
+        BATCH_BACKENDS[args.backend]()
+        if args.backend != "local"
+        else LocalBatchBackend(args.workers)
+    )
+    BatchRunner(args.output_dir, args.workers, args.executor, backend).run(args.dataset)
@@ -1,3 +1,8 @@
+import os
+
+# Data files are resolved against the repository root, so the app runs from any working directory
+DATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 ## Output Types
 VISUALIZATION = "visualization"
 TEXT = "text"
@@ -6,6 +11,7 @@ TEXT = "text"
 GPT_4o_MINI = "gpt-4o-mini"
 GPT_4o = "gpt-4o"
 SONNET_3_5 = "claude-3-5-sonnet-latest"
+HAIKU_3_5 = "claude-3-5-haiku-latest"
 
 ## LLM Options
 DEVELOPER = "developer"
@@ -13,4 +19,225 @@ USER = "user"
 ASSISTANT = "assistant"
 
 ## External APIs
-OPEN_METEO_DATA_TYPES = ["Current", "Daily", "Hourly", "Minutely15", "SixHourly"]
\ No newline at end of file
+OPEN_METEO_DATA_TYPES = ["Current", "Daily", "Hourly", "Minutely15", "SixHourly"]
+OPEN_METEO_CACHE_SIZE = 256
+OPEN_METEO_CACHE_TTL = 6 * 3600  # seconds
+OPEN_METEO_TIMEOUT = 30  # seconds
+# Call limits of the free API as (window in seconds, weighted calls), a request counts as several calls
+# beyond 10 variables or 2 weeks of data, per location
+OPEN_METEO_LIMITS = {
+    "minute": (60, 600),
+    "hour": (3600, 5000),
+    "day": (86400, 10000),
+}
+OPEN_METEO_QUOTA_MAX_WAIT = (
+    30  # seconds a request may wait for budget, beyond: rejected
+)
+OPEN_METEO_RETRY_AFTER = (
+    60  # seconds without requests after a 429 without Retry-After header
+)
+
+## Server
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_MAX_WORKERS = 4
+SERVER_MAX_PENDING_JOBS = 16
+SERVER_JOB_HISTORY = 256
+
+## Streaming
+STREAM_DEBOUNCE_SECONDS = 1.5
+STREAM_CONTEXT_MESSAGES = 6
+
+## Batch
+BATCH_WORKERS = 4
+BATCH_OUTPUT_DIR = "batch_output"
+BATCH_POLL_INTERVAL = 30  # seconds
+
+## Pre-classifier gate
+GATE_ENABLED = False  # the default weights are untrained, enable it with a model trained on labeled conversations
+GATE_NEGATIVE_THRESHOLD = 0.1  # below: no visualization, decided locally
+GATE_POSITIVE_THRESHOLD = 0.95  # above: visualization, decided locally
+GATE_MODEL_PATH = os.path.join(DATA_DIR, "gate_model.json")
+
+## Speculative execution
+SPECULATIVE_EXECUTION = False
+SPECULATION_MIN_SCORE = 0.3  # pre-classifier probability needed to speculate
+SPECULATION_MAX_WASTED_CALLS = 20  # wasted LLM calls allowed per window
+SPECULATION_WINDOW = 600  # seconds
+
+## Latency budgets
+REQUEST_DEADLINE_SECONDS = 90
+# Relative weight of each stage in the end-to-end deadline, in pipeline order.
+# Time left over by a fast stage is shared by the following ones.
+STAGE_BUDGETS = {
+    "complexity": 0.05,
+    "refine": 0.15,  # follow-ups of a conversation, replaces the three next stages
+    "visualization_type": 0.1,
+    "needed_data": 0.1,
+    "data_retrieval": 0.1,
+    "fetch": 0.15,
+    "codegen": 0.3,
+    "explanation": 0.2,
+}
+EXPLANATION_PLAN_MIN_SECONDS = 15  # below: the explanation plan call is skipped
+EXPLANATION_FULL_TOKENS_MIN_SECONDS = (
+    8  # below: the explanation is generated with fewer tokens
+)
+EXPLANATION_MAX_TOKENS = 300
+EXPLANATION_REDUCED_MAX_TOKENS = 150
+
+## Explanation
+# two_call: plan then explanation, both with the figure image
+# single_call: plan and explanation in one call with the figure image
+# trace_summary: plan and explanation in one call with a textual summary of the figure instead of the image
+EXPLANATION_TWO_CALL = "two_call"
+EXPLANATION_SINGLE_CALL = "single_call"
+EXPLANATION_TRACE_SUMMARY = "trace_summary"
+EXPLANATION_MODE = EXPLANATION_SINGLE_CALL
+EXPLANATION_SINGLE_CALL_MAX_TOKENS = 600  # plan and explanation
+EXPLANATION_CACHE_SIZE = 256  # explanations cached per figure and audience level
+EXPLANATION_CACHE_TTL = 3600  # seconds
+
+## LLM routing
+LLM_MAX_RETRIES = 2  # retries of transient errors per provider
+LLM_BACKOFF_BASE = 0.5  # seconds
+LLM_BACKOFF_MAX = 8  # seconds
+LLM_HEDGE_PERCENTILE = 95  # latency percentile after which a hedged request is sent
+LLM_HEDGE_MIN_SAMPLES = 20  # latencies needed before the percentile is trusted
+LLM_HEDGE_DEFAULT_DELAY = (
+    3  # seconds, hedging delay until enough latencies are recorded
+)
+LLM_LATENCY_WINDOW = 200  # latencies kept per provider and call type
+# Minimum output tokens of a structured answer: per field of the response schema, on top of its JSON keys,
+# and for Anthropic models which write the JSON as text
+STRUCTURED_OUTPUT_FIELD_TOKENS = 24
+STRUCTURED_OUTPUT_TEXT_TOKENS = 16
+
+## Model routing
+# Price in dollars per million input and output tokens
+MODEL_PRICES = {
+    GPT_4o_MINI: (0.15, 0.6),
+    GPT_4o: (2.5, 10),
+    HAIKU_3_5: (0.8, 4),
+    SONNET_3_5: (3, 15),
+}
+# Context window and maximum output tokens of each model
+MODEL_LIMITS = {
+    GPT_4o_MINI: (128_000, 16_384),
+    GPT_4o: (128_000, 16_384),
+    HAIKU_3_5: (200_000, 8_192),
+    SONNET_3_5: (200_000, 8_192),
+}
+# Candidate models of each pipeline stage, in order of preference.
+# A model is skipped when its estimated cost is above max_cost (dollars per call),
+# its recent latency above max_latency (seconds) or its recent success rate too low.
+# Models whose context window can't hold the call are left out.
+# Overridden by the stages of ROUTING_TABLE_PATH when the file exists.
+ROUTING_TABLE_PATH = os.path.join(DATA_DIR, "routing_table.json")
+DEFAULT_ROUTING_TABLE = {
+    "classification": {
+        "models": [GPT_4o_MINI, HAIKU_3_5],
+        "max_cost": 0.002,
+        "max_latency": 3,
+    },
+    "visualization_type": {
+        "models": [SONNET_3_5, HAIKU_3_5],
+        "max_cost": 0.03,
+        "max_latency": 15,
+    },
+    "needed_data": {
+        "models": [HAIKU_3_5, SONNET_3_5],
+        "max_cost": 0.03,
+        "max_latency": 15,
+    },
+    "data_retrieval": {
+        "models": [HAIKU_3_5, SONNET_3_5],
+        "max_cost": 0.03,
+        "max_latency": 15,
+    },
+    "refine": {"models": [SONNET_3_5, HAIKU_3_5], "max_cost": 0.04, "max_latency": 20},
+    "processing": {
+        "models": [SONNET_3_5, HAIKU_3_5],
+        "max_cost": 0.05,
+        "max_latency": 30,
+    },
+    "codegen": {"models": [SONNET_3_5, HAIKU_3_5], "max_cost": 0.08, "max_latency": 40},
+    "explanation": {
+        "models": [SONNET_3_5, GPT_4o],
+        "max_cost": 0.05,
+        "max_latency": 20,
+    },
+}
+MODEL_ROUTER_WINDOW = 50  # calls kept per stage and model
+MODEL_ROUTER_MAX_AGE = (
+    300  # seconds, older calls are ignored so demoted models get tried again
+)
+MODEL_ROUTER_MIN_SAMPLES = 5  # calls needed before latency and success rate are used
+MODEL_ROUTER_MIN_SUCCESS_RATE = 0.8
+
+## Rendering
+LLM_RENDER_PROFILE = (
+    "webp"  # profile of the figures sent to vision models, see app/render.py
+)
+
+## Places
+PLACES_PATH = os.path.join(DATA_DIR, "places.json")
+KNOWN_APIS_PATH = os.path.join(DATA_DIR, "known_apis.json")
+DEFAULT_LOCATION = "Nagoya"  # used when the request doesn't mention any location
+PLACE_MATCH_RADIUS_KM = (
+    25  # coordinates closer than this to a known place are replaced by the place's
+)
+
+## Conversation sessions
+SESSION_MAX_COUNT = 200  # conversations kept in memory
+SESSION_TTL = 1800  # seconds of inactivity after which a conversation's data is dropped
+SESSION_MAX_DATA_ENTRIES = (
+    12  # fetched locations kept per conversation, the oldest are dropped first
+)
+REFINE_MAX_TOKENS = 1000
+
+## Warm-up
+# Series prefetched at service start and then periodically, for every location.
+# A series covers the last "years" (from January 1st) or "days", up to "lag_days" ago,
+# unless its parameters set the dates. Overridden by the keys of WARMUP_CONFIG_PATH when the file exists.
+WARMUP_CONFIG_PATH = os.path.join(DATA_DIR, "warmup.json")
+DEFAULT_WARMUP_CONFIG = {
+    "enabled": True,
+    "interval": 24 * 3600,  # seconds
+    "locations": [DEFAULT_LOCATION],
+    "series": [
+        {
+            "url": "https://archive-api.open-meteo.com/v1/archive",
+            "parameters": {
+                "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum"
+            },
+            "years": 20,
+            "lag_days": 2,
+        },
+        {
+            "url": "https://air-quality-api.open-meteo.com/v1/air-quality",
+            "parameters": {"hourly": "pm2_5,pm10"},
+            "days": 92,
+            "lag_days": 1,
+        },
+        {
+            "url": "https://climate-api.open-meteo.com/v1/climate",
+            "parameters": {
+                "daily": "temperature_2m_mean,precipitation_sum",
+                "models": "MRI_AGCM3_2_S",
+                "start_date": "2030-01-01",
+                "end_date": "2049-12-31",
+            },
+        },
+    ],
+    # Render the template figures of the prefetched series, so the renderer and rollups are warm
+    "render_templates": False,
+    # Share of every API window (minute, hour, day) the warm-up leaves to user requests
+    "reserved_share": 0.5,
+    "max_wait": 120,  # seconds a prefetch may wait for API budget
+}
+
+## Profiling
+# Share of the requests profiled, requests can also ask for a profile explicitly. Profiling slows a run down.
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_OUTPUT_DIR = os.path.join(DATA_DIR, "profiles")
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from .constants import STAGE_BUDGETS
+from .profiling import PipelineProfiler
+
+# Absolute deadline (time.monotonic) of the stage running in the current thread
+_stage_deadline: ContextVar[Optional[float]] = ContextVar(
+    "stage_deadline", default=None
+)
+
+
+def current_timeout() -> Optional[float]:
+    """
+    Get the time left to the stage running in the current thread, for LLM and HTTP calls.
+
+    Returns:
+        float: Seconds left, None when the stage has no deadline
+    """
+    deadline = _stage_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.001)
+
+
+class PipelineCancelled(BaseException):
+    """
+    Raised inside a pipeline when its run has been cancelled.
+    Like asyncio.CancelledError it derives from BaseException,
+    so the generic exception handlers of the stages don't swallow it.
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a pipeline stage starts after the end-to-end deadline"""
+
+
+@dataclass
+class PipelineContext:
+    """State shared by the stages of a single pipeline run"""
+
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    stage_timings: dict[str, float] = field(default_factory=dict)
+    deadline: Optional[float] = None
+    degradations: list[str] = field(default_factory=list)
+    metrics: dict[str, float] = field(default_factory=dict)
+    # Stages may record metrics from several threads, e.g. the explanations of several audiences
+    _metrics_lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+    # Set when the stages of the run are profiled
+    profiler: Optional[PipelineProfiler] = None
+
+    @classmethod
+    def with_timeout(
+        cls,
+        seconds: Optional[float],
+        start: Optional[float] = None,
+        profile: Optional[bool] = None,
+    ) -> "PipelineContext":
+        """
+        Create a context whose run must end within a number of seconds.
+
+        Args:
+            seconds (float): End-to-end time budget, None for no deadline
+            start (float): time.monotonic() when the budget started, defaults to now
+            profile (bool): True to profile the stages of the run, False not to, None to sample it at PROFILING_SAMPLE_RATE
+
+        Returns:
+            PipelineContext: The context
+        """
+        profiler = PipelineProfiler.sample(profile)
+        if seconds is None:
+            return cls(profiler=profiler)
+        return cls(
+            deadline=(time.monotonic() if start is None else start) + seconds,
+            profiler=profiler,
+        )
+
+    def cancel(self) -> None:
+        """Request the cancellation of the run, effective at the next stage boundary"""
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def check(self) -> None:
+        """
+        Raises:
+            PipelineCancelled: If the run has been cancelled
+        """
+        if self.cancelled:
+            raise PipelineCancelled()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns:
+            float: Seconds left before the end-to-end deadline, None without deadline
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def degrade(self, degradation: str) -> None:
+        """
+        Record a fallback taken to stay within the deadline.
+
+        Args:
+            degradation (str): Name of the fallback
+        """
+        logging.warning(f"Degraded pipeline run: {degradation}")
+        self.degradations.append(degradation)
+
+    def add_metric(self, name: str, value: float) -> None:
+        """
+        Add to a metric of the run, e.g. the estimated tokens of the images sent.
+
+        Args:
+            name (str): Name of the metric
+            value (float): Value added to the metric
+        """
+        with self._metrics_lock:
+            self.metrics[name] = self.metrics.get(name, 0) + value
+
+    def _stage_share(self, name: str) -> float:
+        """Share of the remaining time given to a stage, relative to the stages that haven't run yet"""
+        if name not in STAGE_BUDGETS:
+            return 1.0
+
+        stages = list(STAGE_BUDGETS)
+        upcoming = [
+            stage
+            for stage in stages[stages.index(name) :]
+            if stage not in self.stage_timings
+        ]
+        return STAGE_BUDGETS[name] / sum(STAGE_BUDGETS[stage] for stage in upcoming)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Run a pipeline stage, checking for cancellation and the deadline before it starts,
+        bounding the calls it makes by its share of the remaining time and recording its duration.
+        The stage is profiled when the run has a profiler.
+
+        Args:
+            name (str): Name of the stage
+
+        Raises:
+            PipelineCancelled: If the run has been cancelled
+            DeadlineExceeded: If no time is left for the stage
+        """
+        self.check()
+
+        stage_deadline = None
+        remaining = self.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline exceeded before stage {name}")
+            stage_deadline = time.monotonic() + remaining * self._stage_share(name)
+
+        token = _stage_deadline.set(stage_deadline)
+        start = time.perf_counter()
+        try:
+            with (
+                self.profiler.stage(name)
+                if self.profiler is not None
+                else nullcontext()
+            ):
+                yield
+        finally:
+            _stage_deadline.reset(token)
+            self.stage_timings[name] = time.perf_counter() - start
@@ -0,0 +1,306 @@
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+from .gazetteer import load_gazetteer
+from .models import ROLLUP_RESOLUTIONS, NormalizedOpenMeteoData, _time_indexed
+from .stats import numeric_columns
+
+DATASET_RESOLUTIONS = ("hourly",) + ROLLUP_RESOLUTIONS
+
+
+def location_name(entry: NormalizedOpenMeteoData) -> str:
+    """Name of the place closest to the coordinates of the data, or the coordinates themselves"""
+    metadata = (
+        entry.metadata.iloc[0]
+        if entry.metadata is not None and not entry.metadata.empty
+        else {}
+    )
+    if "latitude" in metadata and "longitude" in metadata:
+        # The API returns the coordinates of the grid cell, a few km away from the requested place at most
+        place = load_gazetteer().nearest(metadata["latitude"], metadata["longitude"])
+        if place is not None:
+            return place.name
+        return f"{metadata['latitude']:.2f}°, {metadata['longitude']:.2f}°"
+    return "location"
+
+
+def _grid_cell(entry: NormalizedOpenMeteoData) -> Optional[tuple[float, float]]:
+    """Coordinates of the grid cell of the data returned by the API, None when unknown"""
+    metadata = (
+        entry.metadata.iloc[0]
+        if entry.metadata is not None and not entry.metadata.empty
+        else {}
+    )
+    if "latitude" in metadata and "longitude" in metadata:
+        return round(float(metadata["latitude"]), 4), round(
+            float(metadata["longitude"]), 4
+        )
+    return None
+
+
+def _location_names(entries: list[NormalizedOpenMeteoData]) -> list[str]:
+    """Names of the locations of the entries, with their coordinates when several grid cells resolve to one place"""
+    names = [location_name(entry) for entry in entries]
+    cells = [_grid_cell(entry) for entry in entries]
+    cells_per_name: dict[str, set] = {}
+    for name, cell in zip(names, cells):
+        cells_per_name.setdefault(name, set()).add(cell)
+    return [
+        (
+            f"{name} ({cell[0]:.2f}°, {cell[1]:.2f}°)"
+            if len(cells_per_name[name]) > 1 and cell is not None
+            else name
+        )
+        for name, cell in zip(names, cells)
+    ]
+
+
+def endpoint_name(url: str) -> str:
+    """Short name of the Open-Meteo endpoint of a URL, e.g. archive or air-quality"""
+    return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1] or urlparse(url).netloc
+
+
+class OpenMeteoDataset(list):
+    """
+    The fetched data of a visualization, one NormalizedOpenMeteoData per location and endpoint.
+    It is a list of the entries, so code indexing the entries keeps working, and also provides
+    every entry in a single frame indexed by (location, endpoint, time) for comparisons across locations.
+
+    The frame of a resolution is built once: the values of every entry are written into one preallocated
+    float array, without concatenating intermediate frames, and view() returns a per-entry frame sharing that array.
+    The dataset is read-only, as editing its entries would leave the locations, endpoints and frames stale.
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[NormalizedOpenMeteoData] = (),
+        endpoints: Optional[list[str]] = None,
+    ):
+        super().__init__(entries)
+        self.endpoints = (
+            list(endpoints) if endpoints is not None else ["data"] * len(self)
+        )
+        if len(self.endpoints) != len(self):
+            raise ValueError(
+                f"Expected {len(self)} endpoints, got {len(self.endpoints)}"
+            )
+        self.locations = _location_names(list(self))
+        # Per resolution and baseline: the frame, and the row range of each entry in it
+        self._frames: dict[tuple, tuple[pd.DataFrame, list[tuple[int, int]]]] = {}
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(
+            "OpenMeteoDataset is read-only, build a new dataset or edit list(dataset) instead"
+        )
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+    def __reduce__(self):
+        # list subclasses are copied and pickled by appending their items, which is blocked
+        return type(self), (list(self), self.endpoints)
+
+    @classmethod
+    def from_sources(
+        cls, sources: Iterable[tuple[str, NormalizedOpenMeteoData]]
+    ) -> "OpenMeteoDataset":
+        """
+        Build a dataset from fetched entries.
+        Entries of the same grid cell and endpoint, e.g. variables fetched by separate requests, are merged into one.
+
+        Args:
+            sources (Iterable[tuple[str, NormalizedOpenMeteoData]]): The URL and data of each entry
+
+        Returns:
+            OpenMeteoDataset: The dataset, one entry per location and endpoint in order of first appearance
+        """
+        groups: dict[tuple, list[NormalizedOpenMeteoData]] = {}
+        for url, data in sources:
+            cell = _grid_cell(data)
+            groups.setdefault(
+                (cell if cell is not None else id(data), endpoint_name(url)), []
+            ).append(data)
+        return cls(
+            [NormalizedOpenMeteoData.merge(entries) for entries in groups.values()],
+            [endpoint for _, endpoint in groups],
+        )
+
+    def _series(
+        self,
+        entry: NormalizedOpenMeteoData,
+        resolution: str,
+        baseline: Optional[tuple[int, int]],
+    ) -> pd.DataFrame:
+        """Numeric series of an entry, indexed by time (or month for the climatology)"""
+        if resolution == "hourly":
+            return _time_indexed(entry.hourly_data)
+        return entry._rollup(resolution, baseline)
+
+    def _build(
+        self, resolution: str, baseline: Optional[tuple[int, int]]
+    ) -> tuple[pd.DataFrame, list[tuple[int, int]]]:
+        series = [self._series(entry, resolution, baseline) for entry in self]
+        columns = list(
+            dict.fromkeys(
+                column for frame in series for column in numeric_columns(frame)
+            )
+        )
+        lengths = [len(frame) for frame in series]
+        index_name = "month" if resolution == "climatology" else "time"
+
+        values = np.full((sum(lengths), len(columns)), np.nan)
+        times = np.empty(
+            sum(lengths),
+            dtype=np.int64 if resolution == "climatology" else "datetime64[ns]",
+        )
+        ranges = []
+        start = 0
+        for frame, length in zip(series, lengths):
+            stop = start + length
+            ranges.append((start, stop))
+            if length:
+                times[start:stop] = frame.index.to_numpy()
+                for column in numeric_columns(frame):
+                    values[start:stop, columns.index(column)] = frame[column].to_numpy(
+                        dtype=float, na_value=np.nan
+                    )
+            start = stop
+
+        entry_codes = np.repeat(np.arange(len(self)), lengths)
+        index = pd.MultiIndex.from_arrays(
+            [
+                (
+                    pd.Categorical(np.asarray(self.locations)[entry_codes])
+                    if len(self)
+                    else pd.Categorical([])
+                ),
+                (
+                    pd.Categorical(np.asarray(self.endpoints)[entry_codes])
+                    if len(self)
+                    else pd.Categorical([])
+                ),
+                times,
+            ],
+            names=["location", "endpoint", index_name],
+        )
+        return pd.DataFrame(values, index=index, columns=columns, copy=False), ranges
+
+    def _frame(
+        self, resolution: str, baseline: Optional[tuple[int, int]]
+    ) -> tuple[pd.DataFrame, list[tuple[int, int]]]:
+        if resolution not in DATASET_RESOLUTIONS:
+            raise ValueError(
+                f"Invalid dataset resolution {resolution}, expected one of {DATASET_RESOLUTIONS}"
+            )
+
+        key = (resolution, tuple(baseline) if baseline is not None else None)
+        if key not in self._frames:
+            self._frames[key] = self._build(resolution, baseline)
+        return self._frames[key]
+
+    def frame(
+        self, resolution: str = "daily", baseline: Optional[tuple[int, int]] = None
+    ) -> pd.DataFrame:
+        """
+        Get every entry in a single frame, indexed by (location, endpoint, time), one column per variable.
+        Variables missing from an entry are NaN. Computed once per resolution, don't modify it in place.
+
+        Args:
+            resolution (str): hourly for the raw hourly series, or one of the rollup resolutions of NormalizedOpenMeteoData
+            baseline (tuple[int, int]): First and last years of the climatology period, defaults to the whole series
+
+        Returns:
+            pd.DataFrame: The frame, its last index level is month instead of time for the climatology
+        """
+        return self._frame(resolution, baseline)[0]
+
+    def long(
+        self, resolution: str = "daily", baseline: Optional[tuple[int, int]] = None
+    ) -> pd.DataFrame:
+        """
+        Get every entry in long format, one row per location, endpoint, time and variable, missing values dropped.
+
+        Returns:
+            pd.DataFrame: Columns location, endpoint, time (or month), variable and value
+        """
+        return (
+            self.frame(resolution, baseline)
+            .rename_axis(columns="variable")
+            .stack()
+            .rename("value")
+            .reset_index()
+        )
+
+    def view(
+        self,
+        location: str,
+        resolution: str = "daily",
+        endpoint: Optional[str] = None,
+        baseline: Optional[tuple[int, int]] = None,
+    ) -> pd.DataFrame:
+        """
+        Get the data of a location, indexed by time, without copying it out of the dataset frame.
+
+        Args:
+            location (str): Name of the location, as in locations
+            resolution (str): Resolution of the data, as in frame()
+            endpoint (str): Endpoint of the data, needed when the location has data from several endpoints
+            baseline (tuple[int, int]): First and last years of the climatology period
+
+        Returns:
+            pd.DataFrame: A view of the rows of the location, don't modify it in place
+
+        Raises:
+            KeyError: If no entry has data for the location and endpoint
+            ValueError: If the location has data from several endpoints and none is given
+        """
+        matches = [
+            i
+            for i, (name, entry_endpoint) in enumerate(
+                zip(self.locations, self.endpoints)
+            )
+            if name == location and (endpoint is None or entry_endpoint == endpoint)
+        ]
+        if not matches:
+            raise KeyError(
+                f"No data for {location}{f' from {endpoint}' if endpoint else ''}, available: {self.keys()}"
+            )
+        if len(matches) > 1:
+            raise ValueError(
+                f"{location} has data from several endpoints, choose one of {[self.endpoints[i] for i in matches]}"
+            )
+
+        frame, ranges = self._frame(resolution, baseline)
+        start, stop = ranges[matches[0]]
+        values = frame.to_numpy()[start:stop]
+        index = pd.Index(
+            frame.index.get_level_values(-1)[start:stop], name=frame.index.names[-1]
+        )
+        return pd.DataFrame(values, index=index, columns=frame.columns, copy=False)
+
+    def keys(self) -> list[tuple[str, str]]:
+        """(location, endpoint) of each entry, in order"""
+        return list(zip(self.locations, self.endpoints))
+
+    def generate_data_preview(self) -> str:
+        """
+        Generate the preview of every entry for code generation prompts, labelled with its location and endpoint.
+
+        Returns:
+            str: The formatted preview
+        """
+        previews = [
+            f"data[{i}] ({location}, {endpoint})\n{entry.generate_data_preview()}"
+            for i, (entry, location, endpoint) in enumerate(
+                zip(self, self.locations, self.endpoints)
+            )
+        ]
+        if len(self) > 1:
+            previews.append(
+                f"data.frame(): {len(set(self.locations))} locations {sorted(set(self.locations))}, "
+                f"endpoints {sorted(set(self.endpoints))}"
+            )
+        return "\n\n".join(previews)
@@ -0,0 +1,411 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+
+from typing import Optional
+
+import numpy as np
+
+from .constants import GATE_NEGATIVE_THRESHOLD, GATE_POSITIVE_THRESHOLD, GATE_MODEL_PATH
+from .models import VisualizationNeed
+
+# Climate vocabulary mapped to the topic of interest reported for local positive decisions
+TOPIC_KEYWORDS = {
+    "temperature trends": [
+        "heat",
+        "hot",
+        "hotter",
+        "warm",
+        "warmer",
+        "warming",
+        "cold",
+        "colder",
+        "temperature",
+        "temperatures",
+        "summer",
+        "summers",
+        "winter",
+        "winters",
+        "milder",
+        "heatwave",
+        "heatwaves",
+    ],
+    "air quality": [
+        "pollution",
+        "polluted",
+        "air quality",
+        "smog",
+        "pm2.5",
+        "pm10",
+        "ozone",
+        "emissions",
+        "aqi",
+    ],
+    "precipitation": [
+        "rain",
+        "rainfall",
+        "precipitation",
+        "flood",
+        "flooding",
+        "floods",
+        "drought",
+        "snow",
+        "snowfall",
+    ],
+    "wind": ["wind", "windy", "typhoon", "typhoons", "storm", "storms"],
+    "humidity": ["humid", "humidity"],
+}
+DATA_INTENT_KEYWORDS = [
+    "data",
+    "see",
+    "seeing",
+    "show",
+    "showing",
+    "chart",
+    "graph",
+    "map",
+    "plot",
+    "visualize",
+    "compare",
+    "comparing",
+    "comparison",
+    "trend",
+    "trends",
+    "levels",
+    "patterns",
+    "statistics",
+    "numbers",
+    "measure",
+    "measured",
+]
+CURIOSITY_PATTERNS = [
+    r"\bi wonder\b",
+    r"\bis that true\b",
+    r"\bhow much\b",
+    r"\bwould be (interesting|great|nice)\b",
+    r"\bwould (really )?help\b",
+    r"\bany data\b",
+    r"\bis there\b",
+    r"\bare there\b",
+    r"\bhave .* changed\b",
+]
+TEMPORAL_KEYWORDS = [
+    "year",
+    "years",
+    "yearly",
+    "decade",
+    "decades",
+    "ago",
+    "lately",
+    "recently",
+    "changed",
+    "change",
+    "changes",
+    "getting",
+    "every",
+    "more often",
+    "over time",
+    "trend",
+    "worse",
+    "better",
+    "fewer",
+    "increase",
+]
+SMALL_TALK_KEYWORDS = [
+    "hi",
+    "hello",
+    "hey",
+    "thanks",
+    "thank you",
+    "ok",
+    "okay",
+    "lol",
+    "bye",
+    "good morning",
+    "good night",
+    "see you",
+    "sure",
+    "exactly",
+    "agreed",
+    "possibly",
+    "possible",
+    "true",
+]
+
+HASHED_FEATURES = 256
+HAND_CRAFTED_FEATURES = [
+    "bias",
+    "climate",
+    "data_intent",
+    "curiosity",
+    "temporal",
+    "question",
+    "small_talk",
+    "length",
+]
+
+# Weights used until a model is trained on labeled conversations
+DEFAULT_WEIGHTS = {
+    "bias": -4.0,
+    "climate": 1.2,
+    "data_intent": 1.8,
+    "curiosity": 1.8,
+    "temporal": 0.6,
+    "question": 0.6,
+    "small_talk": -1.5,
+    "length": 0.3,
+}
+
+
+def _count_keywords(text: str, keywords: list[str]) -> int:
+    return sum(
+        1 for keyword in keywords if re.search(rf"\b{re.escape(keyword)}\b", text)
+    )
+
+
+def detect_topic(text: str) -> Optional[str]:
+    """
+    Find the climate topic mentioned the most in a text.
+
+    Args:
+        text (str): The text to analyze
+
+    Returns:
+        str: The topic of interest, None if no climate topic is mentioned
+    """
+    text = text.lower()
+    counts = {
+        topic: _count_keywords(text, keywords)
+        for topic, keywords in TOPIC_KEYWORDS.items()
+    }
+    topic, count = max(counts.items(), key=lambda item: item[1])
+    return topic if count else None
+
+
+def extract_features(text: str) -> np.ndarray:
+    """
+    Compute the feature vector of a message: hand-crafted keyword scores followed by hashed unigrams.
+
+    Args:
+        text (str): The message
+
+    Returns:
+        np.ndarray: The feature vector
+    """
+    text = text.lower()
+    words = re.findall(r"[a-z0-9.']+", text)
+
+    hand_crafted = [
+        1.0,
+        min(
+            sum(
+                _count_keywords(text, keywords) for keywords in TOPIC_KEYWORDS.values()
+            ),
+            3,
+        ),
+        min(_count_keywords(text, DATA_INTENT_KEYWORDS), 3),
+        min(sum(1 for pattern in CURIOSITY_PATTERNS if re.search(pattern, text)), 2),
+        min(_count_keywords(text, TEMPORAL_KEYWORDS), 3),
+        float("?" in text),
+        min(_count_keywords(text, SMALL_TALK_KEYWORDS), 2),
+        np.log1p(len(words)),
+    ]
+
+    hashed = np.zeros(HASHED_FEATURES)
+    for word in words:
+        hashed[zlib.crc32(word.encode("utf-8")) % HASHED_FEATURES] += 1.0
+    if words:
+        hashed /= np.sqrt(len(words))
+
+    return np.concatenate([np.array(hand_crafted), hashed])
+
+
+class PreClassifierGate:
+    """
+    Cheap CPU-only first pass in front of the LLM visualization need classifier.
+    A linear model scores each message, confident negatives and positives are decided locally
+    and only uncertain messages are escalated to the LLM.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[np.ndarray] = None,
+        negative_threshold: float = GATE_NEGATIVE_THRESHOLD,
+        positive_threshold: float = GATE_POSITIVE_THRESHOLD,
+    ):
+        if weights is None:
+            weights = np.zeros(len(HAND_CRAFTED_FEATURES) + HASHED_FEATURES)
+            weights[: len(HAND_CRAFTED_FEATURES)] = [
+                DEFAULT_WEIGHTS[name] for name in HAND_CRAFTED_FEATURES
+            ]
+
+        self.weights = weights
+        self.negative_threshold = negative_threshold
+        self.positive_threshold = positive_threshold
+
+        self._lock = threading.Lock()
+        self.counts = {"negative": 0, "positive": 0, "escalated": 0}
+
+    def score(self, text: str) -> float:
+        """
+        Estimate the probability that a message needs a visualization.
+
+        Args:
+            text (str): The message
+
+        Returns:
+            float: Probability between 0 and 1
+        """
+        return float(1 / (1 + np.exp(-extract_features(text) @ self.weights)))
+
+    def decide(self, text: str) -> Optional[VisualizationNeed]:
+        """
+        Decide the visualization need locally when the model is confident.
+        Positive decisions also require a recognizable climate topic. The topic bucket only gates the decision,
+        the message itself is the topic of interest, so its locations and specifics reach data retrieval.
+
+        Args:
+            text (str): The message
+
+        Returns:
+            VisualizationNeed: The local decision, None when the message must be escalated
+        """
+        probability = self.score(text)
+        topic = detect_topic(text)
+
+        if probability <= self.negative_threshold:
+            decision, outcome = (
+                VisualizationNeed.model_validate(
+                    {"need_visualization": 0, "topic_of_interest": topic or ""}
+                ),
+                "negative",
+            )
+        elif probability >= self.positive_threshold and topic is not None:
+            decision, outcome = (
+                VisualizationNeed.model_validate(
+                    {"need_visualization": 1, "topic_of_interest": text}
+                ),
+                "positive",
+            )
+        else:
+            decision, outcome = None, "escalated"
+
+        with self._lock:
+            self.counts[outcome] += 1
+        logging.info(f"Pre-classifier gate: p={probability:.2f} -> {outcome}")
+        return decision
+
+    def stats(self) -> dict:
+        """
+        Get the decisions of the gate.
+
+        Returns:
+            dict: Decision counts and the fraction of messages short-circuited locally
+        """
+        with self._lock:
+            total = sum(self.counts.values())
+            short_circuited = self.counts["negative"] + self.counts["positive"]
+            return {
+                **self.counts,
+                "total": total,
+                "short_circuit_ratio": short_circuited / total if total else 0.0,
+            }
+
+    @classmethod
+    def train(
+        cls,
+        examples: list[tuple[str, int]],
+        epochs: int = 300,
+        learning_rate: float = 0.1,
+        l2: float = 0.01,
+        **kwargs,
+    ) -> "PreClassifierGate":
+        """
+        Fit the linear model on labeled messages with batch gradient descent,
+        starting from the default keyword weights.
+
+        Args:
+            examples (list[tuple[str, int]]): Messages with their need_visualization label
+            epochs (int): Number of gradient descent steps
+            learning_rate (float): Step size
+            l2 (float): L2 regularization strength
+            **kwargs: Thresholds of the gate
+
+        Returns:
+            PreClassifierGate: The trained gate
+        """
+        features = np.stack([extract_features(text) for text, _ in examples])
+        labels = np.array([label for _, label in examples], dtype=float)
+
+        gate = cls(**kwargs)
+        weights = gate.weights.copy()
+        for _ in range(epochs):
+            predictions = 1 / (1 + np.exp(-features @ weights))
+            gradient = features.T @ (predictions - labels) / len(labels) + l2 * weights
+            weights -= learning_rate * gradient
+
+        gate.weights = weights
+        return gate
+
+    @classmethod
+    def from_labeled_dataset(cls, path: str, **kwargs) -> "PreClassifierGate":
+        """
+        Train a gate on a mock.json-style dataset whose messages have a need_visualization label.
+
+        Args:
+            path (str): Path of the labeled dataset
+            **kwargs: Training and threshold arguments
+
+        Returns:
+            PreClassifierGate: The trained gate
+        """
+        with open(path, "r") as file:
+            conversations = json.load(file)
+
+        examples = [
+            (message["message"], int(message["need_visualization"]))
+            for conversation in conversations
+            for message in conversation["messages"]
+            if "need_visualization" in message
+        ]
+        return cls.train(examples, **kwargs)
+
+    def save(self, path: str = GATE_MODEL_PATH) -> None:
+        with open(path, "w") as file:
+            json.dump({"weights": self.weights.tolist()}, file)
+
+    @classmethod
+    def load(cls, path: str = GATE_MODEL_PATH, **kwargs) -> "PreClassifierGate":
+        """
+        Load the trained gate if its model file exists, or a gate with the default keyword weights.
+
+        Args:
+            path (str): Path of the model file
+            **kwargs: Thresholds of the gate
+
+        Returns:
+            PreClassifierGate: The gate
+        """
+        if not os.path.exists(path):
+            logging.warning(
+                f"No gate model at {path}, using the untrained default weights"
+            )
+            return cls(**kwargs)
+
+        with open(path, "r") as file:
+            return cls(weights=np.array(json.load(file)["weights"]), **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train the pre-classifier gate on a labeled conversation dataset"
+    )
+    parser.add_argument("dataset")
+    parser.add_argument("--output", default=GATE_MODEL_PATH)
+    args = parser.parse_args()
+
+    PreClassifierGate.from_labeled_dataset(args.dataset).save(args.output)
@@ -0,0 +1,186 @@
+import json
+import math
+import re
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from .constants import PLACES_PATH, DEFAULT_LOCATION, PLACE_MATCH_RADIUS_KM
+
+EARTH_RADIUS_KM = 6371.0
+
+
+@dataclass(frozen=True)
+class Place:
+    """A named location with its canonical coordinates"""
+
+    name: str
+    country: str
+    latitude: float
+    longitude: float
+    aliases: tuple[str, ...] = ()
+
+    def __str__(self):
+        return f"{self.name}, {self.country}: latitude={self.latitude}, longitude={self.longitude}"
+
+
+def distance_km(
+    latitude_a: float, longitude_a: float, latitude_b: float, longitude_b: float
+) -> float:
+    """Great circle distance between two coordinates"""
+    phi_a, phi_b = math.radians(latitude_a), math.radians(latitude_b)
+    delta_phi = phi_b - phi_a
+    delta_lambda = math.radians(longitude_b - longitude_a)
+    a = (
+        math.sin(delta_phi / 2) ** 2
+        + math.cos(phi_a) * math.cos(phi_b) * math.sin(delta_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Gazetteer:
+    """Offline index of place names, resolving the locations mentioned in a text to canonical coordinates"""
+
+    def __init__(self, places: List[Place]):
+        self.places = places
+        self._by_name: dict[str, Place] = {}
+        for place in places:
+            for name in (place.name, *place.aliases):
+                self._by_name.setdefault(name.lower(), place)
+
+        # Longest names first so "New York City" wins over "New York"
+        names = sorted(self._by_name, key=len, reverse=True)
+        self._pattern = re.compile(
+            r"(?<!\w)(" + "|".join(re.escape(name) for name in names) + r")(?!\w)",
+            re.IGNORECASE,
+        )
+
+    @classmethod
+    def load(cls, path: str = PLACES_PATH) -> "Gazetteer":
+        with open(path, "r") as file:
+            places = json.load(file)
+        return cls(
+            [
+                Place(**{**place, "aliases": tuple(place.get("aliases", ()))})
+                for place in places
+            ]
+        )
+
+    def get(self, name: str) -> Optional[Place]:
+        return self._by_name.get(name.lower())
+
+    def find(self, text: str) -> List[Place]:
+        """
+        Find the known places mentioned in a text.
+
+        Args:
+            text (str): The text to search
+
+        Returns:
+            List[Place]: The places in order of first mention, without duplicates
+        """
+        found = []
+        for match in self._pattern.finditer(text or ""):
+            place = self._by_name[match.group(1).lower()]
+            if place not in found:
+                found.append(place)
+        return found
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        max_distance: float = PLACE_MATCH_RADIUS_KM,
+    ) -> Optional[Place]:
+        """
+        Find the known place closest to coordinates.
+
+        Args:
+            latitude (float): Latitude
+            longitude (float): Longitude
+            max_distance (float): Distance in km beyond which places are ignored
+
+        Returns:
+            Place: The closest place, None if no place is close enough
+        """
+        distance, place = min(
+            (
+                (
+                    distance_km(latitude, longitude, place.latitude, place.longitude),
+                    place,
+                )
+                for place in self.places
+            ),
+            key=lambda item: item[0],
+            default=(math.inf, None),
+        )
+        return place if distance <= max_distance else None
+
+    def canonicalize_url(self, url: str) -> str:
+        """
+        Replace the coordinates of an API URL close to a known place by the place's canonical coordinates,
+        so the slightly different coordinates the LLM writes for the same city produce the same URL.
+
+        Args:
+            url (str): The API URL
+
+        Returns:
+            str: The URL, unchanged when it has no coordinates close to a known place
+        """
+        parts = urlsplit(url.strip())
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        if "latitude" not in query or "longitude" not in query:
+            return url
+
+        latitudes = query["latitude"].split(",")
+        longitudes = query["longitude"].split(",")
+        if len(latitudes) != len(longitudes):
+            return url
+
+        changed = False
+        for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+            try:
+                place = self.nearest(float(latitude), float(longitude))
+            except ValueError:
+                # Invalid coordinates are reported by the URL validation
+                return url
+            if place is not None:
+                latitudes[i], longitudes[i] = str(place.latitude), str(place.longitude)
+                changed = True
+
+        if not changed:
+            return url
+
+        query["latitude"], query["longitude"] = ",".join(latitudes), ",".join(
+            longitudes
+        )
+        return f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(list(query.items()), safe=',:/')}"
+
+    def describe_locations(self, text: str) -> str:
+        """
+        List the coordinates of the places mentioned in a text for the data retrieval prompt.
+
+        Args:
+            text (str): The request text
+
+        Returns:
+            str: One place per line, the default location when no known place is mentioned
+        """
+        places = self.find(text)
+        if not places:
+            default = self.get(DEFAULT_LOCATION)
+            return f"No known location mentioned, if the request doesn't name one use {default}"
+        return "\n".join(str(place) for place in places)
+
+
+@lru_cache(maxsize=1)
+def load_gazetteer() -> Gazetteer:
+    """
+    Load the gazetteer, read once per process.
+
+    Returns:
+        Gazetteer: The gazetteer
+    """
+    return Gazetteer.load()
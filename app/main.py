@@ -1,23 +1,88 @@
+import contextvars
 import logging
 import json
 import random
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from typing import Type
+from typing import Optional, Type
 import plotly.graph_objects as go
 
 from .prompts import *
-from .models import VisualizationNeed, PersonaSelection, NormalizedOpenMeteoData
-from .utils import figure_to_base64, enhance_plotly_figure, handle_exceptions
-from .visualization import visualization_generation_pipeline
-from .constants import DEVELOPER, USER, DEVELOPER
-from .ai import openai_client, anthropic_client
+from .models import (
+    VisualizationNeed,
+    PersonaSelection,
+    NormalizedOpenMeteoData,
+    VisualizationType,
+    VisualizationExplanation,
+)
+from .utils import (
+    enhance_plotly_figure,
+    figure_hash,
+    handle_exceptions,
+    summarize_figure_traces,
+)
+from .render import RenderedImage, render_figure
+from .visualization import (
+    visualization_generation_pipeline,
+    refine_visualization_pipeline,
+)
+from .session import ConversationSession
+from .context import PipelineContext, current_timeout
+from .constants import (
+    DEVELOPER,
+    USER,
+    GATE_ENABLED,
+    REQUEST_DEADLINE_SECONDS,
+    EXPLANATION_PLAN_MIN_SECONDS,
+    EXPLANATION_FULL_TOKENS_MIN_SECONDS,
+    EXPLANATION_MAX_TOKENS,
+    EXPLANATION_REDUCED_MAX_TOKENS,
+    EXPLANATION_MODE,
+    EXPLANATION_TWO_CALL,
+    EXPLANATION_SINGLE_CALL,
+    EXPLANATION_TRACE_SUMMARY,
+    EXPLANATION_SINGLE_CALL_MAX_TOKENS,
+    EXPLANATION_CACHE_SIZE,
+    EXPLANATION_CACHE_TTL,
+)
+from .cache import TTLCache
+from .ai import openai_client, anthropic_client, TIMEOUT_EXCEPTIONS
+from .routing import estimate_cost, llm_router
+from .gate import PreClassifierGate
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s \n\n')
 
 load_dotenv()
 
+pre_classifier_gate = PreClassifierGate.load() if GATE_ENABLED else None
+
+
+def build_classification_messages(
+    text: str, classification_prompt: str
+) -> list[dict[str, str]]:
+    """
+    Build the messages of a classification request.
+
+    Args:
+        text (str): Input text to analyze
+        classification_prompt (str): The prompt to use for classification
+
+    Returns:
+        list[dict[str, str]]: The messages to send
+    """
+    return [
+        {"role": DEVELOPER, "content": classification_prompt},
+        {
+            "role": USER,
+            "content": f"Classify this text:\n\n{text}",
+        },
+    ]
+
 
 @handle_exceptions()
 def classify_text(text: str, classification_prompt: str, response_format: Type[BaseModel], max_tokens: int = 20) -> BaseModel:
@@ -32,15 +97,12 @@ def classify_text(text: str, classification_prompt: str, response_format: Type[B
     Returns:
         BaseModel: The classified result parsed into the specified response format
     """
-    response = openai_client.structured_completion(
-        messages=[
-            {"role": DEVELOPER, "content": classification_prompt},
-            {
-                "role": USER,
-                "content": f"Classify this text:\n\n{text}",
-            },
-        ],
+    # Classification is on the critical path of every message, it is hedged with the next model of the stage
+    response = llm_router.structured_completion(
+        messages=build_classification_messages(text, classification_prompt),
         response_format=response_format,
+        stage="classification",
+        hedge=True,
         max_tokens=max_tokens,
         temperature=0.8,
     )
@@ -49,6 +111,42 @@ def classify_text(text: str, classification_prompt: str, response_format: Type[B
 
 
 
+@lru_cache(maxsize=1)
+def load_personas() -> list[dict]:
+    """
+    Load the personas, read once per process.
+
+    Returns:
+        list[dict]: The personas
+    """
+    with open("personas.json", "r") as file:
+        return json.load(file)
+
+
+def classify_visualization_need(
+    message: str, conversation_context: Optional[str] = None
+) -> VisualizationNeed:
+    """
+    Classify whether a message needs a visualization.
+    The local pre-classifier gate decides confident cases, only uncertain messages are sent to the LLM.
+
+    Args:
+        message (str): The message to classify
+        conversation_context (str): Text sent to the LLM instead of the bare message, e.g. with the previous messages
+
+    Returns:
+        VisualizationNeed: The classification
+    """
+    if pre_classifier_gate is not None:
+        decision = pre_classifier_gate.decide(message)
+        if decision is not None:
+            return decision
+
+    return classify_text(
+        conversation_context or message, VISUALIZATION_NEED_PROMPT, VisualizationNeed
+    )
+
+
 handle_exceptions()
 def set_complexity_level(persona: str) -> tuple[str, str]:
     """
@@ -60,8 +158,7 @@ def set_complexity_level(persona: str) -> tuple[str, str]:
     Returns:
         str: The complexity level prompt
     """
-    with open('personas.json', 'r') as file:
-        personas = json.load(file)
+    personas = load_personas()
     
     user_description = next((p['tuning'] for p in personas if p['name'] == persona), None)
     
@@ -81,65 +178,490 @@ def set_complexity_level(persona: str) -> tuple[str, str]:
 
 
 
-@handle_exceptions()
-def describe_visualization(data: list[NormalizedOpenMeteoData], complexity_level: str, fig: go.Figure) -> str:
+# Explanation prompt of each audience level, from the least to the most technical
+AUDIENCE_LEVELS = {
+    "LVL0": LVL0_EXP_PROMPT,
+    "LVL1": LVL1_EXP_PROMPT,
+    "LVL2": LVL2_EXP_PROMPT,
+}
+
+explanation_cache = TTLCache(maxsize=EXPLANATION_CACHE_SIZE, ttl=EXPLANATION_CACHE_TTL)
+
+
+def audience_level(exp_complexity: str) -> Optional[str]:
     """
-    Describe the visualization based on the given data and complexity level.
+    Find the audience level of an explanation complexity prompt.
 
     Args:
-        data (ProcessedData): The processed data to describe
-        complexity_level (str): The complexity level of the user
-        fig (go.Figure): The generated figure to describe
+        exp_complexity (str): Explanation complexity prompt returned by set_complexity_level
 
     Returns:
-        str: The description of the visualization
+        str: The level, None for an unknown prompt
     """
-    base64_image = figure_to_base64(fig)
-    explanation_plan = anthropic_client.completion(
+    return next(
+        (
+            level
+            for level, prompt in AUDIENCE_LEVELS.items()
+            if prompt == exp_complexity
+        ),
+        None,
+    )
+
+
+@lru_cache(maxsize=None)
+def _persona_audience_level(persona: str) -> Optional[str]:
+    """Audience level of a participant, classified once per process since the personas don't change"""
+    return audience_level(set_complexity_level(persona)[1])
+
+
+def _render_for_llm(fig: go.Figure, context: PipelineContext) -> RenderedImage:
+    """Render the figure with the LLM render profile, recording its size and render time"""
+    image = render_figure(fig)
+    context.add_metric("image_render_time", image.render_time)
+    context.add_metric("image_bytes", len(image.data))
+    return image
+
+
+def _image_content(image: RenderedImage, context: PipelineContext) -> dict:
+    """Image block of a message, each block sent is counted in the estimated image tokens"""
+    context.add_metric("image_tokens", image.tokens())
+    return {
+        "type": "image",
+        "source": { "type": "base64",
+                    "data": image.base64,
+                    "media_type": image.media_type},
+    }
+
+
+def _explanation_max_tokens(max_tokens: int, context: PipelineContext) -> int:
+    """Shorten the explanation when the explanation stage is short on time"""
+    remaining = current_timeout()
+    if remaining is not None and remaining < EXPLANATION_FULL_TOKENS_MIN_SECONDS:
+        context.degrade("reduced_explanation_tokens")
+        return max_tokens * EXPLANATION_REDUCED_MAX_TOKENS // EXPLANATION_MAX_TOKENS
+    return max_tokens
+
+
+def _describe_in_two_calls(
+    data_description: str,
+    complexity_level: str,
+    fig: go.Figure,
+    context: PipelineContext,
+    image: Optional[RenderedImage] = None,
+) -> str:
+    """Generate an explanation plan, then the explanation following it, both calls with the figure image"""
+    image = image or _render_for_llm(fig, context)
+
+    explanation_plan = ""
+    remaining = current_timeout()
+    if remaining is not None and remaining < EXPLANATION_PLAN_MIN_SECONDS:
+        context.degrade("skipped_explanation_plan")
+    else:
+        context.check()
+        explanation_plan = llm_router.completion(
+            messages=[
+                {"role": USER, "content": complexity_level},
+                {"role": USER, "content": [
+                    {
+                        "type": "text",
+                        "text": EXPLANATION_PLAN_PROMPT,
+                    },
+                    _image_content(image, context),
+                ]},
+            ],
+            stage="explanation",
+            temperature=0.7,
+            max_tokens=EXPLANATION_MAX_TOKENS,
+        )
+
+    max_tokens = _explanation_max_tokens(EXPLANATION_MAX_TOKENS, context)
+
+    context.check()
+    return llm_router.completion(
         messages=[
             {"role": USER, "content": complexity_level},
             {"role": USER, "content": [
                 {
                     "type": "text",
-                    "text": EXPLANATION_PLAN_PROMPT,
-                },
-                {
-                    "type": "image",
-                    "source": { "type": "base64",
-                                "data": base64_image,
-                                "media_type": "image/png"},
+                    "text": EXPLANATION_GENERATION_PROMPT.format(explanation_plan=explanation_plan, data_description=data_description),
                 },
+                _image_content(image, context),
             ]},
         ],
+        stage="explanation",
         temperature=0.7,
-        max_tokens=300,
+        max_tokens=max_tokens,
     )
 
-    data_description = ""
-    for data_point in data:
-        data_description += f"{data_point.generate_data_description()}\n\n"
 
-    response = anthropic_client.completion(
+def _describe_in_one_call(
+    data_description: str,
+    complexity_level: str,
+    fig: go.Figure,
+    context: PipelineContext,
+    with_image: bool,
+    image: Optional[RenderedImage] = None,
+    trace_summary: Optional[str] = None,
+) -> str:
+    """Generate the explanation plan and the explanation in a single call, with the figure image or a summary of its traces"""
+    if with_image:
+        content = [
+            {
+                "type": "text",
+                "text": EXPLANATION_SINGLE_CALL_PROMPT.format(
+                    figure=EXPLANATION_FIGURE_IMAGE, data_description=data_description
+                ),
+            },
+            _image_content(image or _render_for_llm(fig, context), context),
+        ]
+    else:
+        figure = EXPLANATION_FIGURE_SUMMARY.format(
+            trace_summary=trace_summary or summarize_figure_traces(fig)
+        )
+        content = EXPLANATION_SINGLE_CALL_PROMPT.format(
+            figure=figure, data_description=data_description
+        )
+
+    max_tokens = _explanation_max_tokens(EXPLANATION_SINGLE_CALL_MAX_TOKENS, context)
+
+    context.check()
+    response = llm_router.structured_completion(
         messages=[
             {"role": USER, "content": complexity_level},
-            {"role": USER, "content": [
-                {
-                    "type": "text",
-                    "text": EXPLANATION_GENERATION_PROMPT.format(explanation_plan=explanation_plan, data_description=data_description),
-                },
-                {
-                    "type": "image",
-                    "source": { "type": "base64",
-                                "data": base64_image,
-                                "media_type": "image/png"},
-                },
-            ]},
+            {"role": USER, "content": content},
         ],
+        response_format=VisualizationExplanation,
+        stage="explanation",
         temperature=0.7,
-        max_tokens=300,
+        max_tokens=max_tokens,
     )
+    logging.info(f"Explanation plan : {response.explanation_plan}")
+    return response.explanation
+
+
+@handle_exceptions()
+def describe_visualization(
+    data: list[NormalizedOpenMeteoData],
+    complexity_level: str,
+    fig: go.Figure,
+    context: Optional[PipelineContext] = None,
+    mode: str = EXPLANATION_MODE,
+) -> str:
+    """
+    Describe the visualization based on the given data and complexity level.
+    The single-call modes send the figure once, as an image or as a summary of its traces.
+    When the explanation stage is short on time the explanation is shortened,
+    and the two-call mode skips its plan.
+
+    Args:
+        data (ProcessedData): The processed data to describe
+        complexity_level (str): The complexity level of the user
+        fig (go.Figure): The generated figure to describe
+        context (PipelineContext): State of the run, used to cancel it between calls and record fallbacks
+        mode (str): EXPLANATION_TWO_CALL, EXPLANATION_SINGLE_CALL or EXPLANATION_TRACE_SUMMARY
+
+    Returns:
+        str: The description of the visualization
+    """
+    context = context or PipelineContext()
+    data_description = "\n\n".join(
+        data_point.generate_data_description() for data_point in data
+    )
+    return _describe(data_description, complexity_level, fig, context, mode)
+
+
+def _describe(
+    data_description: str,
+    complexity_level: str,
+    fig: go.Figure,
+    context: PipelineContext,
+    mode: str,
+    image: Optional[RenderedImage] = None,
+    trace_summary: Optional[str] = None,
+) -> str:
+    """Describe the visualization with an explanation mode, from an image or trace summary already computed when given"""
+    if mode == EXPLANATION_TWO_CALL:
+        return _describe_in_two_calls(
+            data_description, complexity_level, fig, context, image
+        )
+    if mode == EXPLANATION_SINGLE_CALL:
+        return _describe_in_one_call(
+            data_description,
+            complexity_level,
+            fig,
+            context,
+            with_image=True,
+            image=image,
+        )
+    if mode == EXPLANATION_TRACE_SUMMARY:
+        return _describe_in_one_call(
+            data_description,
+            complexity_level,
+            fig,
+            context,
+            with_image=False,
+            trace_summary=trace_summary,
+        )
+    raise ValueError(f"Invalid explanation mode {mode}")
+
+
+@handle_exceptions()
+def describe_visualization_for_audiences(
+    data: list[NormalizedOpenMeteoData],
+    fig: go.Figure,
+    context: Optional[PipelineContext] = None,
+    levels: Optional[list[str]] = None,
+    mode: str = EXPLANATION_MODE,
+) -> dict[str, str]:
+    """
+    Describe the visualization for several audience levels at once, e.g. every participant of a group discussion.
+    The figure is rendered and the data described once for all the levels, whose calls run concurrently.
+    Explanations are cached per figure and level, unless shortened to meet the deadline.
+    A level that fails or times out is left out.
+
+    Args:
+        data (ProcessedData): The processed data to describe
+        fig (go.Figure): The generated figure to describe
+        context (PipelineContext): State of the run, used to cancel it between calls and record fallbacks
+        levels (list[str]): Audience levels to describe the visualization for, defaults to every level of AUDIENCE_LEVELS
+        mode (str): EXPLANATION_TWO_CALL, EXPLANATION_SINGLE_CALL or EXPLANATION_TRACE_SUMMARY
+
+    Returns:
+        dict[str, str]: The explanation of each level
+    """
+    context = context or PipelineContext()
+    levels = levels or list(AUDIENCE_LEVELS)
+    fig_hash = figure_hash(fig)
+
+    explanations = {}
+    for level in levels:
+        cached = explanation_cache.get((fig_hash, level, mode))
+        if cached is not None:
+            explanations[level] = cached
+    context.add_metric("cached_explanations", len(explanations))
+
+    missing = [level for level in levels if level not in explanations]
+    degradations = len(context.degradations)
+    if missing:
+        data_description = "\n\n".join(
+            data_point.generate_data_description() for data_point in data
+        )
+        image = (
+            _render_for_llm(fig, context) if mode != EXPLANATION_TRACE_SUMMARY else None
+        )
+        trace_summary = (
+            summarize_figure_traces(fig) if mode == EXPLANATION_TRACE_SUMMARY else None
+        )
+
+        # The calls run with the caller's context so they keep the deadline of the explanation stage
+        with ThreadPoolExecutor(
+            max_workers=len(missing), thread_name_prefix="explanation"
+        ) as executor:
+            futures = {
+                level: executor.submit(
+                    contextvars.copy_context().run,
+                    _describe,
+                    data_description,
+                    AUDIENCE_LEVELS[level],
+                    fig,
+                    context,
+                    mode,
+                    image,
+                    trace_summary,
+                )
+                for level in missing
+            }
+
+        for level, future in futures.items():
+            try:
+                explanations[level] = future.result()
+            except TIMEOUT_EXCEPTIONS as e:
+                logging.warning(f"Explanation for {level} timed out: {str(e)}")
+                context.degrade(f"explanation_skipped_{level}")
+                continue
+            except Exception as e:
+                logging.error(
+                    f"Error describing the visualization for {level}: {str(e)}",
+                    exc_info=True,
+                )
+                continue
+
+        # Explanations shortened to meet the deadline aren't cached, a later request may have time for full ones.
+        # The levels share the deadline, so a shortened call marks all of them
+        shortened = any(
+            degradation in ("reduced_explanation_tokens", "skipped_explanation_plan")
+            for degradation in context.degradations[degradations:]
+        )
+        for level in missing:
+            if level in explanations and not shortened:
+                explanation_cache.set((fig_hash, level, mode), explanations[level])
+
+    return {level: explanations[level] for level in levels if level in explanations}
+
+
+def _generate_figure(
+    message: str,
+    persona: str,
+    topic_of_interest: str,
+    context: PipelineContext,
+    viz_complexity: str,
+    visualization_details: Optional[VisualizationType],
+    session: Optional[ConversationSession],
+) -> tuple[go.Figure, list[NormalizedOpenMeteoData]]:
+    """Generate the figure of a visualization, refining the previous one of the session for follow-ups"""
+    with session.lock if session is not None else nullcontext():
+        fig = None
+        if session is not None and session.can_refine:
+            try:
+                fig, data = refine_visualization_pipeline(
+                    message, topic_of_interest, viz_complexity, session, context
+                )
+                context.add_metric("refined_turns", 1)
+            except Exception as e:
+                logging.warning(
+                    f"Follow-up refinement failed, running the full pipeline: {str(e)}"
+                )
+                fig = None
+
+        if fig is None:
+            fig, data = visualization_generation_pipeline(
+                message,
+                persona,
+                topic_of_interest,
+                viz_complexity,
+                context,
+                visualization_details,
+                session,
+            )
+    if fig is None:
+        raise ValueError(f"No visualization could be generated for: {message}")
+    return enhance_plotly_figure(fig), data
+
+
+def generate_visualization(
+    message: str,
+    persona: str,
+    topic_of_interest: str,
+    context: Optional[PipelineContext] = None,
+    complexity_levels: Optional[tuple[str, str]] = None,
+    visualization_details: Optional[VisualizationType] = None,
+    session: Optional[ConversationSession] = None,
+) -> tuple[go.Figure, str]:
+    """
+    Generate a visualization and its explanation for a message that needs one.
+    The run must end within REQUEST_DEADLINE_SECONDS unless the context sets its own deadline,
+    the figure is returned without explanation when the explanation runs out of time.
+    Follow-ups of a conversation with a previous visualization take the cheaper refine path,
+    falling back to the full pipeline when it fails.
+
+    Args:
+        message (str): The message of the user
+        persona (str): The persona name
+        topic_of_interest (str): The topic of interest found by the classification
+        context (PipelineContext): State of the run, used to cancel it between stages and bound its duration
+        complexity_levels (tuple[str, str]): Visualization and explanation complexity prompts, when already computed
+        visualization_details (VisualizationType): Visualization details, when already computed, unused by follow-ups
+        session (ConversationSession): The conversation, its data and last figure code are reused by follow-ups
+
+    Returns:
+        tuple[go.Figure, str]: The figure and its description
+    """
+    context = context or PipelineContext.with_timeout(REQUEST_DEADLINE_SECONDS)
+
+    if complexity_levels is None:
+        with context.stage("complexity"):
+            complexity_levels = set_complexity_level(persona)
+    viz_complexity, exp_complexity = complexity_levels
+
+    fig, data = _generate_figure(
+        message,
+        persona,
+        topic_of_interest,
+        context,
+        viz_complexity,
+        visualization_details,
+        session,
+    )
+
+    try:
+        with context.stage("explanation"):
+            description = describe_visualization(data, exp_complexity, fig, context)
+    except TIMEOUT_EXCEPTIONS as e:
+        logging.warning(f"Explanation timed out, returning the figure alone: {str(e)}")
+        context.degrade("explanation_skipped")
+        description = ""
+
+    return fig, description
+
+
+def generate_group_visualization(
+    message: str,
+    persona: str,
+    topic_of_interest: str,
+    context: Optional[PipelineContext] = None,
+    complexity_levels: Optional[tuple[str, str]] = None,
+    visualization_details: Optional[VisualizationType] = None,
+    session: Optional[ConversationSession] = None,
+    personas: Optional[list[str]] = None,
+) -> tuple[go.Figure, str, dict[str, str]]:
+    """
+    Generate a visualization for a group discussion, explained for the audience level of every participant.
+    The figure is drawn for the persona who asked, and the explanations of the levels
+    are generated concurrently, in about the time of a single explanation.
+
+    Args:
+        message (str): The message of the user
+        persona (str): The persona name of the user who asked
+        topic_of_interest (str): The topic of interest found by the classification
+        context (PipelineContext): State of the run, used to cancel it between stages and bound its duration
+        complexity_levels (tuple[str, str]): Visualization and explanation complexity prompts, when already computed
+        visualization_details (VisualizationType): Visualization details, when already computed, unused by follow-ups
+        session (ConversationSession): The conversation, its data and last figure code are reused by follow-ups
+        personas (list[str]): Participants of the discussion, every audience level is explained when not given
+
+    Returns:
+        tuple[go.Figure, str, dict[str, str]]: The figure, its description for the persona who asked and the explanation of each level
+    """
+    context = context or PipelineContext.with_timeout(REQUEST_DEADLINE_SECONDS)
+
+    levels = None
+    if complexity_levels is None or personas:
+        with context.stage("complexity"):
+            if complexity_levels is None:
+                complexity_levels = set_complexity_level(persona)
+            if personas:
+                others = [
+                    _persona_audience_level(participant)
+                    for participant in personas
+                    if participant != persona
+                ]
+                levels = list(
+                    dict.fromkeys([audience_level(complexity_levels[1]), *others])
+                )
+    viz_complexity, exp_complexity = complexity_levels
+
+    fig, data = _generate_figure(
+        message,
+        persona,
+        topic_of_interest,
+        context,
+        viz_complexity,
+        visualization_details,
+        session,
+    )
+
+    try:
+        with context.stage("explanation"):
+            explanations = describe_visualization_for_audiences(
+                data, fig, context, levels
+            )
+    except TIMEOUT_EXCEPTIONS as e:
+        logging.warning(f"Explanations timed out, returning the figure alone: {str(e)}")
+        context.degrade("explanation_skipped")
+        explanations = {}
+
+    return fig, explanations.get(audience_level(exp_complexity), ""), explanations
 
-    return response
 
 def main() -> tuple[go.Figure, str]:
     with open('mock.json', 'r') as file:
@@ -148,26 +670,29 @@ def main() -> tuple[go.Figure, str]:
     conversation = random.choice(conversations)
 
     for message in conversation['messages']:
-        viz_need = classify_text(message['message'], VISUALIZATION_NEED_PROMPT, VisualizationNeed)
+        viz_need = classify_visualization_need(message["message"])
 
         if viz_need.need_visualization:
             logging.info(f"Needed viz : {message['message']}")
             logging.info(f"Topic of interest : {viz_need.topic_of_interest}")
 
-            viz_complexity, exp_complexity = set_complexity_level(message['persona'])
             try:
-                fig, data = visualization_generation_pipeline(message['message'], message['persona'], viz_need.topic_of_interest, viz_complexity)
-                fig = enhance_plotly_figure(fig)
-
-                description = describe_visualization(data, exp_complexity, fig)
-
-                return fig, description
+                return generate_visualization(
+                    message["message"], message["persona"], viz_need.topic_of_interest
+                )
             except Exception:
                 logging.error(f"Error generating visualization:", exc_info=True)
                 return
             finally:
-                in_token, out_token = anthropic_client.get_total_tokens()
-
-                print(f"OPENAI spent tokens = {openai_client.get_total_tokens()}")
-                print(f"ANTHROPIC spent tokens = {in_token*0.000003:.2f}$, {out_token*0.000015:.2f}$")
+                for client in (openai_client, anthropic_client):
+                    for model, (
+                        in_token,
+                        out_token,
+                    ) in client.get_model_tokens().items():
+                        print(
+                            f"{model} spent tokens = {in_token}, {out_token} ({estimate_cost(model, in_token, out_token):.4f}$)"
+                        )
+                if pre_classifier_gate is not None:
+                    logging.info(f"Pre-classifier gate: {pre_classifier_gate.stats()}")
+                logging.info(f"LLM routing: {llm_router.stats()}")
 
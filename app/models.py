@@ -1,9 +1,146 @@
 from dataclasses import dataclass
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 from typing import Optional, List
 from enum import Enum
+import re
+import numpy as np
 import pandas as pd
 
+from .stats import compute_stats, describe_stats, numeric_columns
+
+PREVIEW_SAMPLE_ROWS = 3
+
+ROLLUP_RESOLUTIONS = ("daily", "monthly", "yearly", "climatology", "anomalies")
+# Variables accumulated over their time step (precipitation, durations, sums) are summed when rolled up,
+# daily extremes, probabilities and weather codes keep their maximum, directions get a circular mean,
+# every other variable is averaged. Climate model columns may end with a model suffix, e.g. _mri_agcm3_2_s
+ACCUMULATED_PATTERN = re.compile(
+    r"^(precipitation|rain|showers|snowfall|snowfall_water_equivalent|precipitation_hours|et0_fao_evapotranspiration)(?!_height)(_|$)"
+    r"|_sum(_|$)|_duration(_|$)"
+)
+MAXIMUM_PATTERN = re.compile(r"_max(_|$)|probability|^weather_code")
+MINIMUM_PATTERN = re.compile(r"_min(_|$)")
+DIRECTION_PATTERN = re.compile(r"direction")
+
+
+def _rollup_aggregation(column: str) -> str:
+    if MAXIMUM_PATTERN.search(column):
+        return "max"
+    if MINIMUM_PATTERN.search(column):
+        return "min"
+    if DIRECTION_PATTERN.search(column):
+        return "circular_mean"
+    if ACCUMULATED_PATTERN.search(column):
+        return "sum"
+    return "mean"
+
+
+def _circular_mean(df: pd.DataFrame, group) -> pd.DataFrame:
+    """Mean of directions in degrees per group, so 350° and 10° average to 0° and not 180°"""
+    radians = np.deg2rad(df)
+    sin = group(np.sin(radians)).mean()
+    cos = group(np.cos(radians)).mean()
+    # Rounded first, so a mean a hair below 0° doesn't wrap to 360°
+    return np.rad2deg(np.arctan2(sin, cos)).round(6) % 360
+
+
+def _resample(df: pd.DataFrame, rule: str) -> pd.DataFrame:
+    """Resample a time indexed frame, each column with its own aggregation, in one vectorized pass"""
+    if df.empty:
+        return df
+    resampler = df.resample(rule)
+    aggregations = {column: _rollup_aggregation(column) for column in df.columns}
+    directions = [
+        column
+        for column, aggregation in aggregations.items()
+        if aggregation == "circular_mean"
+    ]
+    linear = {
+        column: aggregation
+        for column, aggregation in aggregations.items()
+        if column not in directions
+    }
+    aggregated = (
+        resampler.agg(linear) if linear else pd.DataFrame(index=resampler.size().index)
+    )
+    if directions:
+        aggregated[directions] = _circular_mean(
+            df[directions], lambda frame: frame.resample(rule)
+        )
+    aggregated = aggregated[list(df.columns)]
+    # A period without any value stays missing instead of summing to 0
+    counts = resampler.count()
+    return aggregated.where(counts > 0)
+
+
+def _time_indexed(df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """Numeric columns of a raw frame indexed by their parsed time"""
+    if df is None or df.empty or "time" not in df.columns:
+        return pd.DataFrame()
+    numeric = df.drop(columns="time").select_dtypes(include="number")
+    numeric.index = pd.DatetimeIndex(pd.to_datetime(df["time"]), name="time")
+    return numeric
+
+
+def _format_preview_value(value) -> str:
+    """Format a single cell value as a short string for previews."""
+    if isinstance(value, (float, np.floating)):
+        return "NaN" if np.isnan(value) else f"{value:.4g}"
+    return str(value)
+
+
+def generate_frame_preview(
+    name: str,
+    df: Optional[pd.DataFrame],
+    units: Optional[dict] = None,
+    sample_rows: int = PREVIEW_SAMPLE_ROWS,
+) -> str:
+    """
+    Generate a compact schema-and-stats preview of a dataframe for LLM prompts.
+    Column names, dtypes, units and null ratios are emitted as one dense table,
+    followed by a few evenly spaced sample rows.
+
+    Args:
+        name (str): Name of the dataframe shown in the preview
+        df (pd.DataFrame): The dataframe to preview
+        units (dict): Optional mapping of column name to unit
+        sample_rows (int): Number of rows to sample
+
+    Returns:
+        str: The formatted preview
+    """
+    if df is None or df.empty:
+        return f"{name}: empty"
+
+    units = units or {}
+    n_rows, n_cols = df.shape
+
+    # Null ratios for every column in a single vectorized pass
+    null_ratios = df.isna().to_numpy().mean(axis=0)
+
+    header = f"{name}: {n_rows} rows x {n_cols} cols"
+    if "time" in df.columns:
+        # Open-Meteo series are returned sorted, no need to scan for min/max
+        header += f" | time: {df['time'].iloc[0]} .. {df['time'].iloc[-1]}"
+    elif isinstance(df.index, pd.DatetimeIndex):
+        header += f" | time: {df.index[0]} .. {df.index[-1]}"
+
+    lines = [header, "column|dtype|unit|null%"]
+    for column, dtype, null_ratio in zip(df.columns, df.dtypes, null_ratios):
+        lines.append(f"{column}|{dtype}|{units.get(column, '')}|{null_ratio * 100:.1f}")
+
+    positions = np.unique(
+        np.linspace(0, n_rows - 1, min(sample_rows, n_rows)).astype(int)
+    )
+    sample = df.iloc[positions]
+    lines.append(f"sample rows ({len(positions)} of {n_rows}):")
+    lines.append("|".join(str(column) for column in sample.columns))
+    for row in sample.itertuples(index=False):
+        lines.append("|".join(_format_preview_value(value) for value in row))
+
+    return "\n".join(lines)
+
+
 @dataclass
 class VisualizationNeed(BaseModel):
     need_visualization: int = Field(description="Whether the user needs a visualization or not")
@@ -26,69 +163,44 @@ class ProcessedData:
     nested_dataframes: dict[str, pd.DataFrame]
 
     def __str__(self):
-        def generate_description(dataframes_dict: dict[str, pd.DataFrame]) -> str:
-            """
-            Generate a formatted description of multiple dataframes
-            Args:
-                dataframes_dict: Dictionary of dataframe name and corresponding dataframe
-            Returns:
-                Formatted string describing each dataframe
-            """
-            if not dataframes_dict:
-                return ""
-                
-            descriptions = []
-            for name, df in dataframes_dict.items():
-                descriptions.append(
-                    f"Dataset: {name}\n"
-                    f"Preview:\n{df.head()}\n"
-                    f"Shape: {df.shape}"
-                )
-                
-            return "\n\n".join(descriptions)
-        
-        main_data_description = (
-            f"Main Data:\n"
-            f"Preview:\n{self.main_data.head()}\n"
-            f"Shape: {self.main_data.shape}"
-        )
-        
-        nested_dataframes_description = generate_description(self.nested_dataframes)
-        
-        return f"{main_data_description}\n\nNested Dataframes:\n{nested_dataframes_description}"
+        return self.generate_data_preview()
+
+    def generate_data_preview(self) -> str:
+        """
+        Generate a compact preview of the main and nested dataframes.
+
+        Returns:
+            str: The formatted preview
+        """
+        previews = [generate_frame_preview("main_data", self.main_data)]
+        for name, df in self.nested_dataframes.items():
+            previews.append(generate_frame_preview(name, df))
+
+        return "\n\n".join(previews)
     
     def describe_patterns(self) -> str:
         """
         Generate a simple description of patterns in any time series data.
         Works with any dataframe that has a datetime index.
         """
-        summary = ""
-        
+        summary = []
+
         for df_name, df in self.nested_dataframes.items():
-            summary += f"Dataset: {df_name}\n"
-            summary += f"Time range: {df.index.min()} to {df.index.max()}\n\n"
-            
-            # Analyze each numerical column
-            for column in df.select_dtypes(include=['float64', 'int64']).columns:
-                summary += f"Variable: {column}\n"
-                
-                # Basic statistics
-                avg = df[column].mean()
-                min_val = df[column].min()
-                max_val = df[column].max()
-                
-                # Overall trend
-                start_val = df[column].iloc[0]
-                end_val = df[column].iloc[-1]
-                total_change = ((end_val - start_val) / start_val) * 100 if start_val != 0 else 0
-                
-                summary += f"Range: {min_val:.2f} to {max_val:.2f}\n"
-                summary += f"Average: {avg:.2f}\n"
-                summary += f"Overall change: {total_change:.1f}%\n\n"
-            
-            summary += "---\n\n"
-        
-        return summary
+            summary.append(f"Dataset: {df_name}")
+            summary.append(f"Time range: {df.index.min()} to {df.index.max()}\n")
+
+            for stats in compute_stats(df, numeric_columns(df, exclude=())):
+                summary.append(f"Variable: {stats.column}")
+                summary.append(f"Range: {stats.min:.2f} to {stats.max:.2f}")
+                summary.append(f"Average: {stats.mean:.2f}")
+                # Absolute changes, a percentage of the first value is meaningless when it is close to 0
+                summary.append(
+                    f"Overall change: {stats.last - stats.first:+.2f} (trend {stats.trend_change:+.2f})\n"
+                )
+
+            summary.append("---\n")
+
+        return "\n".join(summary) + "\n"
 
 
 ## Visualization classes
@@ -120,21 +232,321 @@ class DataProcessingType(BaseModel):
     data_processing_steps: str = Field(description="Step by step process to prepare data for visualization")
 
 
+class VisualizationRefinement(BaseModel):
+    visualization_type: VisualizationType = Field(
+        description="The visualization answering the follow-up"
+    )
+    needed_data: str = Field(
+        description="List of the data needed for visualization, including time range and location"
+    )
+    data_processing_steps: str = Field(
+        description="Step by step process to prepare data for visualization"
+    )
+    endpoints: List[APIEndpoint] = Field(
+        description="API endpoints of all the data the visualization needs, including the data in memory"
+    )
+
+
+class VisualizationExplanation(BaseModel):
+    explanation_plan: str = Field(
+        description="Short outline of what the explanation covers"
+    )
+    explanation: str = Field(
+        description="The explanation of the visualization for the user"
+    )
+
+
 class NormalizedOpenMeteoData(BaseModel):
     metadata: Optional[pd.DataFrame] = Field(description="Dataframe containing data unrelated to time resolution")
     hourly_data: Optional[pd.DataFrame] = Field(description="Dataframe with hourly data")
     daily_data: Optional[pd.DataFrame] = Field(description="Dataframe with daily data")
 
+    # Rollups computed so far, and the shape of the data they were computed from
+    _rollups: dict = PrivateAttr(default_factory=dict)
+    _rollups_source: Optional[tuple] = PrivateAttr(default=None)
+
     def __str__(self):
-        return f"""
-        Metadata: {self.metadata.head()} shape: {self.metadata.shape}
-        Hourly Data: {self.hourly_data.head()} shape: {self.hourly_data.shape}
-        Daily Data: {self.daily_data.head()} shape: {self.daily_data.shape}
-        """
+        return self.generate_data_preview()
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in ("hourly_data", "daily_data"):
+            self.invalidate_rollups()
 
     class Config:
         arbitrary_types_allowed = True
 
+    @classmethod
+    def from_response(cls, json_data: dict) -> "NormalizedOpenMeteoData":
+        """
+        Normalize a single-location Open-Meteo JSON response.
+
+        Args:
+            json_data (dict): The JSON response of the API
+
+        Returns:
+            NormalizedOpenMeteoData: The normalized data
+        """
+        json_data = dict(json_data)
+        hourly_df = pd.DataFrame()
+        daily_df = pd.DataFrame()
+
+        if "hourly" in json_data:
+            hourly_df = pd.DataFrame(json_data.pop("hourly"))
+
+        # Handle daily data if present
+        if "daily" in json_data:
+            daily_df = pd.DataFrame(json_data.pop("daily"))
+
+        # Create metadata DataFrame from remaining scalar values
+        # Convert to a single-row DataFrame with an explicit index
+        metadata_df = pd.DataFrame([json_data])
+
+        return cls(metadata=metadata_df, hourly_data=hourly_df, daily_data=daily_df)
+
+    @classmethod
+    def merge(
+        cls, entries: List["NormalizedOpenMeteoData"]
+    ) -> "NormalizedOpenMeteoData":
+        """
+        Merge entries of the same location, e.g. variables or time ranges fetched by separate requests, into one.
+        The series are joined on their time, a variable present in several entries keeps the values of the first
+        and gets the times only the others have.
+
+        Args:
+            entries (List[NormalizedOpenMeteoData]): The entries, the metadata of the first is kept
+
+        Returns:
+            NormalizedOpenMeteoData: The merged data, the entry itself when there is only one
+        """
+        if len(entries) == 1:
+            return entries[0]
+
+        frames = {}
+        for resolution in ("hourly", "daily"):
+            indexed = [
+                df.set_index("time")
+                for df in (getattr(entry, f"{resolution}_data") for entry in entries)
+                if df is not None and not df.empty and "time" in df.columns
+            ]
+            merged = pd.DataFrame()
+            for df in indexed:
+                merged = df if merged.empty else merged.combine_first(df)
+            if not merged.empty:
+                # combine_first sorts the columns, the order of the entries is kept instead
+                merged = merged[
+                    list(
+                        dict.fromkeys(column for df in indexed for column in df.columns)
+                    )
+                ]
+                merged = merged.sort_index().reset_index()
+            frames[resolution] = merged
+
+        metadata = (
+            entries[0].metadata.iloc[0].to_dict()
+            if entries[0].metadata is not None and not entries[0].metadata.empty
+            else {}
+        )
+        for key in ("hourly_units", "daily_units"):
+            units = {}
+            for entry in reversed(entries):
+                units.update(entry._get_units(key))
+            if units:
+                metadata[key] = units
+
+        return cls(
+            metadata=pd.DataFrame([metadata]),
+            hourly_data=frames["hourly"],
+            daily_data=frames["daily"],
+        )
+
+    def _get_units(self, key: str) -> dict:
+        """
+        Get the units returned by the API for a time resolution.
+
+        Args:
+            key (str): Metadata key of the units (e.g. hourly_units)
+
+        Returns:
+            dict: Mapping of column name to unit
+        """
+        if (
+            self.metadata is None
+            or self.metadata.empty
+            or key not in self.metadata.columns
+        ):
+            return {}
+
+        units = self.metadata[key].iloc[0]
+        return units if isinstance(units, dict) else {}
+
+    def invalidate_rollups(self) -> None:
+        """Forget the computed rollups, needed after editing the values of hourly_data or daily_data in place"""
+        self._rollups = {}
+        self._rollups_source = None
+
+    def _data_fingerprint(self) -> tuple:
+        """Identity, shape and columns of the time series, which change with most edits of the data"""
+        return tuple(
+            (id(df), df.shape, tuple(df.columns)) if df is not None else None
+            for df in (self.hourly_data, self.daily_data)
+        )
+
+    def _compute_rollup(
+        self, resolution: str, baseline: Optional[tuple[int, int]]
+    ) -> pd.DataFrame:
+        if resolution == "daily":
+            hourly = _resample(_time_indexed(self.hourly_data), "D")
+            daily = _time_indexed(self.daily_data)
+            # Variables requested at daily resolution take precedence over the resampled hourly ones
+            hourly = hourly.drop(
+                columns=[column for column in hourly.columns if column in daily.columns]
+            )
+            frames = [frame for frame in (daily, hourly) if not frame.empty]
+            return pd.concat(frames, axis=1).sort_index() if frames else pd.DataFrame()
+        if resolution == "monthly":
+            return _resample(self._rollup("daily"), "MS")
+        if resolution == "yearly":
+            return _resample(self._rollup("daily"), "YS")
+
+        monthly = self._rollup("monthly")
+        if monthly.empty:
+            return monthly
+        if resolution == "climatology":
+            reference = (
+                monthly
+                if baseline is None
+                else monthly[
+                    (monthly.index.year >= baseline[0])
+                    & (monthly.index.year <= baseline[1])
+                ]
+            )
+            climatology = reference.groupby(reference.index.month).mean()
+            directions = [
+                column
+                for column in reference.columns
+                if _rollup_aggregation(column) == "circular_mean"
+            ]
+            if directions:
+                climatology[directions] = _circular_mean(
+                    reference[directions],
+                    lambda frame: frame.groupby(frame.index.month),
+                )
+            return climatology.rename_axis("month")
+        if resolution == "anomalies":
+            climatology = self._rollup("climatology", baseline)
+            anomalies = monthly - climatology.reindex(monthly.index.month).set_axis(
+                monthly.index
+            )
+            # Direction anomalies are wrapped to the shortest turn, between -180° and 180°
+            directions = [
+                column
+                for column in anomalies.columns
+                if _rollup_aggregation(column) == "circular_mean"
+            ]
+            anomalies[directions] = (anomalies[directions] + 180) % 360 - 180
+            return anomalies
+
+        raise ValueError(
+            f"Invalid rollup resolution {resolution}, expected one of {ROLLUP_RESOLUTIONS}"
+        )
+
+    def _rollup(
+        self, resolution: str, baseline: Optional[tuple[int, int]] = None
+    ) -> pd.DataFrame:
+        """Cached rollup, indexed by time (or month for the climatology)"""
+        fingerprint = self._data_fingerprint()
+        if self._rollups_source != fingerprint:
+            self._rollups = {}
+            self._rollups_source = fingerprint
+
+        key = (resolution, tuple(baseline) if baseline is not None else None)
+        if key not in self._rollups:
+            self._rollups[key] = self._compute_rollup(resolution, baseline)
+        return self._rollups[key]
+
+    def rollup(
+        self, resolution: str, baseline: Optional[tuple[int, int]] = None
+    ) -> pd.DataFrame:
+        """
+        Get the data aggregated to a coarser resolution, computed once and cached until the data changes.
+        Accumulated variables (precipitation, durations, sums) are summed, daily maxima and minima keep
+        their extremes, probabilities and weather codes keep their maximum, directions get a circular mean
+        and other variables are averaged.
+
+        Args:
+            resolution (str): daily, monthly or yearly series with a time column,
+                climatology: mean of each calendar month with a month column (1-12),
+                anomalies: monthly series minus the climatology of its calendar month
+            baseline (tuple[int, int]): First and last years of the climatology period, defaults to the whole series
+
+        Returns:
+            pd.DataFrame: A copy of the rollup
+        """
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(
+                f"Invalid rollup resolution {resolution}, expected one of {ROLLUP_RESOLUTIONS}"
+            )
+        return self._rollup(resolution, baseline).reset_index()
+
+    def generate_data_preview(self) -> str:
+        """
+        Generate a compact schema-and-stats preview of the data for code generation prompts.
+
+        Returns:
+            str: The formatted preview
+        """
+        previews = []
+
+        if self.metadata is not None and not self.metadata.empty:
+            scalars = {
+                key: value
+                for key, value in self.metadata.iloc[0].items()
+                if not isinstance(value, (dict, list))
+            }
+            previews.append(
+                "metadata: "
+                + ", ".join(f"{key}={value}" for key, value in scalars.items())
+            )
+
+        previews.append(
+            generate_frame_preview(
+                "hourly_data", self.hourly_data, self._get_units("hourly_units")
+            )
+        )
+        previews.append(
+            generate_frame_preview(
+                "daily_data", self.daily_data, self._get_units("daily_units")
+            )
+        )
+
+        # The rollups are described from the raw frames, computing them is left to the generated code
+        frames = [
+            frame
+            for frame in (
+                _time_indexed(self.daily_data),
+                _time_indexed(self.hourly_data),
+            )
+            if not frame.empty
+        ]
+        if frames:
+            start = min(frame.index.min() for frame in frames)
+            end = max(frame.index.max() for frame in frames)
+            rows = {
+                "daily": (end.normalize() - start.normalize()).days + 1,
+                "monthly": (end.year - start.year) * 12 + end.month - start.month + 1,
+                "yearly": end.year - start.year + 1,
+            }
+            sizes = ", ".join(
+                f"{resolution} {count} rows" for resolution, count in rows.items()
+            )
+            columns = dict.fromkeys(
+                column for frame in frames for column in frame.columns
+            )
+            previews.append(f"rollups: {sizes} | columns: {', '.join(columns)}")
+
+        return "\n".join(previews)
+
     def generate_data_description(self) -> str:
         """
         Generate a statistical description of temporal data.
@@ -144,27 +556,25 @@ class NormalizedOpenMeteoData(BaseModel):
             String containing statistical description
         """
         description = []
-        
-        if self.hourly_data is not None:
-            numeric_cols = self.hourly_data.select_dtypes(include=['float64', 'int64']).columns
-            numeric_cols = [col for col in numeric_cols if col != 'time']
-            
-            if len(numeric_cols) > 0:
-                stats = self.hourly_data[numeric_cols].describe()
-                description.append("Hourly Data:")
-                description.append(f"Time range: {self.hourly_data['time'].min()} to {self.hourly_data['time'].max()}")
-                for col in numeric_cols:
-                    description.append(f"{col}: mean={stats[col]['mean']:.2f}, min={stats[col]['min']:.2f}, max={stats[col]['max']:.2f}")
-        
-        if self.daily_data is not None:
-            numeric_cols = self.daily_data.select_dtypes(include=['float64', 'int64']).columns
-            numeric_cols = [col for col in numeric_cols if col != 'time']
-            
-            if len(numeric_cols) > 0:
-                stats = self.daily_data[numeric_cols].describe()
-                description.append("\nDaily Data:")
-                description.append(f"Time range: {self.daily_data['time'].min()} to {self.daily_data['time'].max()}")
-                for col in numeric_cols:
-                    description.append(f"{col}: mean={stats[col]['mean']:.2f}, min={stats[col]['min']:.2f}, max={stats[col]['max']:.2f}")
-        
+
+        for title, df in (
+            ("Hourly Data:", self.hourly_data),
+            ("Daily Data:", self.daily_data),
+        ):
+            if df is None or df.empty:
+                continue
+
+            stats = compute_stats(df)
+            if stats:
+                times = pd.Index(df["time"]) if "time" in df.columns else None
+                if description:
+                    description.append("")
+                description.append(title)
+                if times is not None:
+                    # Open-Meteo series are returned sorted
+                    description.append(f"Time range: {times[0]} to {times[-1]}")
+                description.extend(
+                    describe_stats(column_stats, times) for column_stats in stats
+                )
+
         return "\n".join(description)
\ No newline at end of file
@@ -0,0 +1,709 @@
+import logging
+import re
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Union
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import numpy as np
+import pandas as pd
+
+from .api import OpenMeteoAPI, VARIABLE_QUERY_KEYS
+from .models import (
+    APIEndpoint,
+    APIEndpointResponse,
+    DataProcessingType,
+    NormalizedOpenMeteoData,
+    VisualizationType,
+)
+
+# Open-Meteo accepts up to 1000 locations per call, but each one counts against the quota
+MAX_LOCATIONS_PER_REQUEST = 50
+
+Location = tuple[str, str]
+
+# Parameters bounding the time range of a request, a request is served by data whose range contains its own
+RANGE_PARAMETERS = (("start_date", "end_date"), ("start_hour", "end_hour"))
+
+# Resolutions below a day, named anywhere in the requirements: hourly data must be kept
+SUB_DAILY_PATTERN = re.compile(
+    r"\b(hourly|hours?|\d+-hourly|diurnal|intraday|sub-daily|time of day|daily cycle|minutes?|minutely|15-minute)\b"
+)
+# Explicit aggregation of the values to daily resolution or coarser, in the processing steps.
+# Durations such as "5 days" or "30 years" are time ranges, not aggregations.
+AGGREGATE_PATTERN = re.compile(
+    r"\b(daily (mean|average|total|sum|max\w*|min\w*|values?)|per day|(weekly|monthly|annual|yearly|seasonal) "
+    r"(mean|average|total|sum|max\w*|min\w*|values?|aggregates?)|aggregat\w+ (to|by|per|into) (day|week|month|year|season)s?|"
+    r"resampl\w+ (to|by|per) (day|week|month|year)s?|moving average|rolling (mean|average)|climatology)\b"
+)
+MAX_PATTERN = re.compile(r"\b(max|maximum|maxima|highest|peaks?|hottest|extremes?)\b")
+MIN_PATTERN = re.compile(r"\b(min|minimum|minima|lowest|coldest|extremes?)\b")
+
+
+@dataclass
+class RequestSource:
+    """A single-location slice of an endpoint requested by the LLM"""
+
+    endpoint_index: int
+    location_index: int
+    location: Location
+    variables: dict[str, tuple[str, ...]]
+
+
+@dataclass
+class PlannedRequest:
+    """A merged request to send to the API, covering one or more sources"""
+
+    base_url: str
+    parameters: tuple[tuple[str, str], ...]
+    locations: list[Location] = field(default_factory=list)
+    variables: dict[str, tuple[str, ...]] = field(default_factory=dict)
+    sources: list[RequestSource] = field(default_factory=list)
+
+    @property
+    def url(self) -> str:
+        query = dict(self.parameters)
+        query["latitude"] = ",".join(latitude for latitude, _ in self.locations)
+        query["longitude"] = ",".join(longitude for _, longitude in self.locations)
+        for key, variables in self.variables.items():
+            query[key] = ",".join(variables)
+
+        return f"{self.base_url}?{urlencode(sorted(query.items()), safe=',:/')}"
+
+    def source_url(self, source: RequestSource) -> str:
+        """Canonical single-location URL of the data a source gets from this request"""
+        return PlannedRequest(
+            self.base_url, self.parameters, [source.location], source.variables
+        ).url
+
+
+def _split_url(
+    url: str,
+) -> tuple[
+    str, tuple[tuple[str, str], ...], list[Location], dict[str, tuple[str, ...]]
+]:
+    """
+    Split a canonical URL into its base, shared parameters, locations and variables.
+
+    Args:
+        url (str): Canonical URL returned by API.validate_url
+
+    Returns:
+        tuple: Base URL, shared parameters, locations and variables per query key
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+
+    latitudes = query.pop("latitude").split(",")
+    longitudes = query.pop("longitude").split(",")
+    if len(latitudes) != len(longitudes):
+        raise ValueError(
+            f"Got {len(latitudes)} latitudes and {len(longitudes)} longitudes in {url}"
+        )
+
+    variables = {
+        key: tuple(query.pop(key).split(","))
+        for key in VARIABLE_QUERY_KEYS
+        if key in query
+    }
+
+    return (
+        f"{parts.scheme}://{parts.netloc}{parts.path}",
+        tuple(sorted(query.items())),
+        list(zip(latitudes, longitudes)),
+        variables,
+    )
+
+
+def plan_requests(endpoints: List[APIEndpoint]) -> List[PlannedRequest]:
+    """
+    Merge compatible endpoints into the fewest API requests.
+    Endpoints for the same location and time range are merged into one request with all their variables,
+    then requests for the same variables are merged into one multi-location request.
+    Identical endpoints are only requested once.
+
+    Args:
+        endpoints (List[APIEndpoint]): Endpoints generated by the LLM
+
+    Returns:
+        List[PlannedRequest]: The requests to send
+    """
+    seen_urls = set()
+    by_location: dict[tuple, PlannedRequest] = {}
+
+    for endpoint_index, endpoint in enumerate(endpoints):
+        try:
+            url = OpenMeteoAPI.validate_url(endpoint.url)
+            base_url, parameters, locations, variables = _split_url(url)
+        except ValueError as e:
+            logging.warning(f"Data Validation Error for {endpoint.url}: {str(e)}")
+            continue
+
+        if url in seen_urls:
+            continue
+        seen_urls.add(url)
+
+        # First pass: one request per location, with the union of the requested variables
+        for location_index, location in enumerate(locations):
+            key = (base_url, parameters, location)
+            planned = by_location.setdefault(
+                key, PlannedRequest(base_url, parameters, [location])
+            )
+            for query_key, names in variables.items():
+                planned.variables[query_key] = tuple(
+                    sorted(set(planned.variables.get(query_key, ())) | set(names))
+                )
+            planned.sources.append(
+                RequestSource(endpoint_index, location_index, location, variables)
+            )
+
+    # Second pass: merge the locations sharing the same variables and parameters
+    by_variables: dict[tuple, list[PlannedRequest]] = {}
+    for planned in by_location.values():
+        key = (
+            planned.base_url,
+            planned.parameters,
+            tuple(sorted(planned.variables.items())),
+        )
+        merged = by_variables.setdefault(key, [])
+
+        if not merged or len(merged[-1].locations) >= MAX_LOCATIONS_PER_REQUEST:
+            merged.append(
+                PlannedRequest(
+                    planned.base_url, planned.parameters, variables=planned.variables
+                )
+            )
+        merged[-1].locations.extend(planned.locations)
+        merged[-1].sources.extend(planned.sources)
+
+    return [planned for merged in by_variables.values() for planned in merged]
+
+
+def _serves(
+    available: tuple, base_url: str, parameters: dict, location: Location
+) -> bool:
+    """
+    Check whether data fetched with a URL serves a request for the same location and variables.
+    Every parameter must match, except the time range which must contain the requested one.
+
+    Args:
+        available (tuple): The split canonical URL of the data
+        base_url (str): Base URL of the request
+        parameters (dict): Shared parameters of the request
+        location (Location): Location of the request
+
+    Returns:
+        bool: Whether the data covers the request
+    """
+    available_base_url, available_parameters, available_locations, _ = available
+    if available_base_url != base_url or location not in available_locations:
+        return False
+
+    available_parameters = dict(available_parameters)
+    range_keys = {key for keys in RANGE_PARAMETERS for key in keys}
+    if {k: v for k, v in available_parameters.items() if k not in range_keys} != {
+        k: v for k, v in parameters.items() if k not in range_keys
+    }:
+        return False
+
+    for start_key, end_key in RANGE_PARAMETERS:
+        start, end = parameters.get(start_key), parameters.get(end_key)
+        available_start, available_end = available_parameters.get(
+            start_key
+        ), available_parameters.get(end_key)
+        if (start is None) != (available_start is None) or (end is None) != (
+            available_end is None
+        ):
+            return False
+        # ISO dates and hours compare in chronological order as strings
+        if (
+            start is not None
+            and start < available_start
+            or end is not None
+            and end > available_end
+        ):
+            return False
+
+    return True
+
+
+@dataclass
+class LocationPlan:
+    """Data of a requested location: the entries in memory serving some of its variables, and the request of the others"""
+
+    base_url: str
+    parameters: dict[str, str]
+    location: Location
+    variables: dict[str, tuple[str, ...]]
+    reused: list[int] = field(default_factory=list)
+    missing: Optional[APIEndpoint] = None
+
+    @property
+    def url(self) -> str:
+        """Canonical single-location URL of the requested data"""
+        return PlannedRequest(
+            self.base_url,
+            tuple(sorted(self.parameters.items())),
+            [self.location],
+            self.variables,
+        ).url
+
+
+def plan_missing(
+    endpoints: List[APIEndpoint], available_urls: List[str]
+) -> List[LocationPlan]:
+    """
+    Split endpoints between data already in memory and data to fetch.
+    A variable is served by data fetched for the same endpoint, location and parameters over a time range
+    containing the requested one, only the other variables are requested again. A variable whose range is
+    only partly in memory is requested again over its whole range.
+
+    Args:
+        endpoints (List[APIEndpoint]): Endpoints generated by the LLM
+        available_urls (List[str]): Canonical single-location URLs of the data in memory
+
+    Returns:
+        List[LocationPlan]: Per endpoint and location, the indices of the available URLs serving it
+            and the single-location endpoint of its missing variables
+    """
+    available = []
+    for url in available_urls:
+        try:
+            available.append(_split_url(url))
+        except (KeyError, ValueError):
+            available.append(None)
+
+    plans: list[LocationPlan] = []
+
+    for endpoint in endpoints:
+        try:
+            base_url, parameters, locations, variables = _split_url(
+                OpenMeteoAPI.validate_url(endpoint.url)
+            )
+        except ValueError as e:
+            logging.warning(f"Data Validation Error for {endpoint.url}: {str(e)}")
+            continue
+        parameters = dict(parameters)
+
+        for location in locations:
+            serving = [
+                i
+                for i, entry in enumerate(available)
+                if entry is not None and _serves(entry, base_url, parameters, location)
+            ]
+            plan = LocationPlan(base_url, parameters, location, variables)
+
+            missing_variables: dict[str, tuple[str, ...]] = {}
+            for key, names in variables.items():
+                for name in names:
+                    index: Optional[int] = next(
+                        (i for i in serving if name in available[i][3].get(key, ())),
+                        None,
+                    )
+                    if index is None:
+                        missing_variables[key] = missing_variables.get(key, ()) + (
+                            name,
+                        )
+                    elif index not in plan.reused:
+                        plan.reused.append(index)
+
+            if missing_variables:
+                planned = PlannedRequest(
+                    base_url,
+                    tuple(sorted(parameters.items())),
+                    [location],
+                    missing_variables,
+                )
+                plan.missing = APIEndpoint(url=planned.url)
+            plans.append(plan)
+
+    return plans
+
+
+def _models(parameters: Union[dict, tuple]) -> tuple[str, ...]:
+    """Models requested by query parameters, whose names suffix the variables of multi-model responses"""
+    models = dict(parameters).get("models")
+    return tuple(model.lower() for model in models.split(",")) if models else ()
+
+
+def _response_variable(name: str, models: tuple[str, ...]) -> str:
+    """Requested variable of a response key, without the model suffix of multi-model responses"""
+    for model in models:
+        if name.lower().endswith(f"_{model}"):
+            return name[: -len(model) - 1]
+    return name
+
+
+def _select_variables(
+    location_data: dict,
+    variables: dict[str, tuple[str, ...]],
+    models: tuple[str, ...] = (),
+) -> dict:
+    """
+    Restrict a single-location response to the variables requested by a source.
+
+    Args:
+        location_data (dict): JSON response for one location
+        variables (dict): Variables requested by the source per query key
+        models (tuple[str, ...]): Lowercase models of the request, e.g. temperature_2m_mean_mri_agcm3_2_s
+            is kept for temperature_2m_mean when several models are requested
+
+    Returns:
+        dict: Shallow copy of the response with only the requested variables
+    """
+    selected = dict(location_data)
+    for resolution in ("hourly", "daily", "current"):
+        keep = {"time", "interval", *variables.get(resolution, ())}
+        for key in (resolution, f"{resolution}_units"):
+            if key in selected:
+                selected[key] = {
+                    name: values
+                    for name, values in selected[key].items()
+                    if name in keep or _response_variable(name, models) in keep
+                }
+
+        if resolution in selected and resolution not in variables:
+            selected.pop(resolution)
+            selected.pop(f"{resolution}_units", None)
+
+    return selected
+
+
+def split_response(
+    planned: PlannedRequest, json_data: Union[dict, list]
+) -> Iterator[tuple[RequestSource, dict]]:
+    """
+    Split the response of a merged request back into one response per source.
+
+    Args:
+        planned (PlannedRequest): The request that was sent
+        json_data (dict | list): Its JSON response, a list when several locations were requested
+
+    Returns:
+        Iterator[tuple[RequestSource, dict]]: Each source with its single-location response
+    """
+    location_responses = json_data if isinstance(json_data, list) else [json_data]
+    if len(location_responses) != len(planned.locations):
+        raise ValueError(
+            f"Expected {len(planned.locations)} locations, got {len(location_responses)} from {planned.url}"
+        )
+
+    by_location = dict(zip(planned.locations, location_responses))
+    models = _models(planned.parameters)
+    for source in planned.sources:
+        yield source, _select_variables(
+            by_location[source.location], source.variables, models
+        )
+
+
+def _range_bounds(parameters: dict) -> list[tuple[str, str, int]]:
+    """Start, end and length of the ISO bounds of the time ranges of request parameters"""
+    return [
+        (parameters[start_key], parameters[end_key], len(parameters[start_key]))
+        for start_key, end_key in RANGE_PARAMETERS
+        if start_key in parameters and end_key in parameters
+    ]
+
+
+def _trim_range(location_data: dict, parameters: dict) -> dict:
+    """Restrict a single-location response to the time range of request parameters"""
+    bounds = _range_bounds(parameters)
+    if not bounds:
+        return location_data
+
+    trimmed = dict(location_data)
+    for resolution in ("hourly", "daily"):
+        if resolution not in trimmed or "time" not in trimmed[resolution]:
+            continue
+        # ISO times are compared on the precision of the bound, days for dates and minutes for hours
+        keep = [
+            i
+            for i, time_value in enumerate(trimmed[resolution]["time"])
+            if all(start <= time_value[:length] <= end for start, end, length in bounds)
+        ]
+        trimmed[resolution] = {
+            name: [values[i] for i in keep]
+            for name, values in trimmed[resolution].items()
+        }
+
+    return trimmed
+
+
+def restrict_entry(
+    entry: NormalizedOpenMeteoData,
+    parameters: dict,
+    variables: dict[str, tuple[str, ...]],
+) -> NormalizedOpenMeteoData:
+    """
+    Restrict data in memory to the variables and time range of a request, like a response is for its sources.
+
+    Args:
+        entry (NormalizedOpenMeteoData): Data fetched over a containing time range
+        parameters (dict): Shared parameters of the request
+        variables (dict): Variables of the request per query key
+
+    Returns:
+        NormalizedOpenMeteoData: The restricted data, sharing the metadata of the entry
+    """
+    models = _models(parameters)
+    bounds = _range_bounds(parameters)
+    frames = {}
+    for resolution in ("hourly", "daily"):
+        df = getattr(entry, f"{resolution}_data")
+        keep = set(variables.get(resolution, ()))
+        if df is None or df.empty or "time" not in df.columns or not keep:
+            frames[resolution] = pd.DataFrame()
+            continue
+
+        columns = ["time"] + [
+            column
+            for column in df.columns
+            if column in keep or _response_variable(column, models) in keep
+        ]
+        times = df["time"].astype(str)
+        mask = np.ones(len(df), dtype=bool)
+        for start, end, length in bounds:
+            prefix = times.str[:length]
+            mask &= ((prefix >= start) & (prefix <= end)).to_numpy()
+        frames[resolution] = df.loc[mask, columns].reset_index(drop=True)
+
+    return NormalizedOpenMeteoData(
+        metadata=entry.metadata,
+        hourly_data=frames["hourly"],
+        daily_data=frames["daily"],
+    )
+
+
+class PrefetchedResponses:
+    """
+    Single-location responses fetched ahead of the requests, e.g. by the warm-up job.
+    A request is served when each of its locations has a response for the same endpoint and parameters,
+    with all the requested variables over a containing time range. The response is cut down to the request.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[float, tuple, dict]] = {}
+
+    def add(self, url: str, location_data: dict, ttl: Optional[float] = None) -> None:
+        """
+        Add a response.
+
+        Args:
+            url (str): Canonical single-location URL of the response
+            location_data (dict): The JSON response
+            ttl (float): Time to live of the response in seconds, defaults to the ttl of the store
+        """
+        with self._lock:
+            self._entries[url] = (
+                time.monotonic() + (self.ttl if ttl is None else ttl),
+                _split_url(url),
+                location_data,
+            )
+
+    def get(self, url: str) -> Optional[Union[dict, list]]:
+        """
+        Serve a request from the prefetched responses.
+
+        Args:
+            url (str): Canonical URL of the request
+
+        Returns:
+            dict | list: The response, shaped like the API response, None when a location isn't served
+        """
+        try:
+            base_url, parameters, locations, variables = _split_url(url)
+        except (KeyError, ValueError):
+            return None
+        parameters = dict(parameters)
+
+        with self._lock:
+            now = time.monotonic()
+            for expired in [
+                key
+                for key, (expires_at, _, _) in self._entries.items()
+                if expires_at < now
+            ]:
+                del self._entries[expired]
+            entries = list(self._entries.values())
+
+        responses = []
+        for location in locations:
+            response = next(
+                (
+                    location_data
+                    for _, available, location_data in entries
+                    if _serves(available, base_url, parameters, location)
+                    and all(
+                        set(names) <= set(available[3].get(key, ()))
+                        for key, names in variables.items()
+                    )
+                ),
+                None,
+            )
+            if response is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            responses.append(
+                _trim_range(
+                    _select_variables(response, variables, _models(parameters)),
+                    parameters,
+                )
+            )
+
+        with self._lock:
+            self.hits += 1
+        return responses if len(responses) > 1 else responses[0]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def _daily_equivalents(
+    name: str,
+    hourly_description: str,
+    daily_parameters: dict,
+    wants_max: bool,
+    wants_min: bool,
+) -> list[str]:
+    """
+    Find the daily aggregates equivalent to an hourly variable.
+    Instant variables map to their daily mean, or to their daily maximum and minimum when there is no mean,
+    the midpoint of the two standing for it. Accumulated variables map to their daily sum.
+    Otherwise, daily maximum and minimum are only added when the processing asks for extremes.
+
+    Args:
+        name (str): Name of the hourly variable
+        hourly_description (str): Catalog description of the hourly variable
+        daily_parameters (dict): Daily parameters available on the same endpoint
+        wants_max (bool): Whether the processing needs maximum values
+        wants_min (bool): Whether the processing needs minimum values
+
+    Returns:
+        list[str]: The daily variables replacing the hourly one, empty if there is no equivalent
+    """
+    if hourly_description.lower().startswith("preceding hour sum"):
+        candidates = [f"{name}_sum", name]
+    else:
+        candidates = [f"{name}_mean"]
+
+    equivalents = [
+        candidate for candidate in candidates if candidate in daily_parameters
+    ][:1]
+    if not equivalents:
+        extremes = [f"{name}_max", f"{name}_min"]
+        # Without a daily mean, the daily range of an instant variable stands for it
+        if candidates == [f"{name}_mean"] and all(
+            extreme in daily_parameters for extreme in extremes
+        ):
+            return extremes
+        # A single extreme can't replace the series the processing averages or sums
+        return []
+
+    if wants_max and f"{name}_max" in daily_parameters:
+        equivalents.append(f"{name}_max")
+    if wants_min and f"{name}_min" in daily_parameters:
+        equivalents.append(f"{name}_min")
+
+    return equivalents
+
+
+def plan_resolution(
+    api_endpoints: APIEndpointResponse,
+    data_requirements: DataProcessingType,
+    visualization_type: VisualizationType,
+) -> APIEndpointResponse:
+    """
+    Rewrite endpoints to request the coarsest data that still serves the visualization.
+    Hourly variables are replaced by their daily aggregates when the processing steps explicitly
+    aggregate to daily or coarser values and no sub-daily resolution is named anywhere in the requirements.
+    Invalid endpoints are returned unchanged so retrieval reports them.
+
+    Args:
+        api_endpoints (APIEndpointResponse): Endpoints generated by the LLM
+        data_requirements (DataProcessingType): Needed data and processing steps
+        visualization_type (VisualizationType): Visualization details
+
+    Returns:
+        APIEndpointResponse: The rewritten endpoints
+    """
+    text = f"{data_requirements.needed_data}\n{data_requirements.data_processing_steps}\n{visualization_type}".lower()
+
+    aggregated = bool(
+        AGGREGATE_PATTERN.search(data_requirements.data_processing_steps.lower())
+    ) and not SUB_DAILY_PATTERN.search(text)
+    wants_max = bool(MAX_PATTERN.search(text))
+    wants_min = bool(MIN_PATTERN.search(text))
+
+    planned_endpoints = []
+    for endpoint in api_endpoints.endpoints:
+        try:
+            url = OpenMeteoAPI.validate_url(endpoint.url)
+        except ValueError:
+            planned_endpoints.append(endpoint)
+            continue
+
+        catalog = OpenMeteoAPI.get_endpoint(url).parameters or {}
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+
+        hourly = query["hourly"].split(",") if "hourly" in query else []
+        daily = query["daily"].split(",") if "daily" in query else []
+
+        downgraded = False
+        if aggregated and hourly and catalog.get("daily_parameters"):
+            kept_hourly = []
+            for variable in hourly:
+                equivalents = _daily_equivalents(
+                    variable,
+                    catalog["hourly_parameters"][variable],
+                    catalog["daily_parameters"],
+                    wants_max,
+                    wants_min,
+                )
+                if equivalents:
+                    logging.info(
+                        f"Downgrading hourly {variable} to daily {equivalents}"
+                    )
+                    daily.extend(
+                        equivalent
+                        for equivalent in equivalents
+                        if equivalent not in daily
+                    )
+                    downgraded = True
+                else:
+                    kept_hourly.append(variable)
+            hourly = kept_hourly
+
+        for key, variables in (("hourly", hourly), ("daily", daily)):
+            if variables:
+                query[key] = ",".join(sorted(variables))
+            else:
+                query.pop(key, None)
+
+        if downgraded and not hourly and "timezone" not in query:
+            # Align the new daily aggregates on local time rather than GMT, unless it would shift hourly series
+            query["timezone"] = "auto"
+
+        planned_endpoints.append(
+            APIEndpoint(
+                url=f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(sorted(query.items()), safe=',:/')}"
+            )
+        )
+
+    return APIEndpointResponse(endpoints=planned_endpoints)
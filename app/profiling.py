@@ -0,0 +1,243 @@
+import cProfile
+import hashlib
+import json
+import linecache
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .constants import PROFILING_SAMPLE_RATE, PROFILING_OUTPUT_DIR
+
+# Profiled stages running in the process, tracemalloc is traced while there is one
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+# Whether the profiler started tracemalloc, tracing started by something else is left running
+_started_tracing = False
+# cProfile can't nest within a thread, inner stages are only timed and traced
+_thread_state = threading.local()
+# Names of the registered sources, the oldest are dropped from linecache
+_MAX_REGISTERED_SOURCES = 64
+_registered_sources: deque[str] = deque()
+
+
+def register_source(code: str, kind: str = "generated") -> str:
+    """
+    Give a name to source code executed dynamically, e.g. LLM generated code,
+    so profiles and tracebacks point to its lines instead of to <string>.
+
+    Args:
+        code (str): The source code
+        kind (str): Kind of code, part of the name
+
+    Returns:
+        str: The file name to compile the code with
+    """
+    filename = f"<{kind}-{hashlib.sha1(code.encode('utf-8')).hexdigest()[:12]}>"
+    with _tracing_lock:
+        if filename not in linecache.cache:
+            _registered_sources.append(filename)
+            if len(_registered_sources) > _MAX_REGISTERED_SOURCES:
+                linecache.cache.pop(_registered_sources.popleft(), None)
+        linecache.cache[filename] = (
+            len(code),
+            None,
+            code.splitlines(keepends=True),
+            filename,
+        )
+    return filename
+
+
+def _frame_name(function: tuple[str, int, str]) -> str:
+    """Flamegraph frame of a pstats function, without the separators of the collapsed format"""
+    filename, line, name = function
+    if filename == "~":
+        return name.replace(" ", "_").replace(";", ",")
+    return f"{name}@{os.path.basename(filename)}:{line}".replace(" ", "_").replace(
+        ";", ","
+    )
+
+
+def collapse_stats(stats: pstats.Stats, root: str) -> list[str]:
+    """
+    Turn profile statistics into the collapsed stack format of flamegraph tools.
+    cProfile only records caller-callee pairs, so each function is placed under its most expensive caller chain.
+
+    Args:
+        stats (pstats.Stats): The statistics
+        root (str): Root frame of every stack, e.g. the stage name
+
+    Returns:
+        list[str]: Lines "frame;frame;frame microseconds"
+    """
+    entries = stats.stats
+
+    def primary_caller(function):
+        callers = entries[function][4]
+        return max(callers, key=lambda caller: callers[caller][3]) if callers else None
+
+    lines = []
+    for function, (_, _, own_time, _, _) in entries.items():
+        microseconds = int(own_time * 1e6)
+        if microseconds <= 0:
+            continue
+
+        stack, seen = [function], {function}
+        caller = primary_caller(function)
+        while caller is not None and caller in entries and caller not in seen:
+            stack.append(caller)
+            seen.add(caller)
+            caller = primary_caller(caller)
+
+        lines.append(
+            ";".join([root] + [_frame_name(frame) for frame in reversed(stack)])
+            + f" {microseconds}"
+        )
+    return lines
+
+
+class PipelineProfiler:
+    """
+    CPU and memory profile of a pipeline run, one entry per stage.
+    Each stage writes its cProfile statistics, viewable with pstats or snakeviz, and its collapsed stacks
+    to a directory per run, along with a summary of the stage durations and peak allocations.
+    cProfile only sees the thread running the stage, and tracemalloc peaks include the allocations
+    of the other requests running at the same time.
+    """
+
+    def __init__(
+        self, output_dir: str = PROFILING_OUTPUT_DIR, run_id: Optional[str] = None
+    ):
+        self.run_id = (
+            run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        )
+        self.path = os.path.join(output_dir, self.run_id)
+        self.stages: list[dict] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def sample(
+        cls, profile: Optional[bool] = None, rate: float = PROFILING_SAMPLE_RATE
+    ) -> Optional["PipelineProfiler"]:
+        """
+        Create a profiler for a run, when requested or sampled.
+
+        Args:
+            profile (bool): True to profile the run, False not to, None to sample it
+            rate (float): Sampling rate of the runs
+
+        Returns:
+            PipelineProfiler: The profiler, None when the run isn't profiled
+        """
+        if profile or (profile is None and rate > 0 and random.random() < rate):
+            return cls()
+        return None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Profile a stage.
+
+        Args:
+            name (str): Name of the stage
+        """
+        global _tracing_stages, _started_tracing
+
+        with _tracing_lock:
+            if _tracing_stages == 0:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _started_tracing = True
+                # Nested and concurrent stages share the peak of the outermost one, overestimating theirs
+                tracemalloc.reset_peak()
+            _tracing_stages += 1
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        profiler = None
+        if not getattr(_thread_state, "active", False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                _thread_state.active = True
+            except ValueError as e:
+                # Python 3.12+ allows a single active profiler per process
+                logging.warning(f"Stage {name} not profiled: {str(e)}")
+                profiler = None
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                _thread_state.active = False
+
+            with _tracing_lock:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                _tracing_stages -= 1
+                if _tracing_stages == 0 and _started_tracing:
+                    tracemalloc.stop()
+                    _started_tracing = False
+
+            try:
+                self._write_stage(
+                    name, duration, max(peak_memory - start_memory, 0), profiler
+                )
+            except OSError as e:
+                logging.warning(f"Error writing the profile of stage {name}: {str(e)}")
+
+    def _write_stage(
+        self,
+        name: str,
+        duration: float,
+        peak_memory: int,
+        profiler: Optional[cProfile.Profile],
+    ) -> None:
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            entry = {
+                "stage": name,
+                "duration": duration,
+                "peak_memory_bytes": peak_memory,
+                "profile": None,
+            }
+
+            if profiler is not None:
+                stats = pstats.Stats(profiler)
+                entry["profile"] = f"{len(self.stages):02d}-{name}.prof"
+                stats.dump_stats(os.path.join(self.path, entry["profile"]))
+                with open(os.path.join(self.path, "stacks.folded"), "a") as file:
+                    file.writelines(line + "\n" for line in collapse_stats(stats, name))
+                self._write_sources(stats)
+
+            self.stages.append(entry)
+            with open(os.path.join(self.path, "summary.json"), "w") as file:
+                json.dump(
+                    {"run_id": self.run_id, "stages": self.stages}, file, indent=2
+                )
+
+    def _write_sources(self, stats: pstats.Stats) -> None:
+        """Save the dynamically executed code found in the profile, so its hotspots map back to its lines"""
+        for filename in {function[0] for function in stats.stats}:
+            if filename.startswith("<") and filename in linecache.cache:
+                with open(
+                    os.path.join(self.path, filename.strip("<>") + ".py"), "w"
+                ) as file:
+                    file.writelines(linecache.cache[filename][2])
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                "path": self.path,
+                "stages": list(self.stages),
+            }
@@ -115,19 +115,49 @@ The visualization type and needed data have already been defined, as following :
 # API Endpoint Information
 {API_ENDPOINT_INFORMATION}
 
+# Locations
+{locations}
+
 Your task is to define the API endpoint and inline-parameters to retrieve the required data.
-If not mentionned, the location should be set to Nagoya, Japan.
+Use the coordinates given above for the locations they list, don't guess them.
 Be careful about the potential amount of data that could be returned (ex. hourly data of 10 years or more isn't acceptable).
 DON'T HALLUCINATE ON THE PARAMETERS AND THE DATA. IF DATA ISN'T AVAILABLE IN WHAT WAS PROVIDED, DON'T INCLUDE IT.
 
 # Output Example
 Daily minimum, maximum and mean temperature in Nagoya, Japan from 2015-01-18 to 2025-02-01
-url="https://archive-api.open-meteo.com/v1/archive?latitude=52.52&longitude=13.41&start_date=2015-01-18&end_date=2025-02-01&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean"
+url="https://archive-api.open-meteo.com/v1/archive?latitude=35.1815&longitude=136.9064&start_date=2015-01-18&end_date=2025-02-01&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean"
 
 Hourly PM10 and PM2.5 concentration in Nagoya, Japan from 2015-01-01 to 2025-01-01
 url="https://air-quality-api.open-meteo.com/v1/air-quality?latitude=35.1815&longitude=136.9064&hourly=pm10,pm2_5&start_date=2015-01-01&end_date=2025-01-01"
 """
 
+REFINE_VISUALIZATION_PROMPT = """
+Your current task is to adapt a climate visualization to a follow-up message of a conversation.
+A visualization was already generated earlier in the conversation, and the data it used is still in memory.
+
+# Follow-up message
+{prompt}
+
+# Topic of interest
+{topic_of_interest}
+
+# Previous visualization
+{session}
+
+# API Endpoint Information
+{API_ENDPOINT_INFORMATION}
+
+# Locations
+{locations}
+
+Your task is to define the new visualization, the data it needs, the processing steps and the API endpoints of the data.
+List the endpoints of ALL the data the new visualization needs. Reuse the URLs of the data in memory as they are when they hold the needed data, they won't be downloaded again.
+Only the data missing from memory is downloaded, so keep the locations, time ranges and parameters of the data in memory unless the follow-up asks for others.
+Use the coordinates given above for the locations they list, don't guess them.
+Be careful about the potential amount of data that could be returned (ex. hourly data of 10 years or more isn't acceptable).
+DON'T HALLUCINATE ON THE PARAMETERS AND THE DATA. IF DATA ISN'T AVAILABLE IN WHAT WAS PROVIDED, DON'T INCLUDE IT.
+"""
+
 PROCESS_DATA_PROMPT = """
 Your current task is to create a function to process raw climate data for visualization.
 You should only return python code that will be then executed with python ```exec()```. Your response shouldn't contain any additional text or comments.
@@ -171,7 +201,7 @@ You have 2 tasks. First, you need to process the raw data for the defined visual
 - Processing Steps: {processing_steps}
 
 Your only output should be a function that encapsulate both tasks (processing and visualization) with this signature:
-def visualize(data: List[NormalizedOpenMeteoData]) -> go.Figure:
+def visualize(data: OpenMeteoDataset) -> go.Figure:
     '''
     Process raw climate data from OpenMeteo API and generate a Plotly visualization.
     '''
@@ -185,6 +215,17 @@ Information:
     metadata: Optional[pd.DataFrame] = Field(description="Dataframe containing data unrelated to time resolution")
     hourly_data: Optional[pd.DataFrame] = Field(description="Dataframe with hourly data")
     daily_data: Optional[pd.DataFrame] = Field(description="Dataframe with daily data")
+- NormalizedOpenMeteoData also provides precomputed aggregations, use them instead of resampling the raw data:
+    rollup("daily"), rollup("monthly"), rollup("yearly") -> pd.DataFrame with a datetime "time" column and one column per variable (sums for precipitation and durations, extremes for _max/_min, maxima for probabilities and weather_code, circular means for directions, means otherwise)
+    rollup("climatology", baseline=(first_year, last_year)) -> pd.DataFrame with a "month" column (1-12) and the mean of each variable per calendar month
+    rollup("anomalies", baseline=(first_year, last_year)) -> monthly pd.DataFrame with a "time" column and each variable minus its climatology
+    The baseline defaults to the whole period.
+- OpenMeteoDataset is a read-only list of NormalizedOpenMeteoData, one per location and endpoint, as labelled in the preview, use list(data) for a list you can modify. It also provides every entry in a single frame, use it to compare locations instead of concatenating the entries:
+    data.frame(resolution) -> pd.DataFrame indexed by (location, endpoint, time), one column per variable, for the hourly series or any rollup resolution above (indexed by month for "climatology")
+    data.long(resolution) -> the same data in long format, with location, endpoint, time, variable and value columns
+    data.view(location, resolution, endpoint=None) -> pd.DataFrame of a single location indexed by time, the endpoint is needed when the location has several
+    data.locations and data.endpoints -> names of the location and endpoint of each entry
+    The frames are shared, copy them before modifying them in place.
 
 Here's a preview of the data:
 {data_preview}
@@ -210,6 +251,13 @@ Here's a preview of the data:
     5. You must add imports, aliases, and any necessary code to make the function executable.
 """
 
+PREVIOUS_VISUALIZATION_CODE_PROMPT = """
+# Previous visualization code
+This visualization follows up on a previous one of the conversation, drawn with the code below from data in the same format.
+Reuse what still applies (processing, styling), but adapt it to the visualization goal and to the data preview above, the data indices may differ.
+{previous_code}
+"""
+
 ########################
 ## Explanation Prompts
 ########################
@@ -258,6 +306,31 @@ Ensure your explanation is clear, short and engaging.
 Use clear, accessible language while maintaining scientific accuracy. Avoid jargon where possible, but explain necessary technical terms. Include relevant comparisons and real-world examples to make the information more relatable.
 """
 
+EXPLANATION_SINGLE_CALL_PROMPT = """
+Explain the climate visualization to facilitate public understanding and discussion.
+
+First write a short explanation plan covering:
+- The key visual elements and the patterns or trends immediately visible
+- The primary climate-related message, with its temporal and geographic scope
+- The statistical or scientific concepts that need explanation
+- What matters for public discussion and which misconceptions it could address
+
+Then, following the plan, write the explanation itself.
+
+{figure}
+
+Here's information about the data that has been used
+{data_description}
+
+Ensure your explanation is clear, short and engaging.
+Use clear, accessible language while maintaining scientific accuracy. Avoid jargon where possible, but explain necessary technical terms. Include relevant comparisons and real-world examples to make the information more relatable.
+"""
+
+EXPLANATION_FIGURE_IMAGE = "The visualization is attached as an image."
+
+EXPLANATION_FIGURE_SUMMARY = """The visualization isn't attached, here is a summary of its traces:
+{trace_summary}"""
+
 
 ###########################
 ## Complexity Level Prompts
@@ -0,0 +1,293 @@
+import logging
+import math
+import threading
+import time
+
+from collections import deque
+from datetime import date, datetime
+from typing import Optional
+from urllib.parse import urlsplit, parse_qsl
+
+from .constants import (
+    OPEN_METEO_LIMITS,
+    OPEN_METEO_QUOTA_MAX_WAIT,
+    OPEN_METEO_RETRY_AFTER,
+)
+
+# A call covers up to this many variables and days of data, heavier requests count as several calls
+VARIABLES_PER_CALL = 10
+DAYS_PER_CALL = 14
+VARIABLE_KEYS = ("hourly", "daily", "current", "minutely_15")
+# Span of requests without explicit range, the forecast length of the API
+DEFAULT_DAYS = 7
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request can't get enough API budget in time"""
+
+
+def _split(value: Optional[str]) -> list[str]:
+    return [item for item in (value or "").split(",") if item.strip()]
+
+
+def _span_days(query: dict) -> float:
+    """Number of days of data requested"""
+    if query.get("start_date") and query.get("end_date"):
+        return (
+            date.fromisoformat(query["end_date"])
+            - date.fromisoformat(query["start_date"])
+        ).days + 1
+    if query.get("start_hour") and query.get("end_hour"):
+        hours = (
+            datetime.fromisoformat(query["end_hour"])
+            - datetime.fromisoformat(query["start_hour"])
+        ).total_seconds() / 3600
+        return (hours + 1) / 24
+    if "past_days" in query or "forecast_days" in query:
+        return int(query.get("past_days") or 0) + int(
+            query.get("forecast_days") or DEFAULT_DAYS
+        )
+    return DEFAULT_DAYS
+
+
+def estimate_request_weight(url: str) -> float:
+    """
+    Estimate the number of calls an API request counts for.
+    A request counts as one call per location up to 10 variables and 2 weeks of data,
+    and proportionally more beyond, e.g. 4 weeks of 20 variables count as 4 calls.
+
+    Args:
+        url (str): The request URL
+
+    Returns:
+        float: The weighted number of calls
+    """
+    query = dict(parse_qsl(urlsplit(url).query, keep_blank_values=True))
+
+    locations = max(1, len(_split(query.get("latitude"))))
+    models = max(1, len(_split(query.get("models"))))
+    variables = sum(len(_split(query.get(key))) for key in VARIABLE_KEYS)
+    try:
+        days = _span_days(query)
+    except ValueError:
+        days = DEFAULT_DAYS
+
+    return (
+        locations
+        * models
+        * max(1.0, variables / VARIABLES_PER_CALL)
+        * max(1.0, days / DAYS_PER_CALL)
+    )
+
+
+class QuotaScheduler:
+    """
+    Schedule API requests within the call limits of sliding time windows.
+    Requests wait for budget in arrival order: the request at the head holds the ones behind it,
+    even lighter ones that would fit, so a heavy request isn't postponed forever by a stream of light ones.
+    A request heavier than a window's limit is sent once that window is empty, the API counts it anyway.
+    A request that would wait longer than allowed, or than its stage has left, is rejected.
+    Background requests, e.g. prefetches, never hold the queue: they go when no request is queued
+    and they fit in the budget left after the share reserved to the others, in every window.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float, float]] = OPEN_METEO_LIMITS,
+        max_wait: float = OPEN_METEO_QUOTA_MAX_WAIT,
+        retry_after: float = OPEN_METEO_RETRY_AFTER,
+    ):
+        self.limits = limits
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+
+        self._condition = threading.Condition()
+        self._usage: dict[str, deque[tuple[float, float]]] = {
+            name: deque() for name in limits
+        }
+        self._used: dict[str, float] = {name: 0.0 for name in limits}
+        self._queue: deque[int] = deque()
+        self._next_ticket = 0
+        self._blocked_until = 0.0
+
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.rejected = 0
+        self.throttled = 0
+
+    def _prune(self, now: float) -> None:
+        for name, (window, _) in self.limits.items():
+            usage = self._usage[name]
+            while usage and usage[0][0] <= now - window:
+                self._used[name] -= usage.popleft()[1]
+            if not usage:
+                self._used[name] = 0.0
+
+    def _wait_time(
+        self, weight: float, now: float, reserved_share: float = 0.0
+    ) -> float:
+        """Seconds before the request fits in every window, 0 when it can be sent now, inf when it never will"""
+        self._prune(now)
+        wait = self._blocked_until - now
+
+        for name, (window, limit) in self.limits.items():
+            available = limit * (1 - reserved_share)
+            if reserved_share and weight > available:
+                return math.inf
+            # At most the whole window has to expire, for a request heavier than the limit
+            excess = min(self._used[name] + weight - available, self._used[name])
+            if excess <= 0:
+                continue
+            # Wait for the oldest calls of the window to expire until enough budget is freed
+            for sent_at, sent_weight in self._usage[name]:
+                excess -= sent_weight
+                if excess <= 0:
+                    wait = max(wait, sent_at + window - now)
+                    break
+            else:
+                wait = max(wait, self._usage[name][-1][0] + window - now)
+
+        return max(wait, 0.0)
+
+    def acquire(
+        self,
+        weight: float,
+        timeout: Optional[float] = None,
+        max_wait: Optional[float] = None,
+        reserved_share: float = 0.0,
+    ) -> float:
+        """
+        Wait for enough budget to send a request, then count it against the limits.
+
+        Args:
+            weight (float): Weighted number of calls of the request
+            timeout (float): Seconds the caller can wait at most, on top of the max_wait bound
+            max_wait (float): Overrides the scheduler's max_wait, e.g. for background jobs
+            reserved_share (float): Share of every window left to the other requests, makes it a background
+                request which waits behind every queued request instead of taking a place in the queue
+
+        Returns:
+            float: Seconds waited
+
+        Raises:
+            QuotaExceeded: If the request can't be sent in time
+        """
+        start = time.monotonic()
+        max_wait = self.max_wait if max_wait is None else max_wait
+        max_wait = max_wait if timeout is None else min(max_wait, timeout)
+        deadline = start + max_wait
+
+        with self._condition:
+            ticket = None
+            if not reserved_share:
+                ticket = self._next_ticket
+                self._next_ticket += 1
+                self._queue.append(ticket)
+            waited = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    # A background request is at the head when nothing is queued
+                    at_head = (
+                        self._queue[0] == ticket
+                        if ticket is not None
+                        else not self._queue
+                    )
+                    if at_head:
+                        wait = self._wait_time(weight, now, reserved_share)
+                        if wait <= 0:
+                            break
+                        if wait == math.inf:
+                            self.rejected += 1
+                            raise QuotaExceeded(
+                                f"{weight:.1f} calls exceed the budget left after the {reserved_share:.0%} reserved share"
+                            )
+                        if now + wait > deadline:
+                            self.rejected += 1
+                            raise QuotaExceeded(
+                                f"API budget exhausted, {weight:.1f} calls would wait {wait:.0f}s"
+                            )
+                    if now >= deadline:
+                        self.rejected += 1
+                        raise QuotaExceeded(
+                            f"Waited more than {max_wait:.0f}s for API budget"
+                        )
+                    waited = True
+                    self._condition.wait(
+                        min(wait, deadline - now)
+                        if wait is not None
+                        else deadline - now
+                    )
+
+                for name in self.limits:
+                    self._usage[name].append((now, weight))
+                    self._used[name] += weight
+
+                self.requests += 1
+                if waited:
+                    self.waits += 1
+                    self.wait_time += now - start
+                return now - start
+            finally:
+                if ticket is not None:
+                    self._queue.remove(ticket)
+                self._condition.notify_all()
+
+    def remaining(self, window: str) -> float:
+        """
+        Args:
+            window (str): Name of the window in the limits
+
+        Returns:
+            float: Weighted calls left in the window
+        """
+        with self._condition:
+            self._prune(time.monotonic())
+            return max(self.limits[window][1] - self._used[window], 0.0)
+
+    def throttle(self, retry_after: Optional[float] = None) -> None:
+        """
+        Stop sending requests for a while after the API answered 429 Too Many Requests.
+
+        Args:
+            retry_after (float): Seconds given by the Retry-After header, defaults to retry_after
+        """
+        retry_after = self.retry_after if retry_after is None else retry_after
+        logging.warning(
+            f"Open-Meteo rate limit reached, pausing requests for {retry_after:.0f}s"
+        )
+        with self._condition:
+            self.throttled += 1
+            self._blocked_until = max(
+                self._blocked_until, time.monotonic() + retry_after
+            )
+
+    def stats(self) -> dict:
+        """
+        Get the usage of the API budget.
+
+        Returns:
+            dict: Used and remaining calls per window, queued requests and scheduling counters
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._prune(now)
+            return {
+                "windows": {
+                    name: {
+                        "limit": limit,
+                        "used": round(self._used[name], 2),
+                        "remaining": round(max(limit - self._used[name], 0), 2),
+                    }
+                    for name, (_, limit) in self.limits.items()
+                },
+                "queued": len(self._queue),
+                "blocked_for": round(max(self._blocked_until - now, 0), 2),
+                "requests": self.requests,
+                "waits": self.waits,
+                "wait_time": round(self.wait_time, 3),
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+            }
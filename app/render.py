@@ -0,0 +1,229 @@
+import argparse
+import base64
+import io
+import logging
+import math
+import time
+
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from .constants import LLM_RENDER_PROFILE
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Anthropic downscales images beyond these, and bills about one token per 750 pixels
+ANTHROPIC_MAX_EDGE = 1568
+ANTHROPIC_MAX_PIXELS = 1_150_000
+ANTHROPIC_PIXELS_PER_TOKEN = 750
+
+# OpenAI high detail images are fitted in 2048x2048, their short side scaled to 768, then billed per 512px tile
+OPENAI_MAX_EDGE = 2048
+OPENAI_SHORT_EDGE = 768
+OPENAI_TILE = 512
+OPENAI_BASE_TOKENS = 85
+OPENAI_TILE_TOKENS = 170
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """How a figure is rendered for LLM consumption"""
+
+    name: str
+    width: int
+    height: int
+    format: str = "png"
+    # Number of colors of the reduced palette, PNG only, None to keep every color
+    colors: Optional[int] = None
+
+
+RENDER_PROFILES = {
+    profile.name: profile
+    for profile in [
+        RenderProfile("full", 800, 500),
+        RenderProfile("compact", 640, 400, colors=64),
+        RenderProfile("jpeg", 640, 400, format="jpeg"),
+        RenderProfile("webp", 640, 400, format="webp"),
+        RenderProfile("small", 512, 320, format="webp"),
+    ]
+}
+
+
+def estimate_image_tokens(width: int, height: int, provider: str = "anthropic") -> int:
+    """
+    Estimate the input tokens billed for an image.
+
+    Args:
+        width (int): Width in pixels
+        height (int): Height in pixels
+        provider (str): anthropic or openai
+
+    Returns:
+        int: Estimated number of tokens
+    """
+    if provider == "openai":
+        scale = min(1, OPENAI_MAX_EDGE / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1, OPENAI_SHORT_EDGE / min(width, height))
+        width, height = width * scale, height * scale
+        return OPENAI_BASE_TOKENS + OPENAI_TILE_TOKENS * math.ceil(
+            width / OPENAI_TILE
+        ) * math.ceil(height / OPENAI_TILE)
+
+    scale = min(
+        1,
+        ANTHROPIC_MAX_EDGE / max(width, height),
+        math.sqrt(ANTHROPIC_MAX_PIXELS / (width * height)),
+    )
+    return math.ceil(width * scale * height * scale / ANTHROPIC_PIXELS_PER_TOKEN)
+
+
+@dataclass
+class RenderedImage:
+    """A figure rendered with a profile"""
+
+    profile: RenderProfile
+    data: bytes
+    render_time: float
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.profile.format]
+
+    @cached_property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def tokens(self, provider: str = "anthropic") -> int:
+        return estimate_image_tokens(self.profile.width, self.profile.height, provider)
+
+
+def _reduce_palette(png: bytes, colors: int) -> bytes:
+    """Quantize a PNG to a palette of a number of colors, unchanged without Pillow"""
+    if Image is None:
+        logging.warning("Pillow is not installed, rendering without palette reduction")
+        return png
+
+    with Image.open(io.BytesIO(png)) as image:
+        output = io.BytesIO()
+        image.convert("RGB").quantize(colors=colors).save(
+            output, format="PNG", optimize=True
+        )
+        return output.getvalue()
+
+
+def render_figure(
+    fig: go.Figure, profile: Optional[RenderProfile] = None
+) -> RenderedImage:
+    """
+    Render a figure for LLM consumption.
+
+    Args:
+        fig (go.Figure): The figure to render
+        profile (RenderProfile): Resolution and encoding, defaults to the LLM_RENDER_PROFILE profile
+
+    Returns:
+        RenderedImage: The rendered image
+    """
+    profile = profile or RENDER_PROFILES[LLM_RENDER_PROFILE]
+
+    start = time.perf_counter()
+    data = fig.to_image(
+        format=profile.format,
+        engine="kaleido",
+        width=profile.width,
+        height=profile.height,
+    )
+    if profile.colors is not None and profile.format == "png":
+        data = _reduce_palette(data, profile.colors)
+
+    return RenderedImage(profile, data, time.perf_counter() - start)
+
+
+def benchmark_render_profiles(
+    fig: go.Figure, profiles: Optional[list[RenderProfile]] = None, repeat: int = 3
+) -> list[dict]:
+    """
+    Compare the render profiles on a figure.
+
+    Args:
+        fig (go.Figure): The figure to render
+        profiles (list[RenderProfile]): Profiles to compare, defaults to every profile
+        repeat (int): Renders per profile, the fastest one is reported
+
+    Returns:
+        list[dict]: Per profile the estimated tokens, encoded size and render time
+    """
+    results = []
+    for profile in profiles or RENDER_PROFILES.values():
+        renders = [render_figure(fig, profile) for _ in range(repeat)]
+        image = min(renders, key=lambda render: render.render_time)
+        results.append(
+            {
+                "profile": profile.name,
+                "size": f"{profile.width}x{profile.height}",
+                "format": profile.format,
+                "anthropic_tokens": image.tokens("anthropic"),
+                "openai_tokens": image.tokens("openai"),
+                "bytes": len(image.data),
+                "base64_bytes": len(image.base64),
+                "render_time": image.render_time,
+            }
+        )
+    return results
+
+
+def _sample_figure() -> go.Figure:
+    """A year of daily temperatures for two cities, shaped like the generated visualizations"""
+    dates = pd.date_range("2024-01-01", periods=366)
+    seasonal = 10 - 10 * np.cos(2 * np.pi * np.arange(366) / 366)
+    rng = np.random.default_rng(0)
+
+    fig = go.Figure(
+        [
+            go.Scatter(x=dates, y=seasonal + rng.normal(0, 2, 366), name="Berlin"),
+            go.Scatter(x=dates, y=seasonal + 5 + rng.normal(0, 2, 366), name="Madrid"),
+        ]
+    )
+    fig.update_layout(
+        title="Daily mean temperature in 2024",
+        xaxis_title="Date",
+        yaxis_title="Temperature (°C)",
+    )
+    return fig
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the figure render profiles used for LLM calls"
+    )
+    parser.add_argument(
+        "--figure", help="Plotly figure JSON file, defaults to a sample time series"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.figure:
+        with open(args.figure, "r") as file:
+            figure = pio.from_json(file.read())
+    else:
+        figure = _sample_figure()
+
+    # The first render starts the kaleido process
+    render_figure(figure)
+    print(
+        pd.DataFrame(benchmark_render_profiles(figure, repeat=args.repeat)).to_string(
+            index=False
+        )
+    )
@@ -0,0 +1,685 @@
+import copy
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence, Type
+
+import anthropic
+import openai
+import requests
+
+from pydantic import BaseModel
+
+from .ai import (
+    LLMClient,
+    LLMProvider,
+    MODEL_PROVIDERS,
+    estimate_tokens,
+    openai_client,
+    anthropic_client,
+)
+from .constants import (
+    USER,
+    MODEL_PRICES,
+    MODEL_LIMITS,
+    ROUTING_TABLE_PATH,
+    DEFAULT_ROUTING_TABLE,
+    MODEL_ROUTER_WINDOW,
+    MODEL_ROUTER_MAX_AGE,
+    MODEL_ROUTER_MIN_SAMPLES,
+    MODEL_ROUTER_MIN_SUCCESS_RATE,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_DEFAULT_DELAY,
+    LLM_LATENCY_WINDOW,
+    STRUCTURED_OUTPUT_FIELD_TOKENS,
+    STRUCTURED_OUTPUT_TEXT_TOKENS,
+)
+from .context import current_timeout
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors (including 529 overloaded)
+TRANSIENT_STATUS_CODES = {408, 409, 429}
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether an error of a provider call is worth retrying.
+
+    Args:
+        error (BaseException): The error raised by the call
+
+    Returns:
+        bool: True for connection errors, timeouts, rate limits and server errors
+    """
+    if isinstance(
+        error,
+        (
+            openai.APIConnectionError,
+            anthropic.APIConnectionError,
+            requests.ConnectionError,
+            requests.Timeout,
+            TimeoutError,
+        ),
+    ):
+        return True
+    if isinstance(error, (openai.APIStatusError, anthropic.APIStatusError)):
+        return error.status_code in TRANSIENT_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def structured_output_tokens(
+    response_format: Type[BaseModel], provider: LLMProvider
+) -> int:
+    """
+    Estimate the output tokens a structured answer needs at least, its JSON keys and short values.
+
+    Args:
+        response_format (Type[BaseModel]): Schema of the answer
+        provider (LLMProvider): Provider of the call, Anthropic answers are JSON written as text
+
+    Returns:
+        int: Minimum max_tokens of the call
+    """
+    fields = response_format.model_fields
+    skeleton = json.dumps({name: "" for name in fields})
+    tokens = estimate_tokens(
+        [{"role": USER, "content": skeleton}]
+    ) + STRUCTURED_OUTPUT_FIELD_TOKENS * len(fields)
+    if provider == LLMProvider.ANTHROPIC:
+        tokens += STRUCTURED_OUTPUT_TEXT_TOKENS
+    return tokens
+
+
+def fits_context(model: str, input_tokens: int, max_tokens: int) -> bool:
+    """
+    Whether a call fits in the context window of a model, its output capped to the model maximum.
+
+    Args:
+        model (str): The model name
+        input_tokens (int): Estimated input tokens of the call
+        max_tokens (int): Maximum tokens of the completion
+
+    Returns:
+        bool: True for models without known limits
+    """
+    if model not in MODEL_LIMITS:
+        return True
+    context_window, max_output_tokens = MODEL_LIMITS[model]
+    return input_tokens + min(max_tokens, max_output_tokens) <= context_window
+
+
+@dataclass(frozen=True)
+class Target:
+    """A provider, and optionally the model, serving a call"""
+
+    provider: LLMProvider
+    model: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.model or self.provider.value
+
+
+class LatencyTracker:
+    """Recent latencies of successful calls per target and call type"""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies: dict[tuple[str, str], deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.window)
+        )
+
+    def record(self, name: str, operation: str, latency: float) -> None:
+        with self._lock:
+            self._latencies[(name, operation)].append(latency)
+
+    def percentile(
+        self, name: str, operation: str, percentile: float, min_samples: int = 1
+    ) -> Optional[float]:
+        """
+        Returns:
+            float: The latency percentile in seconds, None with fewer than min_samples latencies
+        """
+        with self._lock:
+            latencies = sorted(self._latencies[(name, operation)])
+        if len(latencies) < max(min_samples, 1):
+            return None
+        return latencies[
+            min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = list(self._latencies)
+        return {
+            f"{name}.{operation}": {
+                "p50": self.percentile(name, operation, 50),
+                "p95": self.percentile(name, operation, 95),
+                "p99": self.percentile(name, operation, 99),
+            }
+            for name, operation in keys
+        }
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    Args:
+        model (str): The model name
+        input_tokens (int): Number of input tokens
+        output_tokens (int): Number of output tokens
+
+    Returns:
+        float: Cost in dollars, 0 for models without known prices
+    """
+    input_price, output_price = MODEL_PRICES.get(model, (0, 0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class ModelRouter:
+    """
+    Pick the model of each pipeline stage from a routing table.
+    The preferred model of a stage is used unless its estimated cost is above the stage ceiling,
+    or its recent latency or success rate on the stage make it a poor choice under the current load.
+    The remaining candidates are kept in order as failovers.
+    """
+
+    def __init__(
+        self,
+        table: dict[str, dict],
+        window: int = MODEL_ROUTER_WINDOW,
+        max_age: float = MODEL_ROUTER_MAX_AGE,
+        min_samples: int = MODEL_ROUTER_MIN_SAMPLES,
+        min_success_rate: float = MODEL_ROUTER_MIN_SUCCESS_RATE,
+    ):
+        for stage, route in table.items():
+            unknown = [
+                model for model in route["models"] if model not in MODEL_PROVIDERS
+            ]
+            if unknown:
+                raise ValueError(
+                    f"Unknown models {unknown} in the routing of stage {stage}"
+                )
+
+        self.table = table
+        self.max_age = max_age
+        self.min_samples = min_samples
+        self.min_success_rate = min_success_rate
+        self._lock = threading.Lock()
+        # (time.monotonic(), value) of the recent calls
+        self._latencies: dict[tuple[str, str], deque[tuple[float, float]]] = (
+            defaultdict(lambda: deque(maxlen=window))
+        )
+        self._outcomes: dict[tuple[str, str], deque[tuple[float, bool]]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self._selections: dict[tuple[str, str], int] = defaultdict(int)
+        self._spent: dict[str, float] = defaultdict(float)
+
+    @classmethod
+    def load(cls, path: str = ROUTING_TABLE_PATH, **kwargs) -> "ModelRouter":
+        """
+        Load the routing table, the stages of the config file overriding the default ones.
+
+        Args:
+            path (str): Path of the JSON routing table
+            **kwargs: Settings of the router
+
+        Returns:
+            ModelRouter: The router
+        """
+        table = dict(DEFAULT_ROUTING_TABLE)
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                table.update(json.load(file))
+        return cls(table, **kwargs)
+
+    def _recent(self, entries: deque) -> list:
+        oldest = time.monotonic() - self.max_age
+        return [value for timestamp, value in entries if timestamp >= oldest]
+
+    def _latency(self, stage: str, model: str) -> Optional[float]:
+        """Recent median latency, None without enough calls"""
+        latencies = sorted(self._recent(self._latencies[(stage, model)]))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[len(latencies) // 2]
+
+    def _success_rate(self, stage: str, model: str) -> Optional[float]:
+        outcomes = self._recent(self._outcomes[(stage, model)])
+        if len(outcomes) < self.min_samples:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    def _rejection(
+        self, stage: str, model: str, input_tokens: int, max_tokens: int
+    ) -> Optional[str]:
+        """Reason why a model shouldn't serve a call, None when it can"""
+        route = self.table[stage]
+
+        cost = estimate_cost(model, input_tokens, max_tokens)
+        if cost > route.get("max_cost", float("inf")):
+            return f"estimated cost {cost:.4f}$"
+
+        success_rate = self._success_rate(stage, model)
+        if success_rate is not None and success_rate < self.min_success_rate:
+            return f"success rate {success_rate:.0%}"
+
+        latency = self._latency(stage, model)
+        max_latency = min(
+            route.get("max_latency", float("inf")), current_timeout() or float("inf")
+        )
+        if latency is not None and latency > max_latency:
+            return f"latency {latency:.1f}s"
+
+        return None
+
+    def select(self, stage: str, messages: list[dict], max_tokens: int) -> list[str]:
+        """
+        Order the candidate models of a stage for a call.
+
+        Args:
+            stage (str): The pipeline stage
+            messages (list[dict]): Messages of the call, used to estimate the prompt size
+            max_tokens (int): Maximum tokens of the completion
+
+        Returns:
+            list[str]: The models able to serve the call first, in order of preference, then the others
+        """
+        input_tokens = estimate_tokens(messages)
+        # Models whose context window can't hold the call would only fail, unless no model can
+        models = [
+            model
+            for model in self.table[stage]["models"]
+            if fits_context(model, input_tokens, max_tokens)
+        ]
+        for model in self.table[stage]["models"]:
+            if model not in models:
+                logging.warning(
+                    f"Skipping {model} for {stage}: {input_tokens} input tokens exceed its context window"
+                )
+        models = models or self.table[stage]["models"]
+
+        with self._lock:
+            rejections = {
+                model: self._rejection(stage, model, input_tokens, max_tokens)
+                for model in models
+            }
+
+        selected = [model for model in models if rejections[model] is None]
+        fallbacks = [model for model in models if rejections[model] is not None]
+        # When every model is rejected, the cheapest one is used first
+        if not selected:
+            fallbacks.sort(
+                key=lambda model: estimate_cost(model, input_tokens, max_tokens)
+            )
+
+        ordered = selected + fallbacks
+        for model in models[: models.index(ordered[0])]:
+            logging.info(f"Skipping {model} for {stage}: {rejections[model]}")
+
+        with self._lock:
+            self._selections[(stage, ordered[0])] += 1
+        return ordered
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        success: bool,
+        latency: Optional[float] = None,
+        cost: float = 0,
+    ) -> None:
+        """
+        Record the outcome of a call.
+
+        Args:
+            stage (str): The pipeline stage
+            model (str): The model that served the call
+            success (bool): Whether the call succeeded
+            latency (float): Duration of a successful call in seconds
+            cost (float): Estimated cost of the call in dollars
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes[(stage, model)].append((now, success))
+            if latency is not None:
+                self._latencies[(stage, model)].append((now, latency))
+            self._spent[stage] += cost
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "spent": self._spent[stage],
+                    "models": {
+                        model: {
+                            "selected": self._selections[(stage, model)],
+                            "latency": self._latency(stage, model),
+                            "success_rate": self._success_rate(stage, model),
+                        }
+                        for model in route["models"]
+                    },
+                }
+                for stage, route in self.table.items()
+            }
+
+
+class LLMRouter:
+    """
+    Routing layer over the LLM clients.
+    Transient errors are retried with jittered exponential backoff, calls fail over to the next provider
+    when one can't serve them, and latency-critical calls send a hedged request
+    when the first one is slower than the usual latency percentile.
+    Calls of a pipeline stage get their models from the model router.
+    """
+
+    def __init__(
+        self,
+        clients: dict[LLMProvider, LLMClient],
+        model_router: Optional[ModelRouter] = None,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        hedge_default_delay: float = LLM_HEDGE_DEFAULT_DELAY,
+        max_workers: int = 8,
+    ):
+        self.clients = clients
+        self.model_router = model_router
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_default_delay = hedge_default_delay
+        self.latencies = LatencyTracker()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm-hedge"
+        )
+        self._lock = threading.Lock()
+        self.counts: dict[str, int] = defaultdict(int)
+
+    def _count(self, event: str, target: Optional[Target] = None) -> None:
+        with self._lock:
+            self.counts[event] += 1
+            if target is not None:
+                self.counts[f"{target.name}.{event}"] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter backoff delay of a retry"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _target_kwargs(self, target: Target, operation: str, kwargs: dict) -> dict:
+        """
+        Arguments of a call for a target: its model, and a max_tokens large enough for a structured answer
+        but within the output limit of the model.
+        """
+        if target.model is not None:
+            kwargs = {**kwargs, "model": target.model}
+        if operation == "structured_completion" and "max_tokens" in kwargs:
+            # A truncated answer can't be parsed, small budgets sized for one provider are raised for the others
+            minimum = structured_output_tokens(
+                kwargs["response_format"], target.provider
+            )
+            kwargs = {**kwargs, "max_tokens": max(kwargs["max_tokens"], minimum)}
+        if target.model in MODEL_LIMITS and "max_tokens" in kwargs:
+            kwargs = {
+                **kwargs,
+                "max_tokens": min(kwargs["max_tokens"], MODEL_LIMITS[target.model][1]),
+            }
+        return kwargs
+
+    def _call(
+        self,
+        target: Target,
+        operation: str,
+        messages: list[dict],
+        kwargs: dict,
+        stage: Optional[str],
+    ) -> Any:
+        """Single timed call to a target. The clients edit the messages they get, each call gets its own copy."""
+        kwargs = self._target_kwargs(target, operation, kwargs)
+
+        start = time.perf_counter()
+        try:
+            result = getattr(self.clients[target.provider], operation)(
+                copy.deepcopy(messages), **kwargs
+            )
+        except Exception:
+            if stage is not None and self.model_router is not None:
+                self.model_router.record(stage, target.name, success=False)
+            raise
+
+        latency = time.perf_counter() - start
+        self.latencies.record(target.name, operation, latency)
+        if stage is not None and self.model_router is not None:
+            cost = estimate_cost(
+                target.name, estimate_tokens(messages), kwargs.get("max_tokens", 0)
+            )
+            self.model_router.record(
+                stage, target.name, success=True, latency=latency, cost=cost
+            )
+        return result
+
+    def _call_with_retries(
+        self,
+        target: Target,
+        operation: str,
+        messages: list[dict],
+        kwargs: dict,
+        stage: Optional[str],
+    ) -> Any:
+        """Call a target, retrying transient errors while the current stage has time left"""
+        for attempt in range(self.max_retries + 1):
+            self._count("calls", target)
+            try:
+                return self._call(target, operation, messages, kwargs, stage)
+            except Exception as e:
+                self._count("errors", target)
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+
+                delay = self._backoff(attempt)
+                remaining = current_timeout()
+                if remaining is not None and remaining <= delay:
+                    raise
+
+                logging.warning(
+                    f"Transient error from {target.name}, retrying in {delay:.2f}s: {str(e)}"
+                )
+                self._count("retries", target)
+                time.sleep(delay)
+
+    def _hedge_delay(self, target: Target, operation: str) -> float:
+        delay = self.latencies.percentile(
+            target.name, operation, self.hedge_percentile, self.hedge_min_samples
+        )
+        return self.hedge_default_delay if delay is None else delay
+
+    def _submit(self, func: Callable, *args) -> Future:
+        # Run with the caller's context so the calls keep the deadline of the current stage
+        return self._executor.submit(contextvars.copy_context().run, func, *args)
+
+    def _hedged_call(
+        self,
+        targets: Sequence[Target],
+        operation: str,
+        messages: list[dict],
+        kwargs: dict,
+        stage: Optional[str],
+        tried: set,
+    ) -> Any:
+        """
+        Call the first target and, if it hasn't answered after its hedging delay, send the same call
+        to the next target (or again to the first one). The first successful answer wins,
+        the slower call can't be interrupted and is left to finish in the background.
+        """
+        primary = targets[0]
+        hedge = targets[1] if len(targets) > 1 else primary
+
+        tried.add(primary)
+        first = self._submit(
+            self._call_with_retries, primary, operation, messages, kwargs, stage
+        )
+        pending = {first}
+        done, _ = wait(pending, timeout=self._hedge_delay(primary, operation))
+        if not done:
+            logging.info(
+                f"Hedging {operation} call to {primary.name} with {hedge.name}"
+            )
+            self._count("hedges", hedge)
+            tried.add(hedge)
+            pending.add(
+                self._submit(
+                    self._call_with_retries, hedge, operation, messages, kwargs, stage
+                )
+            )
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+
+                if future is not first:
+                    self._count("hedge_wins", hedge)
+                return result
+
+        raise error
+
+    def _targets(
+        self,
+        messages: list[dict],
+        providers: Optional[Sequence[LLMProvider]],
+        stage: Optional[str],
+        kwargs: dict,
+    ) -> list[Target]:
+        if (
+            stage is not None
+            and self.model_router is not None
+            and stage in self.model_router.table
+        ):
+            models = self.model_router.select(
+                stage, messages, kwargs.get("max_tokens", 0)
+            )
+            return [Target(MODEL_PROVIDERS[model], model) for model in models]
+        return [
+            Target(provider) for provider in (providers or (LLMProvider.ANTHROPIC,))
+        ]
+
+    def route(
+        self,
+        operation: str,
+        messages: list[dict],
+        providers: Optional[Sequence[LLMProvider]] = None,
+        hedge: bool = False,
+        stage: Optional[str] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Run a call on the first target able to serve it.
+
+        Args:
+            operation (str): Client method to call, completion or structured_completion
+            messages (list[dict]): Messages of the call
+            providers (Sequence[LLMProvider]): Providers able to serve the call, in order of preference,
+                used with their default model when the stage has no routing
+            hedge (bool): Whether the call is latency-critical and may be hedged
+            stage (str): Pipeline stage of the call, whose models are picked by the model router
+            **kwargs: Arguments of the client method, which must be accepted by every candidate provider
+
+        Returns:
+            The result of the client method
+
+        Raises:
+            Exception: The error of the last target when none could serve the call
+        """
+        targets = self._targets(messages, providers, stage, kwargs)
+        tried: set[Target] = set()
+        error = None
+
+        for index, target in enumerate(targets):
+            if target in tried:
+                continue
+            if error is not None:
+                logging.warning(
+                    f"Failing over {operation} call to {target.name}: {str(error)}"
+                )
+                self._count("failovers", target)
+            try:
+                if hedge:
+                    return self._hedged_call(
+                        targets[index:], operation, messages, kwargs, stage, tried
+                    )
+                tried.add(target)
+                return self._call_with_retries(
+                    target, operation, messages, kwargs, stage
+                )
+            except Exception as e:
+                error = e
+
+        raise error
+
+    def completion(
+        self,
+        messages: list[dict],
+        providers: Optional[Sequence[LLMProvider]] = None,
+        hedge: bool = False,
+        stage: Optional[str] = None,
+        **kwargs,
+    ) -> str:
+        return self.route("completion", messages, providers, hedge, stage, **kwargs)
+
+    def structured_completion(
+        self,
+        messages: list[dict],
+        response_format: Type[BaseModel],
+        providers: Optional[Sequence[LLMProvider]] = None,
+        hedge: bool = False,
+        stage: Optional[str] = None,
+        **kwargs,
+    ) -> BaseModel:
+        return self.route(
+            "structured_completion",
+            messages,
+            providers,
+            hedge,
+            stage,
+            response_format=response_format,
+            **kwargs,
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "counts": counts,
+            "latencies": self.latencies.stats(),
+            "models": (
+                self.model_router.stats() if self.model_router is not None else None
+            ),
+        }
+
+
+llm_router = LLMRouter(
+    {LLMProvider.OPENAI: openai_client, LLMProvider.ANTHROPIC: anthropic_client},
+    model_router=ModelRouter.load(),
+)
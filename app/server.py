@@ -0,0 +1,424 @@
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+import plotly.graph_objects as go
+
+from .constants import (
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_MAX_WORKERS,
+    SERVER_MAX_PENDING_JOBS,
+    SERVER_JOB_HISTORY,
+    SPECULATIVE_EXECUTION,
+    REQUEST_DEADLINE_SECONDS,
+)
+from .context import PipelineContext
+from .main import (
+    classify_visualization_need,
+    generate_group_visualization,
+    generate_visualization,
+    pre_classifier_gate,
+)
+from .routing import llm_router
+from .session import SessionStore
+from .speculation import PreparedStages, speculative_classifier
+from .utils import warm_up_renderer
+from .visualization import open_meteo_cache, open_meteo_scheduler
+from .warmup import WarmUpJob
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """A queued visualization job"""
+
+    conversation_id: str
+    persona: str
+    message: str
+    topic_of_interest: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.PENDING
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    figure: Optional[go.Figure] = None
+    description: Optional[str] = None
+    error: Optional[str] = None
+    prepared: Optional[PreparedStages] = None
+    # Group discussions get an explanation for the audience level of every participant
+    group: bool = False
+    participants: list[str] = field(default_factory=list)
+    explanations: Optional[dict[str, str]] = None
+    # The deadline starts when the job is queued, the time spent waiting for a worker counts
+    context: PipelineContext = field(
+        default_factory=lambda: PipelineContext.with_timeout(REQUEST_DEADLINE_SECONDS)
+    )
+
+    def to_dict(self) -> dict:
+        result = {
+            "job_id": self.job_id,
+            "conversation_id": self.conversation_id,
+            "persona": self.persona,
+            "message": self.message,
+            "topic_of_interest": self.topic_of_interest,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "stage_timings": self.context.stage_timings,
+            "degradations": self.context.degradations,
+            "metrics": self.context.metrics,
+        }
+        if self.context.profiler is not None:
+            result["profile"] = self.context.profiler.summary()
+        if self.status == JobStatus.DONE:
+            result["figure"] = json.loads(self.figure.to_json())
+            result["description"] = self.description
+            if self.explanations is not None:
+                result["explanations"] = self.explanations
+        return result
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue can't accept more jobs"""
+
+
+class JobQueue:
+    """
+    Bounded job queue running jobs on a fixed pool of workers.
+    Submissions are rejected once every worker is busy and the pending slots are full.
+    """
+
+    def __init__(
+        self,
+        worker: Callable[[Job], None],
+        max_workers: int,
+        max_pending: int,
+        history: int = SERVER_JOB_HISTORY,
+    ):
+        self.worker = worker
+        self.history = history
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="viz-job"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def submit(self, job: Job) -> Job:
+        """
+        Queue a job.
+
+        Args:
+            job (Job): The job to run
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            QueueFullError: If there is no free slot
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Too many visualization jobs in progress")
+
+        try:
+            with self._lock:
+                self._jobs[job.job_id] = job
+                self._prune()
+            self._executor.submit(self._run, job)
+        except Exception:
+            # The slot is released by _run, which never starts when the submission fails
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            self._slots.release()
+            raise
+        return job
+
+    def _run(self, job: Job) -> None:
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            self.worker(job)
+            job.status = JobStatus.DONE
+        except Exception as e:
+            logging.error(f"Error in job {job.job_id}: {str(e)}", exc_info=True)
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+            self._slots.release()
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond the history size"""
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in (JobStatus.DONE, JobStatus.FAILED)
+        ]
+        for job_id in finished[: max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status.value for job in self._jobs.values()]
+        return {status.value: statuses.count(status.value) for status in JobStatus}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+class VisualizationService:
+    """
+    Long-lived visualization service.
+    LLM clients, the renderer and the data caches are created once and shared by every request.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = SERVER_MAX_WORKERS,
+        max_pending: int = SERVER_MAX_PENDING_JOBS,
+        speculative: bool = SPECULATIVE_EXECUTION,
+    ):
+        warm_up_renderer()
+        self.speculative = speculative
+        self._lock = threading.Lock()
+        self.sessions = SessionStore()
+        self.jobs = JobQueue(
+            self._run_job, max_workers=max_workers, max_pending=max_pending
+        )
+        self.warmup = WarmUpJob()
+        self.warmup.start()
+
+    def post_message(
+        self,
+        conversation_id: str,
+        persona: str,
+        message: str,
+        profile: Optional[bool] = None,
+    ) -> dict:
+        """
+        Add a message to a conversation and queue a visualization job if it needs one.
+
+        Args:
+            conversation_id (str): Identifier of the conversation
+            persona (str): The persona name
+            message (str): The message of the user
+            profile (bool): True to profile the job, False not to, None to sample it at PROFILING_SAMPLE_RATE
+
+        Returns:
+            dict: The classification, with the queued job when a visualization is needed
+
+        Raises:
+            QueueFullError: If the job queue is full
+        """
+        session = self.sessions.get(conversation_id)
+        with self._lock:
+            session.personas.add(persona)
+            group = len(session.personas) > 1
+            participants = sorted(session.personas)
+
+        prepared = None
+        if self.speculative:
+            viz_need, prepared = speculative_classifier.classify(message, persona)
+        else:
+            viz_need = classify_visualization_need(message)
+
+        result = {
+            "need_visualization": viz_need.need_visualization,
+            "topic_of_interest": viz_need.topic_of_interest,
+        }
+
+        if viz_need.need_visualization:
+            job = self.jobs.submit(Job(
+                conversation_id, persona, message, viz_need.topic_of_interest, prepared=prepared, group=group,
+                participants=participants,
+                context=PipelineContext.with_timeout(REQUEST_DEADLINE_SECONDS, profile=profile),
+            ))
+            result["job"] = job.to_dict()
+
+        return result
+
+    def _run_job(self, job: Job) -> None:
+        prepared = job.prepared
+        kwargs = dict(
+            complexity_levels=prepared.complexity_levels if prepared else None,
+            visualization_details=prepared.visualization_details if prepared else None,
+            session=self.sessions.get(job.conversation_id),
+        )
+        if job.group:
+            job.figure, job.description, job.explanations = (
+                generate_group_visualization(
+                    job.message,
+                    job.persona,
+                    job.topic_of_interest,
+                    job.context,
+                    personas=job.participants,
+                    **kwargs,
+                )
+            )
+        else:
+            job.figure, job.description = generate_visualization(
+                job.message, job.persona, job.topic_of_interest, job.context, **kwargs
+            )
+
+    def stats(self) -> dict:
+        return {
+            "jobs": self.jobs.stats(),
+            "conversations": len(self.sessions),
+            "sessions": self.sessions.stats(),
+            "data_cache": open_meteo_cache.stats(),
+            "open_meteo_quota": open_meteo_scheduler.stats(),
+            "warmup": self.warmup.stats(),
+            "pre_classifier_gate": pre_classifier_gate.stats() if pre_classifier_gate is not None else None,
+            "speculation": speculative_classifier.budget.stats() if self.speculative else None,
+            "llm_routing": llm_router.stats(),
+        }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the visualization service:
+        POST /conversations/<conversation_id>/messages  {"persona": ..., "message": ..., "profile": optional bool}
+        GET  /jobs/<job_id>
+        GET  /health
+    """
+
+    service: VisualizationService
+
+    def _send_json(
+        self, status: HTTPStatus, body: dict, headers: Optional[dict] = None
+    ) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+
+        if parts == ["health"]:
+            return self._send_json(HTTPStatus.OK, self.service.stats())
+
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self.service.jobs.get(parts[1])
+            if job is None:
+                return self._send_json(
+                    HTTPStatus.NOT_FOUND, {"error": f"Unknown job {parts[1]}"}
+                )
+            return self._send_json(HTTPStatus.OK, job.to_dict())
+
+        self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if not (
+            len(parts) == 3 and parts[0] == "conversations" and parts[2] == "messages"
+        ):
+            return self._send_json(
+                HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"}
+            )
+
+        try:
+            body = json.loads(
+                self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}"
+            )
+            persona, message, profile = (
+                body["persona"],
+                body["message"],
+                body.get("profile"),
+            )
+        except (ValueError, KeyError) as e:
+            return self._send_json(
+                HTTPStatus.BAD_REQUEST, {"error": f"Invalid message: {str(e)}"}
+            )
+
+        try:
+            result = self.service.post_message(parts[1], persona, message, profile)
+        except QueueFullError as e:
+            return self._send_json(
+                HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}, {"Retry-After": "5"}
+            )
+        except Exception as e:
+            logging.error(f"Error handling message: {str(e)}", exc_info=True)
+            return self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+
+        status = HTTPStatus.ACCEPTED if "job" in result else HTTPStatus.OK
+        self._send_json(status, result)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+
+def serve(
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+    max_workers: int = SERVER_MAX_WORKERS,
+    max_pending: int = SERVER_MAX_PENDING_JOBS,
+    speculative: bool = SPECULATIVE_EXECUTION,
+) -> None:
+    """
+    Run the visualization service until interrupted.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on
+        max_workers (int): Number of visualization jobs run concurrently
+        max_pending (int): Number of jobs waiting for a worker before new ones are rejected
+        speculative (bool): Whether to run the stages following classification speculatively
+    """
+    service = VisualizationService(
+        max_workers=max_workers, max_pending=max_pending, speculative=speculative
+    )
+    handler = type("ServiceRequestHandler", (RequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+
+    logging.info(f"Serving visualizations on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.warmup.stop()
+        service.jobs.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gaya visualization service")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--max-workers", type=int, default=SERVER_MAX_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=SERVER_MAX_PENDING_JOBS)
+    parser.add_argument(
+        "--speculative", action="store_true", default=SPECULATIVE_EXECUTION
+    )
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.max_workers, args.max_pending, args.speculative)
@@ -0,0 +1,124 @@
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .cache import TTLCache
+from .constants import SESSION_MAX_COUNT, SESSION_TTL, SESSION_MAX_DATA_ENTRIES
+from .models import DataProcessingType, NormalizedOpenMeteoData, VisualizationType
+
+
+@dataclass
+class SessionData:
+    """Data fetched during a conversation"""
+
+    # Canonical single-location URL the data was fetched with
+    url: str
+    data: NormalizedOpenMeteoData
+
+
+@dataclass
+class ConversationSession:
+    """
+    State kept between the visualization turns of a conversation.
+    Follow-ups reuse the fetched data and the previous visualization instead of starting from scratch.
+    """
+
+    data: list[SessionData] = field(default_factory=list)
+    visualization_details: Optional[VisualizationType] = None
+    data_requirements: Optional[DataProcessingType] = None
+    # Code of the last visualization, None when it was drawn with a template
+    figure_code: Optional[str] = None
+    turns: int = 0
+    updated_at: Optional[float] = None
+    # Personas who posted in the conversation, several make it a group discussion
+    personas: set[str] = field(default_factory=set)
+    # Turns of a conversation run one at a time, so a follow-up sees the data of the turn before
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @property
+    def can_refine(self) -> bool:
+        """Whether a follow-up can be served by refining the previous visualization"""
+        return bool(self.data) and self.visualization_details is not None
+
+    @property
+    def urls(self) -> list[str]:
+        return [entry.url for entry in self.data]
+
+    def describe(self) -> str:
+        """
+        Describe the previous visualization and the data in memory for the refine prompt.
+
+        Returns:
+            str: The description
+        """
+        processing = (
+            self.data_requirements.data_processing_steps
+            if self.data_requirements
+            else ""
+        )
+        data = "\n".join(f"- {entry.url}" for entry in self.data)
+        return f"{self.visualization_details}\nProcessing steps:\n{processing}\n\n# Data in memory\n{data}"
+
+    def record(
+        self,
+        visualization_details: VisualizationType,
+        data_requirements: DataProcessingType,
+        figure_code: Optional[str],
+        fetched: list[tuple[str, NormalizedOpenMeteoData]],
+    ) -> None:
+        """
+        Record a visualization turn of the conversation.
+
+        Args:
+            visualization_details (VisualizationType): The visualization details
+            data_requirements (DataProcessingType): Needed data and processing steps
+            figure_code (str): Code of the visualization, None when drawn with a template
+            fetched (list[tuple[str, NormalizedOpenMeteoData]]): URL and data of the entries fetched during the turn
+        """
+        self.visualization_details = visualization_details
+        self.data_requirements = data_requirements
+        self.figure_code = figure_code
+
+        fetched_urls = {url for url, _ in fetched}
+        self.data = [entry for entry in self.data if entry.url not in fetched_urls]
+        self.data.extend(SessionData(url, data) for url, data in fetched)
+        del self.data[:-SESSION_MAX_DATA_ENTRIES]
+
+        self.turns += 1
+        self.updated_at = time.time()
+
+
+class SessionStore:
+    """Sessions of the recent conversations, dropped after SESSION_TTL seconds of inactivity"""
+
+    def __init__(self, maxsize: int = SESSION_MAX_COUNT, ttl: float = SESSION_TTL):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str) -> ConversationSession:
+        """
+        Get the session of a conversation, created on its first message.
+
+        Args:
+            conversation_id (str): Identifier of the conversation
+
+        Returns:
+            ConversationSession: The session
+        """
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                session = ConversationSession()
+            # Setting it again restarts its time to live
+            self._sessions.set(conversation_id, session)
+            return session
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        return self._sessions.stats()
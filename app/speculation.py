@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from .constants import (
+    SPECULATION_MIN_SCORE,
+    SPECULATION_MAX_WASTED_CALLS,
+    SPECULATION_WINDOW,
+)
+from .context import PipelineContext, PipelineCancelled
+from .main import classify_visualization_need, set_complexity_level, pre_classifier_gate
+from .models import VisualizationNeed, VisualizationType
+from .visualization import determine_visualization_type
+
+
+@dataclass
+class PreparedStages:
+    """Outputs of the stages run speculatively before the classification resolved"""
+
+    complexity_levels: tuple[str, str]
+    visualization_details: VisualizationType
+
+
+class SpeculationBudget:
+    """
+    Bounds the LLM calls wasted on speculation for messages that turn out not to need a visualization,
+    over a sliding time window.
+    """
+
+    def __init__(
+        self,
+        max_wasted_calls: int = SPECULATION_MAX_WASTED_CALLS,
+        window: float = SPECULATION_WINDOW,
+    ):
+        self.max_wasted_calls = max_wasted_calls
+        self.window = window
+        self._lock = threading.Lock()
+        self._wasted: deque[float] = deque()
+        self.counts = {
+            "committed": 0,
+            "wasted": 0,
+            "failed": 0,
+            "skipped": 0,
+            "wasted_calls": 0,
+        }
+
+    def _expire(self) -> None:
+        while self._wasted and self._wasted[0] < time.monotonic() - self.window:
+            self._wasted.popleft()
+
+    def allow(self) -> bool:
+        with self._lock:
+            self._expire()
+            return len(self._wasted) < self.max_wasted_calls
+
+    def record(self, outcome: str, wasted_calls: int = 0) -> None:
+        """
+        Record the outcome of a speculation.
+
+        Args:
+            outcome (str): committed, wasted, failed or skipped
+            wasted_calls (int): Number of LLM calls whose result was thrown away
+        """
+        with self._lock:
+            self.counts[outcome] += 1
+            self.counts["wasted_calls"] += wasted_calls
+            self._wasted.extend([time.monotonic()] * wasted_calls)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire()
+            return {**self.counts, "wasted_calls_in_window": len(self._wasted)}
+
+
+class SpeculativeClassifier:
+    """
+    Classify a message while speculatively running the stages that follow a positive classification.
+    The complexity level and visualization type are computed as soon as the message arrives,
+    then committed if the message needs a visualization or cancelled otherwise.
+    The visualization type is speculated with the message itself as topic. The classified topic only
+    summarizes the message, so the speculative details are committed whatever topic the classifier returns.
+    """
+
+    def __init__(
+        self,
+        budget: Optional[SpeculationBudget] = None,
+        min_score: float = SPECULATION_MIN_SCORE,
+        max_workers: int = 4,
+    ):
+        self.budget = budget or SpeculationBudget()
+        self.min_score = min_score
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="speculation"
+        )
+
+    def _should_speculate(self, message: str) -> bool:
+        if not self.budget.allow():
+            return False
+        # Without the gate every message would be speculated on
+        return (
+            pre_classifier_gate is None
+            or pre_classifier_gate.score(message) >= self.min_score
+        )
+
+    def _prepare(
+        self, message: str, persona: str, context: PipelineContext, started: list[str]
+    ) -> PreparedStages:
+        with context.stage("complexity"):
+            started.append("complexity")
+            complexity_levels = set_complexity_level(persona)
+
+        with context.stage("visualization_type"):
+            started.append("visualization_type")
+            # The classification topic isn't known yet, the message holds everything it summarizes
+            visualization_details = determine_visualization_type(
+                message, message, persona, complexity_levels[0]
+            )
+
+        return PreparedStages(complexity_levels, visualization_details)
+
+    def classify(
+        self, message: str, persona: str
+    ) -> tuple[VisualizationNeed, Optional[PreparedStages]]:
+        """
+        Classify a message, speculating on the following stages when the budget allows it.
+
+        Args:
+            message (str): The message to classify
+            persona (str): The persona name
+
+        Returns:
+            tuple[VisualizationNeed, PreparedStages]: The classification and the committed speculative stages, if any
+        """
+        classification = self._executor.submit(classify_visualization_need, message)
+
+        if not self._should_speculate(message):
+            self.budget.record("skipped")
+            return classification.result(), None
+
+        context = PipelineContext()
+        started: list[str] = []
+        speculation = self._executor.submit(
+            self._prepare, message, persona, context, started
+        )
+
+        viz_need = classification.result()
+
+        if viz_need.need_visualization:
+            try:
+                prepared = speculation.result()
+                self.budget.record("committed")
+                logging.info(f"Committed speculative stages {started}")
+                return viz_need, prepared
+            except (Exception, PipelineCancelled) as e:
+                logging.warning(
+                    f"Speculative stages failed, running them normally: {str(e)}"
+                )
+                self.budget.record("failed")
+                return viz_need, None
+
+        # The stages already started can't be interrupted, the remaining ones are skipped
+        context.cancel()
+        speculation.add_done_callback(
+            lambda _: self.budget.record("wasted", len(started))
+        )
+        return viz_need, None
+
+
+speculative_classifier = SpeculativeClassifier()
@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class ColumnStats:
+    """NaN-aware statistics of a numeric column, positions are row positions in the frame"""
+
+    column: str
+    count: int
+    mean: float
+    std: float
+    min: float
+    max: float
+    min_position: int
+    max_position: int
+    first: float
+    last: float
+    # Least squares slope per row, and the change it implies from the first to the last valid row
+    slope: float
+    trend_change: float
+
+
+def numeric_columns(
+    df: pd.DataFrame, exclude: tuple[str, ...] = ("time",)
+) -> list[str]:
+    """Numeric, non boolean columns of a frame"""
+    return [
+        column
+        for column, dtype in df.dtypes.items()
+        if column not in exclude
+        and pd.api.types.is_numeric_dtype(dtype)
+        and not pd.api.types.is_bool_dtype(dtype)
+    ]
+
+
+def compute_stats(df: pd.DataFrame, columns: list[str] = None) -> list[ColumnStats]:
+    """
+    Compute the statistics of every numeric column at once on the underlying 2D array.
+    Every reduction runs over all columns together, missing values are ignored.
+
+    Args:
+        df (pd.DataFrame): The frame to describe
+        columns (list[str]): Columns to describe, defaults to every numeric column but time
+
+    Returns:
+        list[ColumnStats]: Statistics of the columns having at least one value
+    """
+    columns = numeric_columns(df) if columns is None else columns
+    if df.empty or not columns:
+        return []
+
+    values = df[columns].to_numpy(dtype=float, na_value=np.nan)
+    valid = ~np.isnan(values)
+    n_rows = len(values)
+    positions = np.arange(n_rows, dtype=float)
+    column_indices = np.arange(len(columns))
+
+    if valid.all():
+        # Fast path without missing values: plain reductions, and the slope as a single dot product
+        count = np.full(len(columns), n_rows)
+        mean = values.mean(axis=0)
+        std = values.std(axis=0, ddof=1) if n_rows > 1 else np.zeros(len(columns))
+        min_position = values.argmin(axis=0)
+        max_position = values.argmax(axis=0)
+        first_position = np.zeros(len(columns), dtype=int)
+        last_position = np.full(len(columns), n_rows - 1)
+
+        centered_positions = positions - positions.mean()
+        variance = centered_positions @ centered_positions
+        slope = (
+            centered_positions @ values / variance
+            if variance > 0
+            else np.zeros(len(columns))
+        )
+    else:
+        count = valid.sum(axis=0)
+        safe_count = np.maximum(count, 1)
+
+        mean = np.where(valid, values, 0.0).sum(axis=0) / safe_count
+        centered = np.where(valid, values - mean, 0.0)
+        std = np.sqrt((centered**2).sum(axis=0) / np.maximum(count - 1, 1))
+
+        min_position = np.where(valid, values, np.inf).argmin(axis=0)
+        max_position = np.where(valid, values, -np.inf).argmax(axis=0)
+        first_position = valid.argmax(axis=0)
+        last_position = n_rows - 1 - valid[::-1].argmax(axis=0)
+
+        # Least squares slope of the values against their row position, over the valid rows of each column
+        mean_position = (valid * positions[:, None]).sum(axis=0) / safe_count
+        centered_positions = np.where(valid, positions[:, None] - mean_position, 0.0)
+        variance = (centered_positions**2).sum(axis=0)
+        slope = np.divide(
+            (centered_positions * centered).sum(axis=0),
+            variance,
+            out=np.zeros_like(variance),
+            where=variance > 0,
+        )
+
+    has_values = count > 0
+    minimum = values[min_position, column_indices]
+    maximum = values[max_position, column_indices]
+    first = values[first_position, column_indices]
+    last = values[last_position, column_indices]
+    trend_change = slope * (last_position - first_position)
+
+    return [
+        ColumnStats(
+            column=column,
+            count=int(count[i]),
+            mean=float(mean[i]),
+            std=float(std[i]),
+            min=float(minimum[i]),
+            max=float(maximum[i]),
+            min_position=int(min_position[i]),
+            max_position=int(max_position[i]),
+            first=float(first[i]),
+            last=float(last[i]),
+            slope=float(slope[i]),
+            trend_change=float(trend_change[i]),
+        )
+        for i, column in enumerate(columns)
+        if has_values[i]
+    ]
+
+
+def describe_stats(stats: ColumnStats, positions: pd.Index = None) -> str:
+    """
+    Format the statistics of a column on one line.
+
+    Args:
+        stats (ColumnStats): The statistics
+        positions (pd.Index): Labels of the rows (e.g. times) used to locate the extremes
+
+    Returns:
+        str: The description
+    """
+
+    def at(position: int) -> str:
+        return f" at {positions[position]}" if positions is not None else ""
+
+    return (
+        f"{stats.column}: mean={stats.mean:.2f}, std={stats.std:.2f}, "
+        f"min={stats.min:.2f}{at(stats.min_position)}, max={stats.max:.2f}{at(stats.max_position)}, "
+        f"first={stats.first:.2f}, last={stats.last:.2f}, trend={stats.trend_change:+.2f} over the period"
+    )
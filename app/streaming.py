@@ -0,0 +1,198 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import plotly.graph_objects as go
+
+from .constants import (
+    STREAM_DEBOUNCE_SECONDS,
+    STREAM_CONTEXT_MESSAGES,
+    REQUEST_DEADLINE_SECONDS,
+)
+from .context import PipelineContext, PipelineCancelled
+from .main import classify_visualization_need, generate_visualization
+from .session import ConversationSession
+
+
+@dataclass
+class StreamMessage:
+    """A message of a live transcript"""
+
+    sequence: int
+    persona: str
+    message: str
+
+
+@dataclass
+class StreamResult:
+    """A visualization generated for a message of the transcript"""
+
+    message: StreamMessage
+    topic_of_interest: str
+    figure: Optional[go.Figure] = None
+    description: Optional[str] = None
+    error: Optional[str] = None
+    stage_timings: dict[str, float] = field(default_factory=dict)
+    degradations: list[str] = field(default_factory=list)
+    metrics: dict[str, float] = field(default_factory=dict)
+
+
+class ConversationStream:
+    """
+    Incremental ingestion of a live conversation transcript.
+    Messages are classified as they arrive, with the recent conversation as context.
+    Visualization needs are debounced so a burst of messages only starts one job,
+    and a newer need cancels the job of the need it supersedes.
+    """
+
+    def __init__(
+        self,
+        on_result: Callable[[StreamResult], None],
+        debounce: float = STREAM_DEBOUNCE_SECONDS,
+        context_messages: int = STREAM_CONTEXT_MESSAGES,
+    ):
+        self.on_result = on_result
+        self.debounce = debounce
+        self.context_messages = context_messages
+        self.history: list[StreamMessage] = []
+        self.session = ConversationSession()
+
+        self._lock = threading.Lock()
+        self._classifier = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="stream-classify"
+        )
+        self._worker = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="stream-viz"
+        )
+        self._timer: Optional[threading.Timer] = None
+        self._pending: Optional[tuple[StreamMessage, str]] = None
+        self._latest_need = -1
+        self._running: Optional[tuple[StreamMessage, PipelineContext]] = None
+        self.cancelled_jobs = 0
+
+    def push(self, persona: str, message: str) -> StreamMessage:
+        """
+        Add a message to the transcript and classify it in the background.
+
+        Args:
+            persona (str): The persona name
+            message (str): The message
+
+        Returns:
+            StreamMessage: The added message
+        """
+        with self._lock:
+            stream_message = StreamMessage(len(self.history), persona, message)
+            context = self.history[-self.context_messages :]
+            self.history.append(stream_message)
+
+        self._classifier.submit(self._classify, stream_message, context)
+        return stream_message
+
+    def _classify(
+        self, stream_message: StreamMessage, context: list[StreamMessage]
+    ) -> None:
+        conversation_context = None
+        if context:
+            transcript = "\n".join(
+                f"{previous.persona}: {previous.message}" for previous in context
+            )
+            conversation_context = f"Conversation so far:\n{transcript}\n\nLatest message ({stream_message.persona}): {stream_message.message}"
+
+        try:
+            viz_need = classify_visualization_need(
+                stream_message.message, conversation_context
+            )
+        except Exception as e:
+            logging.error(
+                f"Error classifying message {stream_message.sequence}: {str(e)}"
+            )
+            return
+
+        if viz_need.need_visualization:
+            self._schedule(stream_message, viz_need.topic_of_interest)
+
+    def _schedule(self, stream_message: StreamMessage, topic_of_interest: str) -> None:
+        """Make a need the pending one and restart the debounce timer, unless a newer need exists"""
+        with self._lock:
+            if stream_message.sequence <= self._latest_need:
+                return
+            self._latest_need = stream_message.sequence
+            self._pending = (stream_message, topic_of_interest)
+
+            if self._running is not None:
+                logging.info(
+                    f"Cancelling visualization of message {self._running[0].sequence}, superseded by {stream_message.sequence}"
+                )
+                self._running[1].cancel()
+
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._start_pending)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _start_pending(self) -> None:
+        with self._lock:
+            if self._pending is None:
+                return
+            stream_message, topic_of_interest = self._pending
+            self._pending = None
+            context = PipelineContext.with_timeout(REQUEST_DEADLINE_SECONDS)
+            self._running = (stream_message, context)
+
+        self._worker.submit(self._run, stream_message, topic_of_interest, context)
+
+    def _run(
+        self,
+        stream_message: StreamMessage,
+        topic_of_interest: str,
+        context: PipelineContext,
+    ) -> None:
+        result = StreamResult(
+            stream_message,
+            topic_of_interest,
+            stage_timings=context.stage_timings,
+            degradations=context.degradations,
+            metrics=context.metrics,
+        )
+        try:
+            result.figure, result.description = generate_visualization(
+                stream_message.message,
+                stream_message.persona,
+                topic_of_interest,
+                context,
+                session=self.session,
+            )
+        except PipelineCancelled:
+            with self._lock:
+                self.cancelled_jobs += 1
+            return
+        except Exception as e:
+            logging.error(
+                f"Error generating visualization for message {stream_message.sequence}: {str(e)}",
+                exc_info=True,
+            )
+            result.error = str(e)
+        finally:
+            with self._lock:
+                if self._running is not None and self._running[1] is context:
+                    self._running = None
+
+        if not context.cancelled:
+            self.on_result(result)
+
+    def close(self, wait: bool = True) -> None:
+        """Stop the stream, cancelling the pending and running visualizations"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._pending = None
+            if self._running is not None:
+                self._running[1].cancel()
+
+        self._classifier.shutdown(wait=wait)
+        self._worker.shutdown(wait=wait)
@@ -0,0 +1,464 @@
+import logging
+import re
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from plotly.colors import qualitative
+from plotly.subplots import make_subplots
+
+from .dataset import location_name
+from .models import NormalizedOpenMeteoData, VisualizationType, _rollup_aggregation
+from .prompts import LVL0_VIZ_PROMPT, LVL1_VIZ_PROMPT
+from .utils import enhance_plotly_figure
+
+# Days of data needed for a year to be plotted, partial years would bias yearly means
+MIN_DAYS_PER_YEAR = 330
+MAX_TEMPLATE_LOCATIONS = 8
+MAX_COMPARED_VARIABLES = 3
+# Longer comparisons are plotted monthly instead of daily
+MAX_DAILY_COMPARISON_DAYS = 2 * 366
+
+MONTH_NAMES = [
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+]
+
+YEARLY_PATTERN = re.compile(r"\b(years?|yearly|annual|annually|decades?)\b")
+COMPARISON_PATTERN = re.compile(
+    r"\b(compar\w*|versus|vs|between|cities|locations|regions|countries)\b"
+)
+MOVING_AVERAGE_PATTERN = re.compile(r"(\d+)[- ]year (moving|rolling|running) average")
+BASELINE_PATTERN = re.compile(r"baseline[^0-9]{0,20}(\d{4})\s*[-–to ]+\s*(\d{4})")
+# Processing the templates can't do: seasonal or monthly filters, unit conversions, thresholds and counts
+UNSUPPORTED_PROCESSING_PATTERN = re.compile(
+    r"\b(summer|winter|spring|autumn|fall|monsoon|seasons?|seasonal|months? of|"
+    r"january|february|march|april|june|july|august|september|october|november|december|"
+    r"fahrenheit|kelvin|mph|knots|inch\w*|feet|convert\w*|"
+    r"thresholds?|counts?|counting|number of|how many|frequency|days with|percentiles?|quantiles?)\b|"
+    r"\b(above|below|exceed\w*|over|under|greater than|less than|more than|at least)\s+-?\d|°f\b|[<>]"
+)
+# Aggregation suffix of the daily variables, and the words asking for it
+AGGREGATION_WORDS = {
+    "mean": r"mean|average|avg",
+    "max": r"max\w*|highest|hottest|peak|warmest",
+    "min": r"min\w*|lowest|coldest|coolest",
+    "sum": r"sum|total|accumulated|cumulative",
+}
+AGGREGATION_SUFFIX_PATTERN = re.compile(rf"_({'|'.join(AGGREGATION_WORDS)})(?=_|$)")
+# Templates draw plain charts, expert audiences get generated code with uncertainty and richer annotations
+TEMPLATE_COMPLEXITY_LEVELS = (LVL0_VIZ_PROMPT, LVL1_VIZ_PROMPT)
+
+
+def _details_text(details: VisualizationType) -> str:
+    """Lowercase text of the visualization details, with pm2.5-like names written as the API variables"""
+    text = " ".join(
+        [
+            details.visualization,
+            details.chart_type,
+            details.focus,
+            details.visual_elements,
+        ]
+    ).lower()
+    return re.sub(r"(\w)\.(\d)", r"\1_\2", text)
+
+
+def _variable_score(variable: str, text: str) -> int:
+    """
+    Number of words of a variable name found in the text, plus one when the text asks for the
+    aggregation of its suffix, so a mean temperature ranks above the maximum for an average
+    """
+    words = [
+        word
+        for word in variable.split("_")
+        if word not in (*AGGREGATION_WORDS, "2m", "10m")
+    ]
+    score = sum(1 for word in words if re.search(rf"\b{re.escape(word)}", text))
+    suffix = variable.rsplit("_", 1)[-1]
+    if (
+        score
+        and suffix in AGGREGATION_WORDS
+        and re.search(rf"\b({AGGREGATION_WORDS[suffix]})\b", text)
+    ):
+        score += 1
+    return score
+
+
+def _aggregation(variable: str) -> str:
+    """Aggregation of the daily values of a variable, from its suffix or from how its hourly values are rolled up"""
+    aggregation = _rollup_aggregation(variable)
+    return "mean" if aggregation == "circular_mean" else aggregation
+
+
+def _mentioned_variables(data: List[NormalizedOpenMeteoData], text: str) -> list[str]:
+    """
+    Variables available for every location, best matches of the text first.
+    Empty when the best match is ambiguous: when it ties with another aggregation of the same variable,
+    or when it isn't the aggregation the text asks for, like a daily maximum for an average temperature.
+    """
+    columns = [list(entry.rollup("daily").columns.drop("time")) for entry in data]
+    shared = [
+        column for column in columns[0] if all(column in other for other in columns[1:])
+    ]
+    scores = {column: _variable_score(column, text) for column in shared}
+    mentioned = sorted(
+        (column for column in shared if scores[column] > 0),
+        key=lambda column: -scores[column],
+    )
+    if not mentioned:
+        return []
+
+    best = mentioned[0]
+    tied = [
+        column
+        for column in mentioned[1:]
+        if scores[column] == scores[best]
+        and AGGREGATION_SUFFIX_PATTERN.sub("", column)
+        == AGGREGATION_SUFFIX_PATTERN.sub("", best)
+        and _aggregation(column) != _aggregation(best)
+    ]
+    requested = [
+        aggregation
+        for aggregation, words in AGGREGATION_WORDS.items()
+        if re.search(rf"\b({words})\b", text)
+    ]
+    if tied or (requested and _aggregation(best) not in requested):
+        logging.info(
+            f"No template variable, {best} is an ambiguous match for the details"
+        )
+        return []
+    return mentioned
+
+
+def _single_variable(data: List[NormalizedOpenMeteoData], text: str) -> Optional[str]:
+    """The best match of the text for templates drawing one variable, None when another one matches as well"""
+    variables = _mentioned_variables(data, text)
+    if not variables:
+        return None
+    if len(variables) > 1 and _variable_score(variables[1], text) == _variable_score(
+        variables[0], text
+    ):
+        logging.info(
+            f"No template variable, {variables[0]} and {variables[1]} match the details as well"
+        )
+        return None
+    return variables[0]
+
+
+def _label(variable: str, entry: NormalizedOpenMeteoData) -> str:
+    units = {**entry._get_units("hourly_units"), **entry._get_units("daily_units")}
+    unit = units.get(variable) or units.get(
+        re.sub(r"_(mean|max|min|sum)$", "", variable)
+    )
+    name = variable.replace("_", " ")
+    return f"{name} ({unit})" if unit else name
+
+
+def _complete_years(entry: NormalizedOpenMeteoData, variable: str) -> pd.Series:
+    """Yearly values of a variable, restricted to the years with enough days of data"""
+    daily = entry.rollup("daily").set_index("time")[variable]
+    complete = daily.resample("YS").count() >= MIN_DAYS_PER_YEAR
+    yearly = entry.rollup("yearly").set_index("time")[variable]
+    return yearly[complete.reindex(yearly.index, fill_value=False)].dropna()
+
+
+@dataclass
+class TemplateMatch:
+    """A template able to draw the visualization, with its parameters"""
+
+    template: "VisualizationTemplate"
+    params: dict = field(default_factory=dict)
+
+    def render(
+        self, data: List[NormalizedOpenMeteoData], details: VisualizationType
+    ) -> go.Figure:
+        return enhance_plotly_figure(self.template.render(data, details, **self.params))
+
+
+class VisualizationTemplate(ABC):
+    """A hand written visualizer for a recurring chart archetype"""
+
+    name: str
+
+    @abstractmethod
+    def match(
+        self, details: VisualizationType, text: str, data: List[NormalizedOpenMeteoData]
+    ) -> Optional[dict]:
+        """
+        Check whether the template can draw the visualization from the fetched data.
+
+        Args:
+            details (VisualizationType): The visualization details
+            text (str): Lowercase text of the details
+            data (List[NormalizedOpenMeteoData]): The fetched data, one entry per location
+
+        Returns:
+            dict: Parameters of the render, None when the template doesn't apply
+        """
+
+    @abstractmethod
+    def render(
+        self, data: List[NormalizedOpenMeteoData], details: VisualizationType, **params
+    ) -> go.Figure:
+        pass
+
+
+class YearlyTrendTemplate(VisualizationTemplate):
+    """Yearly values of a variable with their linear trend, and optionally a moving average"""
+
+    name = "yearly_trend"
+
+    def match(self, details, text, data):
+        if (
+            "line" not in details.chart_type.lower()
+            or not YEARLY_PATTERN.search(text)
+            or len(data) > MAX_TEMPLATE_LOCATIONS
+        ):
+            return None
+
+        variable = _single_variable(data, text)
+        if variable is None:
+            return None
+        if any(len(_complete_years(entry, variable)) < 3 for entry in data):
+            return None
+
+        moving_average = MOVING_AVERAGE_PATTERN.search(text)
+        return {
+            "variable": variable,
+            "moving_average": int(moving_average.group(1)) if moving_average else None,
+        }
+
+    def render(
+        self, data, details, variable: str, moving_average: Optional[int] = None
+    ):
+        fig = go.Figure()
+        for entry in data:
+            yearly = _complete_years(entry, variable)
+            location = location_name(entry) if len(data) > 1 else "Yearly value"
+            years = yearly.index.year
+
+            fig.add_trace(
+                go.Scatter(
+                    x=years, y=yearly.to_numpy(), mode="lines+markers", name=location
+                )
+            )
+
+            if moving_average and len(yearly) >= moving_average:
+                smoothed = yearly.rolling(moving_average, center=True).mean()
+                fig.add_trace(
+                    go.Scatter(
+                        x=years,
+                        y=smoothed.to_numpy(),
+                        mode="lines",
+                        line=dict(width=3),
+                        name=f"{location} {moving_average}-year average",
+                    )
+                )
+
+            slope, intercept = np.polyfit(years, yearly.to_numpy(), 1)
+            fig.add_trace(
+                go.Scatter(
+                    x=[years[0], years[-1]],
+                    y=[intercept + slope * years[0], intercept + slope * years[-1]],
+                    mode="lines",
+                    line=dict(dash="dot"),
+                    name=f"{location} trend ({slope * 10:+.2f} per decade)",
+                )
+            )
+
+        fig.update_layout(
+            title=details.visualization,
+            xaxis_title="Year",
+            yaxis_title=_label(variable, data[0]),
+        )
+        return fig
+
+
+class LocationComparisonTemplate(VisualizationTemplate):
+    """Time series of the same variables at several locations, one panel per variable"""
+
+    name = "location_comparison"
+
+    def match(self, details, text, data):
+        if "line" not in details.chart_type.lower() or not COMPARISON_PATTERN.search(
+            text
+        ):
+            return None
+        if not 2 <= len(data) <= MAX_TEMPLATE_LOCATIONS:
+            return None
+
+        variables = _mentioned_variables(data, text)[:MAX_COMPARED_VARIABLES]
+        if not variables:
+            return None
+
+        days = max(len(entry.rollup("daily")) for entry in data)
+        return {
+            "variables": variables,
+            "resolution": "daily" if days <= MAX_DAILY_COMPARISON_DAYS else "monthly",
+        }
+
+    def render(self, data, details, variables: list[str], resolution: str = "daily"):
+        fig = make_subplots(
+            rows=len(variables), cols=1, shared_xaxes=True, vertical_spacing=0.08
+        )
+
+        for i, entry in enumerate(data):
+            series = entry.rollup(resolution)
+            for row, variable in enumerate(variables, start=1):
+                fig.add_trace(
+                    go.Scatter(
+                        x=series["time"],
+                        y=series[variable],
+                        mode="lines",
+                        name=location_name(entry),
+                        legendgroup=str(i),
+                        showlegend=row == 1,
+                        line=dict(
+                            color=qualitative.Plotly[i % len(qualitative.Plotly)]
+                        ),
+                    ),
+                    row=row,
+                    col=1,
+                )
+                fig.update_yaxes(title_text=_label(variable, entry), row=row, col=1)
+
+        fig.update_layout(title=details.visualization)
+        return fig
+
+
+class AnomalyHeatmapTemplate(VisualizationTemplate):
+    """Monthly anomalies against a baseline period, years by months"""
+
+    name = "anomaly_heatmap"
+
+    def match(self, details, text, data):
+        if (
+            "heatmap" not in details.chart_type.lower()
+            or "anomal" not in text
+            or len(data) != 1
+        ):
+            return None
+
+        variable = _single_variable(data, text)
+        if variable is None:
+            return None
+
+        years = data[0].rollup("monthly")["time"].dt.year
+        if years.nunique() < 2:
+            return None
+
+        baseline = None
+        match = BASELINE_PATTERN.search(text)
+        # A baseline outside of the fetched data falls back to the whole period
+        if (
+            match
+            and years.min() <= int(match.group(1))
+            and int(match.group(2)) <= years.max()
+        ):
+            baseline = (int(match.group(1)), int(match.group(2)))
+
+        return {"variable": variable, "baseline": baseline}
+
+    def render(
+        self, data, details, variable: str, baseline: Optional[tuple[int, int]] = None
+    ):
+        anomalies = data[0].rollup("anomalies", baseline)
+        grid = anomalies.pivot_table(
+            index=anomalies["time"].dt.year,
+            columns=anomalies["time"].dt.month,
+            values=variable,
+        )
+        grid = grid.reindex(columns=range(1, 13))
+
+        fig = go.Figure(
+            go.Heatmap(
+                z=grid.to_numpy(),
+                x=MONTH_NAMES,
+                y=grid.index,
+                colorscale="RdBu_r",
+                zmid=0,
+                colorbar=dict(title=_label(variable, data[0])),
+                hovertemplate="%{x} %{y}: %{z:+.2f}<extra></extra>",
+            )
+        )
+        period = f"{baseline[0]}-{baseline[1]}" if baseline else "the whole period"
+        fig.update_layout(
+            title=f"{details.visualization} (baseline: {period})",
+            xaxis_title="Month",
+            yaxis_title="Year",
+        )
+        return fig
+
+
+# Matched in order, the most specific archetypes first
+TEMPLATES: list[VisualizationTemplate] = [
+    AnomalyHeatmapTemplate(),
+    YearlyTrendTemplate(),
+    LocationComparisonTemplate(),
+]
+
+
+def match_template(
+    details: VisualizationType,
+    data: List[NormalizedOpenMeteoData],
+    processing_steps: Optional[List[str]] = None,
+    complexity_level: Optional[str] = None,
+    previous_code: Optional[str] = None,
+) -> Optional[TemplateMatch]:
+    """
+    Find a template able to draw the visualization from the fetched data.
+    No template is used to refine generated code, for expert audiences, or when the details or processing
+    steps ask for something the templates would silently drop, like a season, a unit or a threshold.
+
+    Args:
+        details (VisualizationType): The visualization details
+        data (List[NormalizedOpenMeteoData]): The fetched data
+        processing_steps (List[str]): The data processing steps of the visualization
+        complexity_level (str): Visualization complexity prompt, any level when not given
+        previous_code (str): Code of the visualization being refined
+
+    Returns:
+        TemplateMatch: The first matching template, None when the visualization needs code generation
+    """
+    if not data or previous_code:
+        return None
+    if (
+        complexity_level is not None
+        and complexity_level not in TEMPLATE_COMPLEXITY_LEVELS
+    ):
+        return None
+
+    text = _details_text(details)
+    steps = " ".join(processing_steps or []).lower()
+    unsupported = UNSUPPORTED_PROCESSING_PATTERN.search(f"{text} {steps}")
+    if unsupported:
+        logging.info(
+            f"No template, the visualization asks for {unsupported.group(0)!r}"
+        )
+        return None
+
+    for template in TEMPLATES:
+        try:
+            params = template.match(details, text, data)
+        except Exception as e:
+            logging.warning(f"Error matching template {template.name}: {str(e)}")
+            continue
+        if params is not None:
+            return TemplateMatch(template, params)
+
+    return None
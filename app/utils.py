@@ -1,13 +1,24 @@
 import logging
-import base64
+import hashlib
+import threading
 
+from concurrent.futures import Future
 from functools import wraps
-from typing import Callable, Any, TypeVar
+from typing import Callable, Any, Hashable, Optional, TypeVar
 
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 
+from .context import current_timeout
+
 T = TypeVar('T')
 
+# Traces described by summarize_figure_traces, the others are only counted
+FIGURE_SUMMARY_MAX_TRACES = 20
+# Change over a trace below this share of its range is reported as flat
+FLAT_TREND_RATIO = 0.05
+
 def handle_exceptions(
     default_return: Any = None,
     reraise: bool = True,
@@ -44,26 +55,19 @@ def handle_exceptions(
     return decorator
     
 
-def figure_to_base64(fig: go.Figure) -> str:
+def figure_hash(fig: go.Figure) -> str:
     """
-    Turn a Plotly figure to a base64 encoded image for LLM api queries.
+    Hash a Plotly figure, identical figures have the same hash.
 
     Args:
-        fig: The figure to encode
+        fig: The figure to hash
 
     Returns:
-        str: The encoded image in base64
-
+        str: Hex digest of the figure JSON
     """
-    try:
-        img_bytes = fig.to_image(format="png", engine="kaleido", width=800)
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-        return img_base64
+    return hashlib.sha256(fig.to_json().encode("utf-8")).hexdigest()
+
 
-    except Exception as e:
-        logging.error(f"Error converting figure to base64: {e}")
-        return ""
-    
 def enhance_plotly_figure(fig: go.Figure) -> go.Figure:
     """
     Function to improve accessibility and styling of a plotly figure.
@@ -132,3 +136,179 @@ def enhance_plotly_figure(fig: go.Figure) -> go.Figure:
     )
 
     return fig
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls sharing the same key.
+    The first caller runs the function, callers arriving while it runs wait for its result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run a function once for all concurrent callers of the same key.
+
+        Args:
+            key: Key identifying identical calls
+            func: The function to run
+            *args, **kwargs: Arguments of the function
+
+        Returns:
+            The result of the function, shared by all concurrent callers
+
+        Raises:
+            TimeoutError: If the stage of a follower ends before the result is available
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            # A follower waits no longer than its own stage allows
+            return future.result(timeout=current_timeout())
+
+        try:
+            result = func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+def warm_up_renderer() -> None:
+    """
+    Render a tiny figure so the kaleido process is started before the first real request.
+    """
+    try:
+        go.Figure(go.Scatter(x=[0, 1], y=[0, 1])).to_image(
+            format="png", engine="kaleido", width=50, height=50
+        )
+    except Exception as e:
+        logging.error(f"Error warming up the renderer: {e}")
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def _format_position(value: Any) -> str:
+    if isinstance(value, pd.Timestamp) and value == value.normalize():
+        return str(value.date())
+    return str(value)
+
+
+def _axis_title(axis) -> Optional[str]:
+    return axis.title.text if axis is not None and axis.title is not None else None
+
+
+def _summarize_series(
+    values: pd.Series, positions: Optional[pd.Series] = None, trend: bool = True
+) -> str:
+    """Range, extremes, mean and trend of numeric values, the extremes located by their positions"""
+    values = pd.to_numeric(values, errors="coerce").reset_index(drop=True)
+    valid = values.notna()
+    if not valid.any():
+        return "no numeric values"
+
+    numbers = values[valid].to_numpy(dtype=float)
+    positions = (
+        positions if positions is not None else pd.Series(values.index)
+    ).reset_index(drop=True)[valid.to_numpy()]
+    low, high = int(numbers.argmin()), int(numbers.argmax())
+
+    summary = (
+        f"min {_format_number(numbers[low])} at {_format_position(positions.iloc[low])}, "
+        f"max {_format_number(numbers[high])} at {_format_position(positions.iloc[high])}, "
+        f"mean {_format_number(numbers.mean())}"
+    )
+
+    if trend and len(numbers) > 2:
+        slope = np.polyfit(np.arange(len(numbers)), numbers, 1)[0]
+        change = slope * (len(numbers) - 1)
+        value_range = numbers[high] - numbers[low]
+        if value_range == 0 or abs(change) < FLAT_TREND_RATIO * value_range:
+            direction = "flat"
+        else:
+            direction = "rising" if change > 0 else "falling"
+        summary += f", trend {direction} ({change:+.3g} over the trace, first {_format_number(numbers[0])}, last {_format_number(numbers[-1])})"
+
+    return summary
+
+
+def _summarize_trace(trace) -> str:
+    """One line description of a trace"""
+    name = f' "{trace.name}"' if getattr(trace, "name", None) else ""
+
+    if trace.type == "pie":
+        shares = pd.Series(
+            pd.to_numeric(pd.Series(trace.values), errors="coerce").to_numpy(),
+            index=trace.labels,
+        ).dropna()
+        shares = (shares / shares.sum()).sort_values(ascending=False)
+        top = ", ".join(
+            f"{label} {share:.0%}" for label, share in shares.head(5).items()
+        )
+        return f"pie{name} ({len(shares)} slices): {top}"
+
+    if trace.type in ("heatmap", "contour"):
+        z = pd.Series(np.asarray(trace.z, dtype=float).ravel())
+        return (
+            f"{trace.type}{name} ({len(z)} cells): {_summarize_series(z, trend=False)}"
+        )
+
+    x = pd.Series(trace.x) if getattr(trace, "x", None) is not None else None
+    y = pd.Series(trace.y) if getattr(trace, "y", None) is not None else None
+    # Horizontal charts carry their values on x
+    if y is not None and x is not None and getattr(trace, "orientation", None) == "h":
+        x, y = y, x
+    if y is None:
+        return f"{trace.type}{name}"
+
+    description = f"{trace.type}{name} ({len(y)} points)"
+    if x is not None and len(x):
+        description += (
+            f": x from {_format_position(x.iloc[0])} to {_format_position(x.iloc[-1])}"
+        )
+    return f"{description}; y {_summarize_series(y, x)}"
+
+
+def summarize_figure_traces(fig: go.Figure) -> str:
+    """
+    Compact textual summary of a figure: titles, and per trace its range, extremes and trend.
+    Lets an LLM describe the figure without receiving it as an image.
+
+    Args:
+        fig: The figure to summarize
+
+    Returns:
+        str: The summary, one line per trace
+    """
+    layout = fig.layout
+    lines = [
+        f"Figure: {layout.title.text or 'untitled'}"
+        f" | x axis: {_axis_title(layout.xaxis) or 'untitled'}"
+        f" | y axis: {_axis_title(layout.yaxis) or 'untitled'}"
+    ]
+
+    for i, trace in enumerate(fig.data[:FIGURE_SUMMARY_MAX_TRACES]):
+        try:
+            lines.append(f"trace {i} {_summarize_trace(trace)}")
+        except Exception as e:
+            logging.warning(f"Error summarizing trace {i}: {e}")
+            lines.append(f"trace {i} {trace.type}")
+
+    if len(fig.data) > FIGURE_SUMMARY_MAX_TRACES:
+        lines.append(f"... {len(fig.data) - FIGURE_SUMMARY_MAX_TRACES} more traces")
+
+    return "\n".join(lines)
@@ -5,17 +5,42 @@ import logging
 import plotly.graph_objects as go
 import pandas as pd
 
-from typing import List
-
-from .constants import USER, USER
-from .utils import handle_exceptions
+from typing import List, Optional
+
+from .constants import (
+    USER,
+    USER,
+    OPEN_METEO_CACHE_SIZE,
+    OPEN_METEO_CACHE_TTL,
+    OPEN_METEO_TIMEOUT,
+    REFINE_MAX_TOKENS,
+)
+from .cache import TTLCache
+from .quota import QuotaExceeded, QuotaScheduler, estimate_request_weight
+from .context import DeadlineExceeded, PipelineContext, current_timeout
+from .utils import handle_exceptions, SingleFlight
+from .profiling import register_source
 from .api import OpenMeteoAPI
+from .dataset import OpenMeteoDataset
+from .gazetteer import load_gazetteer
+from .planner import (
+    PrefetchedResponses,
+    plan_missing,
+    plan_requests,
+    plan_resolution,
+    restrict_entry,
+    split_response,
+)
+from .session import ConversationSession
+from .templates import match_template
 from .prompts import (
     DETERMINE_VISUALIZATION_TYPE_PROMPT,
     DETERMINE_NEEDED_DATA_PROMPT,
     RETRIEVE_DATA_PROMPT,
+    REFINE_VISUALIZATION_PROMPT,
     PROCESS_DATA_PROMPT,
-    BUILD_VISUALIZATION_PROMPT
+    BUILD_VISUALIZATION_PROMPT,
+    PREVIOUS_VISUALIZATION_CODE_PROMPT,
 )
 from .models import (
     VisualizationType,
@@ -24,10 +49,14 @@ from .models import (
     APIEndpointResponse,
     NormalizedOpenMeteoData,
     ProcessedData,
+    VisualizationRefinement,
 )
-from .ai import anthropic_client
-
+from .routing import llm_router
 
+open_meteo_flight = SingleFlight()
+open_meteo_cache = TTLCache(maxsize=OPEN_METEO_CACHE_SIZE, ttl=OPEN_METEO_CACHE_TTL)
+open_meteo_scheduler = QuotaScheduler()
+open_meteo_prefetched = PrefetchedResponses(ttl=OPEN_METEO_CACHE_TTL)
 
 
 @handle_exceptions()
@@ -56,12 +85,13 @@ def determine_visualization_type(
         complexity_level=complexity_level,
     )
 
-    response = anthropic_client.structured_completion(
+    response = llm_router.structured_completion(
         messages=[
             {"role": USER, "content": system_prompt},
             {"role": USER, "content": prompt},
         ],
         response_format=VisualizationType,
+        stage="visualization_type",
         max_tokens=1000,
         temperature=.5
     )
@@ -70,7 +100,7 @@ def determine_visualization_type(
 
 @handle_exceptions()
 def determine_needed_data(
-    prompt: str, visualization_type: VisualizationType
+    prompt: str, visualization_type: VisualizationType, topic_of_interest: str = ""
 ) -> DataProcessingType:
     """
     Determine data requirements for the visualization
@@ -78,6 +108,7 @@ def determine_needed_data(
     Args:
         prompt (str): User's visualization request
         visualization (VisualizationType): Visualization details
+        topic_of_interest (str): Specific climate topic, used to filter the API catalog
 
     Returns:
         DataProcessingType: Data processing and API endpoint specifications
@@ -85,106 +116,257 @@ def determine_needed_data(
 
     system_prompt = DETERMINE_NEEDED_DATA_PROMPT.format(
         visualization_type=visualization_type,
-        API_ENDPOINT_INFORMATION=OpenMeteoAPI.__str__(),
+        API_ENDPOINT_INFORMATION=OpenMeteoAPI.relevant_catalog(
+            topic_of_interest, visualization_type
+        ),
     )
 
-    response = anthropic_client.structured_completion(
+    response = llm_router.structured_completion(
         messages=[
             {"role": USER, "content": system_prompt},
             {"role": USER, "content": prompt},
         ],
         response_format=DataProcessingType,
+        stage="needed_data",
         max_tokens=1000,
     )
     return response
 
 
 def build_data_retrieval(
-    visualization_type: VisualizationType, needed_data: str
+    visualization_type: VisualizationType, needed_data: str, topic_of_interest: str = ""
 ) -> list[APIEndpoint]:
     """
-    Build data retrieval queries for the specified visualization and data requirements
+    Build data retrieval queries for the specified visualization and data requirements.
+    Places mentioned in the request are resolved offline and given to the LLM with their coordinates,
+    and the coordinates it returns near a known place are replaced by the place's canonical ones.
 
     Args:
         visualization (VisualizationType): Visualization details
         needed_data (str): Data requirements
+        topic_of_interest (str): Specific climate topic, used to filter the API catalog
 
     Returns:
         list[APIEndpoint]: List of API endpoints to query
     """
-    system_prompt = str.format(RETRIEVE_DATA_PROMPT, visualization_type=visualization_type, needed_data=needed_data, API_ENDPOINT_INFORMATION=OpenMeteoAPI.__str__())
+    gazetteer = load_gazetteer()
+    system_prompt = str.format(
+        RETRIEVE_DATA_PROMPT,
+        visualization_type=visualization_type,
+        needed_data=needed_data,
+        API_ENDPOINT_INFORMATION=OpenMeteoAPI.relevant_catalog(
+            f"{topic_of_interest} {needed_data}", visualization_type
+        ),
+        locations=gazetteer.describe_locations(f"{topic_of_interest} {needed_data}"),
+    )
 
-    response = anthropic_client.structured_completion(
+    response = llm_router.structured_completion(
         messages=[
             {"role": USER, "content": system_prompt},
         ],
         response_format=APIEndpointResponse,
+        stage="data_retrieval",
         max_tokens=800,
         temperature=.3
     )
 
+    if isinstance(response, APIEndpointResponse):
+        response.endpoints = [
+            APIEndpoint(url=gazetteer.canonicalize_url(endpoint.url))
+            for endpoint in response.endpoints
+        ]
+
+    return response
+
+
+@handle_exceptions()
+def refine_visualization(
+    prompt: str, topic_of_interest: str, session: ConversationSession
+) -> VisualizationRefinement:
+    """
+    Define the visualization answering a follow-up, and the data it needs, in a single call.
+
+    Args:
+        prompt (str): The follow-up message
+        topic_of_interest (str): Specific climate topic
+        session (ConversationSession): The conversation, with the previous visualization and the data in memory
+
+    Returns:
+        VisualizationRefinement: The visualization details, data requirements and endpoints
+    """
+    gazetteer = load_gazetteer()
+    text = f"{topic_of_interest} {prompt}"
+    places = gazetteer.find(text)
+
+    system_prompt = str.format(
+        REFINE_VISUALIZATION_PROMPT,
+        prompt=prompt,
+        topic_of_interest=topic_of_interest,
+        session=session.describe(),
+        API_ENDPOINT_INFORMATION=OpenMeteoAPI.relevant_catalog(text),
+        locations="\n".join(str(place) for place in places)
+        or "No new location mentioned, keep the locations of the data in memory",
+    )
+
+    response = llm_router.structured_completion(
+        messages=[
+            {"role": USER, "content": system_prompt},
+        ],
+        response_format=VisualizationRefinement,
+        stage="refine",
+        max_tokens=REFINE_MAX_TOKENS,
+        temperature=0.3,
+    )
+
+    if isinstance(response, VisualizationRefinement):
+        response.endpoints = [
+            APIEndpoint(url=gazetteer.canonicalize_url(endpoint.url))
+            for endpoint in response.endpoints
+        ]
+
     return response
 
 
-def retrieve_data(api_endpoints: APIEndpointResponse) -> List[NormalizedOpenMeteoData]:
+def fetch_json(url: str):
     """
-    Retrieve data from multiple API OpenMeteo endpoints
+    Fetch the JSON response of an API URL, from the data cache or the prefetched series when possible.
+    Identical requests made concurrently by different pipelines share a single round trip,
+    and requests sent to the API wait for budget within its call limits.
+
+    Args:
+        url (str): Canonical URL to fetch
+
+    Returns:
+        The decoded JSON response
+    """
+    json_data = open_meteo_cache.get(url)
+    if json_data is not None:
+        return json_data
+
+    json_data = open_meteo_prefetched.get(url)
+    if json_data is not None:
+        return json_data
+
+    return open_meteo_flight.do(url, _fetch_json, url)
+
+
+def refresh_json(
+    url: str, max_wait: Optional[float] = None, reserved_share: float = 0.0
+):
+    """
+    Fetch the JSON response of an API URL from the API, even when cached, and cache it again.
+
+    Args:
+        url (str): Canonical URL to fetch
+        max_wait (float): Seconds the request may wait for API budget, defaults to the scheduler's
+        reserved_share (float): Share of the API budget left to other requests, for background fetches
+
+    Returns:
+        The decoded JSON response
+    """
+    return open_meteo_flight.do(url, _fetch_json, url, max_wait, reserved_share)
+
+
+def _fetch_json(
+    url: str, max_wait: Optional[float] = None, reserved_share: float = 0.0
+):
+    open_meteo_scheduler.acquire(
+        estimate_request_weight(url), current_timeout(), max_wait, reserved_share
+    )
+
+    # The time spent waiting for budget counts against the stage
+    stage_timeout = current_timeout()
+    timeout = (
+        OPEN_METEO_TIMEOUT
+        if stage_timeout is None
+        else min(OPEN_METEO_TIMEOUT, stage_timeout)
+    )
+    response = requests.get(url, timeout=timeout)
+
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "")
+        open_meteo_scheduler.throttle(
+            float(retry_after) if retry_after.isdigit() else None
+        )
+    if not response.status_code == 200:
+        raise ValueError(
+            f"Invalid response status code {response.status_code} from {url}"
+        )
+
+    json_data = response.json()
+    if json_data is None:
+        raise ValueError(f"Null JSON response from {url}")
+
+    open_meteo_cache.set(url, json_data)
+    return json_data
+
+
+def retrieve_data(api_endpoints: APIEndpointResponse) -> OpenMeteoDataset:
+    """
+    Retrieve data from multiple API OpenMeteo endpoints.
+    Compatible endpoints are merged into as few requests as possible,
+    multi-location responses are split back into one entry per location.
     
     Args:
         api_endpoints (APIEndpointResponse): Object containing list of API endpoints to query
         
     Returns:
-        List[NormalizedOpenMeteoData]: List of normalized data objects
+        OpenMeteoDataset: The normalized data of each location, in the order of the endpoints
     """
-    consolidated_data: List[NormalizedOpenMeteoData] = []
-    
-    for endpoint in api_endpoints.endpoints:
+    return OpenMeteoDataset.from_sources(retrieve_data_sources(api_endpoints))
+
+
+def retrieve_data_sources(
+    api_endpoints: APIEndpointResponse,
+) -> List[tuple[str, NormalizedOpenMeteoData]]:
+    """
+    Retrieve data like retrieve_data, along with the canonical single-location URL of each entry.
+
+    Args:
+        api_endpoints (APIEndpointResponse): Object containing list of API endpoints to query
+
+    Returns:
+        List[tuple[str, NormalizedOpenMeteoData]]: The URL and normalized data of each entry, in the order of the endpoints
+
+    Raises:
+        DeadlineExceeded: If a request times out, the data would be incomplete
+    """
+    consolidated_data: list[tuple[tuple[int, int], str, NormalizedOpenMeteoData]] = []
+
+    # Hallucinated endpoints and parameters are rejected here, before any network round trip
+    for planned in plan_requests(api_endpoints.endpoints):
         try:
-            response = requests.get(endpoint.url)
-            
-            if not response.status_code == 200:
-                raise ValueError(f"Invalid response status code {response.status_code} from {endpoint.url}")
-                
-            json_data = response.json()
-            if json_data is None:
-                raise ValueError(f"Null JSON response from {endpoint.url}")
-                
-            metadata_df = pd.DataFrame()
-            hourly_df = pd.DataFrame()
-            daily_df = pd.DataFrame()
-            
-            if 'hourly' in json_data:
-                hourly_df = pd.DataFrame(json_data.pop('hourly'))
-                
-            # Handle daily data if present
-            if 'daily' in json_data:
-                daily_df = pd.DataFrame(json_data.pop('daily'))
-            
-            # Create metadata DataFrame from remaining scalar values
-            # Convert to a single-row DataFrame with an explicit index
-
-            metadata_df = pd.DataFrame([json_data])
-            
-            # Create normalized data object with all fields initialized
-            normalized_data = NormalizedOpenMeteoData(
-                metadata=metadata_df,
-                hourly_data=hourly_df,
-                daily_data=daily_df
-            )
-            
-            consolidated_data.append(normalized_data)
-            
+            json_data = fetch_json(planned.url)
+
+            for source, location_data in split_response(planned, json_data):
+                normalized_data = NormalizedOpenMeteoData.from_response(location_data)
+                consolidated_data.append(
+                    (
+                        (source.endpoint_index, source.location_index),
+                        planned.source_url(source),
+                        normalized_data,
+                    )
+                )
+
+        except (requests.Timeout, TimeoutError) as e:
+            raise DeadlineExceeded(f"Fetching {planned.url} timed out: {str(e)}") from e
         except requests.RequestException as e:
-            print(f"API Request Error for {endpoint.url}: {str(e)}")
+            logging.error(f"API Request Error for {planned.url}: {str(e)}")
+            continue
+        except QuotaExceeded as e:
+            logging.warning(f"API Quota Error for {planned.url}: {str(e)}")
             continue
         except ValueError as e:
-            print(f"Data Validation Error for {endpoint.url}: {str(e)}")
+            logging.warning(f"Data Validation Error for {planned.url}: {str(e)}")
             continue
         except Exception as e:
-            print(f"Unexpected Error for {endpoint.url}: {str(e)}")
+            logging.error(
+                f"Unexpected Error for {planned.url}: {str(e)}", exc_info=True
+            )
             continue
-            
-    return consolidated_data
+
+    consolidated_data.sort(key=lambda entry: entry[0])
+    return [(url, normalized_data) for _, url, normalized_data in consolidated_data]
 
 
 @handle_exceptions()
@@ -202,7 +384,7 @@ def process_data(
         ProcessedData: Processed data ready for visualization
     """
 
-    data_description = [entry.__str__() for entry in data]
+    data_description = "\n\n".join(entry.generate_data_preview() for entry in data)
 
     system_prompt = str.format(
         PROCESS_DATA_PROMPT, 
@@ -212,16 +394,19 @@ def process_data(
     )
 
     # Use LLM to dynamically generate data processing code
-    response = anthropic_client.completion(
+    response = llm_router.completion(
         messages=[
             {"role": USER, "content": system_prompt},
         ],
+        stage="processing",
         max_tokens=700,
         temperature=.8
     )
 
     try:
-        exec(response)
+        exec(
+            compile(response, register_source(response, "generated-processing"), "exec")
+        )
         processed_data: ProcessedData = locals().get("process_raw_data")(data)
         return processed_data
 
@@ -233,26 +418,76 @@ def process_data(
 
 @handle_exceptions()
 def process_and_viz(data: List[NormalizedOpenMeteoData], visualization_type, complexity_level, processing_steps) -> go.Figure:
+    code = generate_visualization_code(
+        data, visualization_type, complexity_level, processing_steps
+    )
+    return execute_visualization_code(code, data)
+
+
+def generate_visualization_code(
+    data: List[NormalizedOpenMeteoData],
+    visualization_type: VisualizationType,
+    complexity_level: str,
+    processing_steps: str,
+    previous_code: Optional[str] = None,
+) -> str:
+    """
+    Generate the code of the visualize() function drawing the visualization.
+
+    Args:
+        data (List[NormalizedOpenMeteoData]): The fetched data, previewed in the prompt
+        visualization_type (VisualizationType): Visualization details
+        complexity_level (str): Visualization complexity prompt
+        processing_steps (str): Data processing steps
+        previous_code (str): Code of the previous visualization of the conversation, given as a starting point
+
+    Returns:
+        str: The generated code
+    """
+    if not isinstance(data, OpenMeteoDataset):
+        data = OpenMeteoDataset(data)
+    data_preview = data.generate_data_preview()
+
     prompt = BUILD_VISUALIZATION_PROMPT.format(
         visualization_type=visualization_type,
         complexity_level=complexity_level,
         processing_steps=processing_steps,
-        data_preview=data.__str__()
+        data_preview=data_preview,
     )
+    if previous_code:
+        prompt += PREVIOUS_VISUALIZATION_CODE_PROMPT.format(previous_code=previous_code)
 
-    response = anthropic_client.completion(
+    return llm_router.completion(
         messages=[
             {"role": USER, "content": prompt},
         ],
+        stage="codegen",
         max_tokens=2000,
     )
 
-    exec(response)
-    fig = locals().get("visualize")(data)
 
+def execute_visualization_code(
+    code: str, data: List[NormalizedOpenMeteoData]
+) -> go.Figure:
+    """
+    Execute generated visualization code on the data.
 
+    Args:
+        code (str): Code defining a visualize() function
+        data (List[NormalizedOpenMeteoData]): The data to visualize
+
+    Returns:
+        go.Figure: The figure returned by visualize()
+    """
+    # A copy of the module globals, so helpers and imports defined by the code are visible to visualize()
+    namespace = dict(globals())
+    # Compiled under its own name, so profiles and tracebacks point to the generated lines
+    exec(
+        compile(code, register_source(code, "generated-visualization"), "exec"),
+        namespace,
+    )
+    return namespace["visualize"](data)
 
-    return fig
 
 @handle_exceptions(default_return=(None, None))
 def visualization_generation_pipeline(
@@ -260,6 +495,9 @@ def visualization_generation_pipeline(
     persona: str,
     topic_of_interest: str,
     complexity_level: str,
+    context: Optional[PipelineContext] = None,
+    visualization_details: Optional[VisualizationType] = None,
+    session: Optional[ConversationSession] = None,
 ) -> tuple[go.Figure, pd.DataFrame]:
     """
     Comprehensive visualization generation pipeline
@@ -268,26 +506,174 @@ def visualization_generation_pipeline(
         prompt (str): User's visualization request
         persona (str): User persona
         complexity_level (ComplexityLevel): Visualization complexity
+        context (PipelineContext): State of the run, used to cancel it between stages
+        visualization_details (VisualizationType): Visualization details, when already computed
+        session (ConversationSession): The conversation, recording the data and figure code for follow-ups
 
     Returns:
         tuple: Generated figure and processed data
     """
-    visualization_details: VisualizationType = determine_visualization_type(
-        prompt, topic_of_interest, persona, complexity_level
-    )
+    context = context or PipelineContext()
+
+    if visualization_details is None:
+        with context.stage("visualization_type"):
+            visualization_details = determine_visualization_type(
+                prompt, topic_of_interest, persona, complexity_level
+            )
     logging.info(f"Visualization details: {visualization_details}")
-    data_requirements: DataProcessingType = determine_needed_data(prompt, visualization_details)
 
+    with context.stage("needed_data"):
+        data_requirements: DataProcessingType = determine_needed_data(
+            prompt, visualization_details, topic_of_interest
+        )
     logging.info(f"Data requirements: {data_requirements}")
+
     # Retrieve data from specified endpoints
-    api_endpoints = build_data_retrieval(
-        visualization_details, data_requirements.needed_data
-    )
+    with context.stage("data_retrieval"):
+        api_endpoints = build_data_retrieval(
+            visualization_details, data_requirements.needed_data, topic_of_interest
+        )
+
+        # Request daily aggregates instead of hourly series when only aggregates are plotted
+        api_endpoints = plan_resolution(
+            api_endpoints, data_requirements, visualization_details
+        )
 
     logging.info(f"Raw data: {api_endpoints}")
-    normalized_data = retrieve_data(api_endpoints)
+    with context.stage("fetch"):
+        fetched = retrieve_data_sources(api_endpoints)
+    if not fetched:
+        raise ValueError(f"No data could be retrieved for: {prompt}")
+    normalized_data = OpenMeteoDataset.from_sources(fetched)
+
+    fig, code = _draw_visualization(
+        normalized_data,
+        visualization_details,
+        complexity_level,
+        data_requirements,
+        context,
+    )
 
-    # Execute visualization generation
-    fig = process_and_viz(normalized_data, visualization_details, complexity_level, data_requirements.data_processing_steps)
+    if session is not None:
+        session.record(visualization_details, data_requirements, code, fetched)
 
     return fig, normalized_data
+
+
+@handle_exceptions(default_return=(None, None))
+def refine_visualization_pipeline(
+    prompt: str,
+    topic_of_interest: str,
+    complexity_level: str,
+    session: ConversationSession,
+    context: Optional[PipelineContext] = None,
+) -> tuple[go.Figure, List[NormalizedOpenMeteoData]]:
+    """
+    Cheaper pipeline for the follow-ups of a conversation.
+    A single call defines the visualization and its data, the data in memory is reused, cut down to the
+    requested variables and range, only the variables it doesn't cover are fetched and merged into the same
+    location, and the previous figure code is adapted.
+
+    Args:
+        prompt (str): The follow-up message
+        topic_of_interest (str): Specific climate topic
+        complexity_level (str): Visualization complexity
+        session (ConversationSession): The conversation, must have a previous visualization
+        context (PipelineContext): State of the run, used to cancel it between stages
+
+    Returns:
+        tuple: Generated figure and the data it was drawn from
+
+    Raises:
+        ValueError: If no data serves the follow-up
+    """
+    context = context or PipelineContext()
+
+    with context.stage("refine"):
+        refinement = refine_visualization(prompt, topic_of_interest, session)
+        visualization_details = refinement.visualization_type
+        data_requirements = DataProcessingType(
+            needed_data=refinement.needed_data,
+            data_processing_steps=refinement.data_processing_steps,
+        )
+        api_endpoints = plan_resolution(
+            APIEndpointResponse(endpoints=refinement.endpoints),
+            data_requirements,
+            visualization_details,
+        )
+        plans = plan_missing(api_endpoints.endpoints, session.urls)
+    used = list(dict.fromkeys(index for plan in plans for index in plan.reused))
+    missing = [plan.missing for plan in plans if plan.missing is not None]
+    logging.info(
+        f"Refined visualization: {visualization_details}, reusing {len(used)} data entries, fetching {len(missing)}"
+    )
+
+    fetched = []
+    if missing:
+        with context.stage("fetch"):
+            fetched = retrieve_data_sources(APIEndpointResponse(endpoints=missing))
+    fetched_by_url = dict(fetched)
+
+    # One entry per requested location, the data in memory and the fetched variables joined on time
+    sources = []
+    for plan in plans:
+        entries = [
+            restrict_entry(session.data[index].data, plan.parameters, plan.variables)
+            for index in plan.reused
+        ]
+        if plan.missing is not None and plan.missing.url in fetched_by_url:
+            entries.append(fetched_by_url[plan.missing.url])
+        if entries:
+            sources.append((plan.url, NormalizedOpenMeteoData.merge(entries)))
+
+    normalized_data = OpenMeteoDataset.from_sources(sources)
+    if not normalized_data:
+        raise ValueError(f"No data for the follow-up: {prompt}")
+    context.add_metric("session_reused_data", len(used))
+    context.add_metric("session_fetched_data", len(fetched))
+
+    fig, code = _draw_visualization(
+        normalized_data,
+        visualization_details,
+        complexity_level,
+        data_requirements,
+        context,
+        previous_code=session.figure_code,
+    )
+    session.record(visualization_details, data_requirements, code, fetched)
+
+    return fig, normalized_data
+
+
+def _draw_visualization(
+    data: List[NormalizedOpenMeteoData],
+    visualization_details: VisualizationType,
+    complexity_level: str,
+    data_requirements: DataProcessingType,
+    context: PipelineContext,
+    previous_code: Optional[str] = None,
+) -> tuple[go.Figure, Optional[str]]:
+    """Draw the visualization with a template when one fits and LLM code generation otherwise, returning the code if any"""
+    with context.stage("codegen"):
+        template = match_template(
+            visualization_details,
+            data,
+            data_requirements.data_processing_steps,
+            complexity_level,
+            previous_code,
+        )
+        if template is not None:
+            logging.info(
+                f"Visualization drawn with the {template.template.name} template"
+            )
+            context.add_metric("template_visualizations", 1)
+            return template.render(data, visualization_details), None
+
+        code = generate_visualization_code(
+            data,
+            visualization_details,
+            complexity_level,
+            data_requirements.data_processing_steps,
+            previous_code,
+        )
+        return execute_visualization_code(code, data), code
@@ -0,0 +1,264 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from datetime import date, timedelta
+from typing import Optional
+from urllib.parse import urlencode, urlsplit, parse_qsl
+
+from .api import OpenMeteoAPI
+from .constants import WARMUP_CONFIG_PATH, DEFAULT_WARMUP_CONFIG
+from .gazetteer import load_gazetteer
+from .models import NormalizedOpenMeteoData, VisualizationType
+from .quota import QuotaExceeded, estimate_request_weight
+from .render import render_figure
+from .templates import match_template
+from .visualization import open_meteo_prefetched, open_meteo_scheduler, refresh_json
+
+# Archetypes pre-rendered from the prefetched series when render_templates is set
+WARMUP_FIGURES = [
+    VisualizationType(
+        visualization="Yearly temperature",
+        chart_type="line chart",
+        focus="yearly trend of temperature",
+        visual_elements="years",
+    ),
+    VisualizationType(
+        visualization="Temperature anomalies",
+        chart_type="heatmap",
+        focus="monthly temperature anomalies",
+        visual_elements="months by years",
+    ),
+]
+
+
+def load_warmup_config(path: str = WARMUP_CONFIG_PATH) -> dict:
+    """
+    Load the warm-up config, the keys of the config file overriding the default ones.
+
+    Args:
+        path (str): Path of the JSON config
+
+    Returns:
+        dict: The config
+    """
+    config = dict(DEFAULT_WARMUP_CONFIG)
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            config.update(json.load(file))
+    return config
+
+
+def _chunk_urls(url: str, budget: float) -> list[str]:
+    """
+    Split the date range of a series into consecutive chunks weighing at most budget calls each.
+
+    Args:
+        url (str): Canonical URL of the series
+        budget (float): Weighted calls a chunk may use
+
+    Returns:
+        list[str]: URLs of the chunks, the URL itself when it fits or has no date range
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    weight = estimate_request_weight(url)
+    if weight <= budget or not (query.get("start_date") and query.get("end_date")):
+        return [url]
+
+    start, end = date.fromisoformat(query["start_date"]), date.fromisoformat(
+        query["end_date"]
+    )
+    days = (end - start).days + 1
+    count = math.ceil(weight / budget)
+    while True:
+        size = math.ceil(days / count)
+        urls = []
+        for offset in range(0, days, size):
+            chunk_start = start + timedelta(days=offset)
+            query["start_date"] = chunk_start.isoformat()
+            query["end_date"] = min(
+                end, chunk_start + timedelta(days=size - 1)
+            ).isoformat()
+            urls.append(
+                f"{parts.scheme}://{parts.netloc}{parts.path}?{urlencode(sorted(query.items()), safe=',:/')}"
+            )
+        # Chunks of a day that still don't fit are left to the scheduler to reject
+        if size == 1 or all(estimate_request_weight(chunk) <= budget for chunk in urls):
+            return urls
+        count += 1
+
+
+def _concatenate(responses: list[dict]) -> dict:
+    """Join the responses of consecutive chunks of a series into the response of the whole series"""
+    joined = dict(responses[0])
+    for resolution in ("hourly", "daily"):
+        if resolution in joined:
+            joined[resolution] = {
+                name: [
+                    value
+                    for response in responses
+                    for value in response[resolution][name]
+                ]
+                for name in joined[resolution]
+            }
+    return joined
+
+
+class WarmUpJob:
+    """
+    Prefetch the most requested series into the data caches, at start and then periodically,
+    so the first requests of the day don't pay for a cold cache.
+    Prefetches are background requests: they wait behind queued user requests, only use the budget
+    left after the reserved share of every window, and long series are fetched in chunks that fit it.
+    """
+
+    def __init__(self, config: Optional[dict] = None):
+        self.config = config or load_warmup_config()
+        self.runs = 0
+        self.last_run: Optional[dict] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def urls(self, today: Optional[date] = None) -> list[str]:
+        """
+        Build the canonical URLs of every series at every location.
+
+        Args:
+            today (date): Date the relative ranges end at, defaults to today
+
+        Returns:
+            list[str]: The URLs, invalid series are skipped
+        """
+        today = today or date.today()
+        gazetteer = load_gazetteer()
+
+        urls = []
+        for name in self.config["locations"]:
+            place = gazetteer.get(name)
+            if place is None:
+                logging.warning(f"Unknown warm-up location {name}")
+                continue
+
+            for series in self.config["series"]:
+                query = {
+                    "latitude": place.latitude,
+                    "longitude": place.longitude,
+                    **series.get("parameters", {}),
+                }
+                end = today - timedelta(days=series.get("lag_days", 0))
+                if "years" in series:
+                    query.setdefault(
+                        "start_date", date(end.year - series["years"], 1, 1).isoformat()
+                    )
+                elif "days" in series:
+                    query.setdefault(
+                        "start_date", (end - timedelta(days=series["days"])).isoformat()
+                    )
+                query.setdefault("end_date", end.isoformat())
+
+                try:
+                    urls.append(
+                        OpenMeteoAPI.validate_url(
+                            f"{series['url']}?{urlencode(query, safe=',:/')}"
+                        )
+                    )
+                except ValueError as e:
+                    logging.warning(f"Invalid warm-up series {series['url']}: {str(e)}")
+
+        return urls
+
+    def _render_templates(self, data: NormalizedOpenMeteoData) -> int:
+        """Render the template figures matching the data, returns the number of figures rendered"""
+        rendered = 0
+        for details in WARMUP_FIGURES:
+            template = match_template(details, [data])
+            if template is not None:
+                render_figure(template.render([data], details))
+                rendered += 1
+        return rendered
+
+    def run_once(self) -> dict:
+        """
+        Prefetch every series, skipping those the unreserved API budget can't afford in time.
+
+        Returns:
+            dict: Numbers of series fetched, skipped and failed, figures rendered and duration
+        """
+        start = time.perf_counter()
+        summary = {"fetched": 0, "skipped": 0, "failed": 0, "rendered": 0}
+        reserved_share = self.config["reserved_share"]
+        # A chunk must fit in the unreserved budget of the smallest window
+        budget = min(limit for _, limit in open_meteo_scheduler.limits.values()) * (
+            1 - reserved_share
+        )
+        # Prefetched series stay served until the next run has refreshed them
+        ttl = self.config["interval"] * 1.5
+
+        for url in self.urls():
+            try:
+                json_data = _concatenate(
+                    [
+                        refresh_json(chunk, self.config["max_wait"], reserved_share)
+                        for chunk in _chunk_urls(url, budget)
+                    ]
+                )
+                open_meteo_prefetched.add(url, json_data, ttl)
+                data = NormalizedOpenMeteoData.from_response(json_data)
+                summary["fetched"] += 1
+                if self.config["render_templates"]:
+                    summary["rendered"] += self._render_templates(data)
+            except QuotaExceeded as e:
+                logging.info(
+                    f"Skipping warm-up of {url}, the unreserved API budget is used: {str(e)}"
+                )
+                summary["skipped"] += 1
+            except Exception as e:
+                logging.warning(f"Error warming up {url}: {str(e)}")
+                summary["failed"] += 1
+
+        summary["duration"] = time.perf_counter() - start
+        self.runs += 1
+        self.last_run = summary
+        logging.info(f"Warm-up done: {summary}")
+        return summary
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Error in warm-up: {str(e)}", exc_info=True)
+            self._stop.wait(self.config["interval"])
+
+    def start(self) -> None:
+        """Run the warm-up in a background thread, now and then every interval"""
+        if not self.config["enabled"] or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.config["enabled"],
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "prefetched": open_meteo_prefetched.stats(),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prefetch the configured series once, e.g. from a scheduled task"
+    )
+    parser.add_argument("--config", default=WARMUP_CONFIG_PATH)
+    args = parser.parse_args()
+
+    print(WarmUpJob(load_warmup_config(args.config)).run_once())
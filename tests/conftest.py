@@ -0,0 +1,5 @@
+import os
+
+# The provider clients are created at import, they need keys even though the tests never call them
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
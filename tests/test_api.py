@@ -0,0 +1,101 @@
+import re
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from app.api import OpenMeteoAPI
+from app.models import VisualizationType
+from app.prompts import RETRIEVE_DATA_PROMPT
+
+ARCHIVE = "https://archive-api.open-meteo.com/v1/archive"
+AIR_QUALITY = "https://air-quality-api.open-meteo.com/v1/air-quality"
+
+
+def test_catalog_search_maps_everyday_words_to_variables():
+    matches = OpenMeteoAPI.index.search("how polluted is the air in Nagoya")
+
+    assert matches
+    assert all(url == AIR_QUALITY for url, _, _ in matches)
+    assert (AIR_QUALITY, "hourly_parameters", "pm2_5") in matches
+
+
+def test_catalog_search_without_matches():
+    assert OpenMeteoAPI.index.search("zzz qqq") == []
+
+
+def test_relevant_catalog_keeps_only_matching_parameters():
+    details = VisualizationType(
+        visualization="Yearly rainfall",
+        chart_type="bar chart",
+        focus="rainfall",
+        visual_elements="bars per year",
+    )
+
+    catalog = OpenMeteoAPI.relevant_catalog("rainfall in Nagoya", details)
+
+    assert "precipitation" in catalog
+    assert "pm2_5" not in catalog
+    assert len(catalog) < len(str(OpenMeteoAPI))
+    # The selection is serialized once
+    assert OpenMeteoAPI.relevant_catalog("rainfall in Nagoya", details) is catalog
+
+
+def test_relevant_catalog_falls_back_to_the_full_catalog():
+    assert OpenMeteoAPI.relevant_catalog("zzz qqq") == str(OpenMeteoAPI)
+
+
+def _prompt_example_urls() -> list[str]:
+    return re.findall(r'url="([^"]+)"', RETRIEVE_DATA_PROMPT)
+
+
+@pytest.mark.parametrize("url", _prompt_example_urls())
+def test_prompt_examples_are_valid(url):
+    query = dict(parse_qsl(urlsplit(url).query))
+    canonical = dict(parse_qsl(urlsplit(OpenMeteoAPI.validate_url(url)).query))
+
+    for key in ("hourly", "daily"):
+        if key in query:
+            assert sorted(canonical[key].split(",")) == sorted(query[key].split(","))
+
+
+def test_validate_url_canonicalizes():
+    url = f"{ARCHIVE}?start_date=2020-01-01&longitude=136.9064&latitude=35.1815&end_date=2020-01-31&daily=temperature_2m_min, temperature_2m_max"
+
+    canonical = OpenMeteoAPI.validate_url(url)
+
+    assert canonical == (
+        f"{ARCHIVE}?daily=temperature_2m_max,temperature_2m_min&end_date=2020-01-31"
+        "&latitude=35.25&longitude=137&start_date=2020-01-01"
+    )
+    # Nearby coordinates of the same grid cell share the URL
+    assert (
+        OpenMeteoAPI.validate_url(
+            url.replace("35.1815", "35.3").replace("136.9064", "136.95")
+        )
+        == canonical
+    )
+    assert OpenMeteoAPI.validate_url(canonical) == canonical
+
+
+def test_validate_url_drops_unknown_variables():
+    url = f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2020-01-01&end_date=2020-01-31&daily=temperature_2m_max,made_up"
+
+    query = dict(parse_qsl(urlsplit(OpenMeteoAPI.validate_url(url)).query))
+
+    assert query["daily"] == "temperature_2m_max"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://example.com/v1/archive?latitude=35.2&longitude=136.9",
+        f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2020-01-01&end_date=2020-01-31&daily=made_up",
+        f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2020-01-01&daily=temperature_2m_max",
+        f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2020-02-01&end_date=2020-01-31&daily=temperature_2m_max",
+        f"{ARCHIVE}?latitude=95&longitude=136.9&start_date=2020-01-01&end_date=2020-01-31&daily=temperature_2m_max",
+        f"{ARCHIVE}?latitude=north&longitude=136.9&start_date=2020-01-01&end_date=2020-01-31&daily=temperature_2m_max",
+    ],
+)
+def test_validate_url_rejects_invalid_urls(url):
+    with pytest.raises(ValueError):
+        OpenMeteoAPI.validate_url(url)
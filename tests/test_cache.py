@@ -0,0 +1,51 @@
+import time
+
+from app.cache import TTLCache
+
+
+def test_get_returns_cached_values_and_counts_hits():
+    cache = TTLCache()
+    cache.set("key", "value")
+
+    assert cache.get("key") == "value"
+    assert cache.get("missing", "default") == "default"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set("default", 1)
+    cache.set("short", 2, ttl=1)
+
+    now[0] += 5
+    assert "short" not in cache
+    assert cache.get("short") is None
+    assert cache.get("default") == 1
+
+    now[0] += 10
+    assert cache.get("default") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Reading "a" makes "b" the least recently used entry
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_clear_removes_every_entry():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.get("a") is None
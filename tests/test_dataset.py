@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.dataset import OpenMeteoDataset
+from app.models import NormalizedOpenMeteoData
+
+ARCHIVE = "https://archive-api.open-meteo.com/v1/archive"
+AIR_QUALITY = "https://air-quality-api.open-meteo.com/v1/air-quality"
+
+
+def _entry(
+    latitude: float, longitude: float, **variables: float
+) -> NormalizedOpenMeteoData:
+    times = pd.date_range("2020-01-01", "2020-01-03 23:00", freq="h")
+    hourly = pd.DataFrame({"time": times.strftime("%Y-%m-%dT%H:%M"), **variables})
+    units = {name: "°C" for name in variables}
+    metadata = pd.DataFrame(
+        [{"latitude": latitude, "longitude": longitude, "hourly_units": units}]
+    )
+    return NormalizedOpenMeteoData(
+        metadata=metadata, hourly_data=hourly, daily_data=pd.DataFrame()
+    )
+
+
+def test_view_shares_the_memory_of_the_dataset_frame():
+    dataset = OpenMeteoDataset(
+        [
+            _entry(35.25, 137.0, temperature_2m=1.0),
+            _entry(43.0, 141.25, temperature_2m=2.0),
+        ]
+    )
+
+    view = dataset.view(dataset.locations[1], "hourly")
+
+    assert np.shares_memory(view.to_numpy(), dataset.frame("hourly").to_numpy())
+    assert len(view) == 72
+    assert (view["temperature_2m"] == 2.0).all()
+
+
+def test_from_sources_merges_the_entries_of_a_grid_cell_and_endpoint():
+    dataset = OpenMeteoDataset.from_sources(
+        [
+            (ARCHIVE, _entry(35.25, 137.0, temperature_2m=1.0)),
+            (AIR_QUALITY, _entry(35.25, 137.0, pm2_5=10.0)),
+            (ARCHIVE, _entry(35.25, 137.0, precipitation=0.5)),
+        ]
+    )
+
+    assert dataset.endpoints == ["archive", "air-quality"]
+    assert list(dataset[0].hourly_data.columns) == [
+        "time",
+        "temperature_2m",
+        "precipitation",
+    ]
+    assert dataset[0]._get_units("hourly_units") == {
+        "temperature_2m": "°C",
+        "precipitation": "°C",
+    }
+
+
+def test_grid_cells_resolving_to_one_place_get_their_coordinates():
+    dataset = OpenMeteoDataset.from_sources(
+        [
+            (ARCHIVE, _entry(35.25, 137.0, temperature_2m=1.0)),
+            (ARCHIVE, _entry(35.0, 136.75, temperature_2m=2.0)),
+        ]
+    )
+
+    assert dataset.locations == ["Nagoya (35.25°, 137.00°)", "Nagoya (35.00°, 136.75°)"]
+    assert dataset.view(dataset.locations[1], "hourly")["temperature_2m"].iloc[0] == 2.0
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda dataset: dataset.append(dataset[0]),
+        lambda dataset: dataset.pop(),
+        lambda dataset: dataset.sort(key=id),
+        lambda dataset: dataset.__setitem__(0, dataset[0]),
+        lambda dataset: dataset.__delitem__(0),
+    ],
+)
+def test_dataset_is_read_only(mutate):
+    dataset = OpenMeteoDataset([_entry(35.25, 137.0, temperature_2m=1.0)])
+
+    with pytest.raises(TypeError):
+        mutate(dataset)
+    assert len(dataset) == len(dataset.locations) == 1
@@ -0,0 +1,92 @@
+import plotly.graph_objects as go
+
+from app import main
+from app.context import PipelineContext
+from app.main import (
+    AUDIENCE_LEVELS,
+    describe_visualization_for_audiences,
+    generate_group_visualization,
+)
+from app.prompts import (
+    LVL0_EXP_PROMPT,
+    LVL0_VIZ_PROMPT,
+    LVL2_EXP_PROMPT,
+    LVL2_VIZ_PROMPT,
+)
+
+
+def _stub_explanations(monkeypatch, degradation=None) -> list:
+    calls = []
+
+    def describe(
+        data_description,
+        complexity_level,
+        fig,
+        context,
+        mode,
+        image=None,
+        trace_summary=None,
+    ):
+        level = next(
+            level
+            for level, prompt in AUDIENCE_LEVELS.items()
+            if prompt == complexity_level
+        )
+        calls.append(level)
+        if degradation:
+            context.degrade(degradation)
+        return f"{level} explanation"
+
+    monkeypatch.setattr(main, "_describe", describe)
+    monkeypatch.setattr(main, "_render_for_llm", lambda fig, context: None)
+    monkeypatch.setattr(main, "explanation_cache", main.TTLCache())
+    return calls
+
+
+def test_explanations_are_cached_per_level(monkeypatch):
+    calls = _stub_explanations(monkeypatch)
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]))
+
+    describe_visualization_for_audiences([], fig, levels=["LVL0", "LVL2"])
+    explanations = describe_visualization_for_audiences(
+        [], fig, levels=["LVL0", "LVL1", "LVL2"]
+    )
+
+    assert explanations == {
+        level: f"{level} explanation" for level in ("LVL0", "LVL1", "LVL2")
+    }
+    assert sorted(calls) == ["LVL0", "LVL1", "LVL2"]
+
+
+def test_shortened_explanations_are_not_cached(monkeypatch):
+    calls = _stub_explanations(monkeypatch, degradation="reduced_explanation_tokens")
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]))
+
+    describe_visualization_for_audiences([], fig, PipelineContext(), levels=["LVL0"])
+    describe_visualization_for_audiences([], fig, PipelineContext(), levels=["LVL0"])
+
+    assert calls == ["LVL0", "LVL0"]
+    assert len(main.explanation_cache) == 0
+
+
+def test_group_visualization_explains_the_levels_of_the_participants(monkeypatch):
+    calls = _stub_explanations(monkeypatch)
+    levels = {
+        "Student": (LVL0_VIZ_PROMPT, LVL0_EXP_PROMPT),
+        "Researcher": (LVL2_VIZ_PROMPT, LVL2_EXP_PROMPT),
+    }
+    monkeypatch.setattr(main, "set_complexity_level", lambda persona: levels[persona])
+    main._persona_audience_level.cache_clear()
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]))
+    monkeypatch.setattr(main, "_generate_figure", lambda *args: (fig, []))
+
+    _, description, explanations = generate_group_visualization(
+        "Is it getting hotter?",
+        "Student",
+        "temperature trends",
+        personas=["Researcher", "Student"],
+    )
+
+    assert description == "LVL0 explanation"
+    assert sorted(explanations) == ["LVL0", "LVL2"]
+    assert sorted(calls) == ["LVL0", "LVL2"]
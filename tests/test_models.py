@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from app.models import NormalizedOpenMeteoData, generate_frame_preview
+
+
+def test_frame_preview_lists_schema_units_and_nulls():
+    df = pd.DataFrame(
+        {
+            "time": ["2020-01-01", "2020-01-02", "2020-01-03", "2020-01-04"],
+            "temperature_2m_max": [10.0, np.nan, 12.5, 13.0],
+            "weather_code": [1, 2, 3, 61],
+        }
+    )
+
+    preview = generate_frame_preview(
+        "daily_data", df, {"temperature_2m_max": "°C"}
+    ).splitlines()
+
+    assert preview[0] == "daily_data: 4 rows x 3 cols | time: 2020-01-01 .. 2020-01-04"
+    assert preview[1] == "column|dtype|unit|null%"
+    assert "temperature_2m_max|float64|°C|25.0" in preview
+    assert "weather_code|int64||0.0" in preview
+
+
+def test_frame_preview_samples_evenly_spaced_rows():
+    df = pd.DataFrame(
+        {"time": [f"t{i}" for i in range(100)], "value": np.arange(100.0)}
+    )
+
+    preview = generate_frame_preview("hourly_data", df, sample_rows=3).splitlines()
+
+    assert preview[-5] == "sample rows (3 of 100):"
+    assert preview[-4] == "time|value"
+    assert [row.split("|")[0] for row in preview[-3:]] == ["t0", "t49", "t99"]
+
+
+def test_frame_preview_of_missing_data():
+    assert generate_frame_preview("hourly_data", None) == "hourly_data: empty"
+    assert generate_frame_preview("hourly_data", pd.DataFrame()) == "hourly_data: empty"
+
+
+def _hourly_data(start: str, end: str) -> NormalizedOpenMeteoData:
+    times = pd.date_range(start, end, freq="h")
+    hourly = pd.DataFrame(
+        {
+            "time": times.strftime("%Y-%m-%dT%H:%M"),
+            "temperature_2m": np.arange(len(times), dtype=float) % 24,
+            "precipitation": 0.5,
+            "precipitation_probability": np.arange(len(times)) % 100,
+            # Half the hours from the north-west, half from the north-east
+            "wind_direction_10m": np.where(np.arange(len(times)) % 2, 350.0, 10.0),
+        }
+    )
+    return NormalizedOpenMeteoData(
+        metadata=pd.DataFrame(), hourly_data=hourly, daily_data=pd.DataFrame()
+    )
+
+
+def test_daily_rollup_aggregates_each_variable_by_its_kind():
+    daily = _hourly_data("2020-01-01", "2020-01-02 23:00").rollup("daily")
+
+    assert list(daily["time"].dt.strftime("%Y-%m-%d")) == ["2020-01-01", "2020-01-02"]
+    assert list(daily["temperature_2m"]) == [11.5, 11.5]
+    assert list(daily["precipitation"]) == [12.0, 12.0]
+    assert list(daily["precipitation_probability"]) == [23, 47]
+    # A plain mean of 10° and 350° would point south
+    assert list(daily["wind_direction_10m"]) == [0.0, 0.0]
+
+
+def test_data_preview_describes_the_rollups_without_computing_them():
+    data = _hourly_data("2020-01-30", "2021-02-02 23:00")
+
+    preview = data.generate_data_preview()
+
+    assert preview.splitlines()[-1] == (
+        "rollups: daily 370 rows, monthly 14 rows, yearly 2 rows"
+        " | columns: temperature_2m, precipitation, precipitation_probability, wind_direction_10m"
+    )
+    assert data._rollups == {}
+    assert [
+        len(data.rollup(resolution)) for resolution in ("daily", "monthly", "yearly")
+    ] == [370, 14, 2]
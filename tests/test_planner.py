@@ -0,0 +1,275 @@
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from app.models import (
+    APIEndpoint,
+    APIEndpointResponse,
+    DataProcessingType,
+    VisualizationType,
+)
+from app.planner import (
+    _daily_equivalents,
+    plan_requests,
+    plan_resolution,
+    split_response,
+)
+
+ARCHIVE = "https://archive-api.open-meteo.com/v1/archive"
+CLIMATE = "https://climate-api.open-meteo.com/v1/climate"
+RANGE = "start_date=2020-01-01&end_date=2020-01-03"
+
+
+def _query(url: str) -> dict:
+    return dict(parse_qsl(urlsplit(url).query))
+
+
+def _response(url: str) -> list:
+    """Response of the API to a request, one value per day and variable"""
+    query = _query(url)
+    locations = list(zip(query["latitude"].split(","), query["longitude"].split(",")))
+    times = ["2020-01-01", "2020-01-02", "2020-01-03"]
+    return [
+        {
+            "latitude": float(latitude),
+            "longitude": float(longitude),
+            "daily": {
+                "time": times,
+                **{
+                    name: [f"{name}@{latitude}"] * len(times)
+                    for name in query["daily"].split(",")
+                },
+            },
+        }
+        for latitude, longitude in locations
+    ]
+
+
+def test_variables_of_a_location_are_merged_and_split_back():
+    endpoints = [
+        APIEndpoint(
+            url=f"{ARCHIVE}?latitude=35.2&longitude=136.9&{RANGE}&daily=temperature_2m_max"
+        ),
+        APIEndpoint(
+            url=f"{ARCHIVE}?latitude=35.2&longitude=136.9&{RANGE}&daily=precipitation_sum,temperature_2m_max"
+        ),
+    ]
+
+    (planned,) = plan_requests(endpoints)
+    assert _query(planned.url)["daily"] == "precipitation_sum,temperature_2m_max"
+
+    split = {
+        source.endpoint_index: data
+        for source, data in split_response(planned, _response(planned.url)[0])
+    }
+    assert list(split[0]["daily"]) == ["time", "temperature_2m_max"]
+    assert list(split[1]["daily"]) == [
+        "time",
+        "precipitation_sum",
+        "temperature_2m_max",
+    ]
+
+
+def test_locations_with_the_same_variables_share_a_request():
+    endpoints = [
+        APIEndpoint(
+            url=f"{ARCHIVE}?latitude=35.2&longitude=136.9&{RANGE}&daily=temperature_2m_max"
+        ),
+        APIEndpoint(
+            url=f"{ARCHIVE}?latitude=34.7&longitude=135.5&{RANGE}&daily=temperature_2m_max"
+        ),
+        APIEndpoint(
+            url=f"{ARCHIVE}?latitude=35.2&longitude=136.9&{RANGE}&daily=temperature_2m_max"
+        ),
+    ]
+
+    (planned,) = plan_requests(endpoints)
+    assert len(planned.locations) == 2
+
+    split = list(split_response(planned, _response(planned.url)))
+    assert [source.endpoint_index for source, _ in split] == [0, 1]
+    for source, data in split:
+        assert (
+            data["daily"]["temperature_2m_max"][0]
+            == f"temperature_2m_max@{source.location[0]}"
+        )
+        assert (
+            planned.source_url(source)
+            == plan_requests([APIEndpoint(url=endpoints[source.endpoint_index].url)])[
+                0
+            ].url
+        )
+
+
+def test_split_response_keeps_model_suffixed_variables():
+    url = f"{CLIMATE}?latitude=35.2&longitude=136.9&start_date=2030-01-01&end_date=2030-01-02&models=MRI_AGCM3_2_S,EC_Earth3P_HR"
+    endpoints = [
+        APIEndpoint(url=f"{url}&daily=temperature_2m_mean"),
+        APIEndpoint(url=f"{url}&daily=precipitation_sum"),
+    ]
+    response = {
+        "daily": {
+            "time": ["2030-01-01", "2030-01-02"],
+            **{
+                f"{name}_{model}": [0, 1]
+                for name in ("temperature_2m_mean", "precipitation_sum")
+                for model in ("MRI_AGCM3_2_S", "EC_Earth3P_HR")
+            },
+        }
+    }
+
+    (planned,) = plan_requests(endpoints)
+    split = {
+        source.endpoint_index: data
+        for source, data in split_response(planned, response)
+    }
+
+    assert list(split[0]["daily"]) == [
+        "time",
+        "temperature_2m_mean_MRI_AGCM3_2_S",
+        "temperature_2m_mean_EC_Earth3P_HR",
+    ]
+    assert list(split[1]["daily"]) == [
+        "time",
+        "precipitation_sum_MRI_AGCM3_2_S",
+        "precipitation_sum_EC_Earth3P_HR",
+    ]
+
+
+def test_split_response_checks_the_number_of_locations():
+    endpoints = [
+        APIEndpoint(
+            url=f"{ARCHIVE}?latitude=35.2,34.7&longitude=136.9,135.5&{RANGE}&daily=temperature_2m_max"
+        ),
+    ]
+
+    (planned,) = plan_requests(endpoints)
+    with pytest.raises(ValueError):
+        list(split_response(planned, _response(planned.url)[0]))
+
+
+HOURLY_URL = f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2020-01-01&end_date=2020-01-05&hourly=precipitation,temperature_2m"
+
+
+def _plan(needed_data: str, steps: str) -> dict:
+    details = VisualizationType(
+        visualization="Rainfall",
+        chart_type="bar chart",
+        focus="rainfall",
+        visual_elements="bars",
+    )
+    endpoints = plan_resolution(
+        APIEndpointResponse(endpoints=[APIEndpoint(url=HOURLY_URL)]),
+        DataProcessingType(needed_data=needed_data, data_processing_steps=steps),
+        details,
+    ).endpoints
+    return _query(endpoints[0].url)
+
+
+def test_plan_resolution_downgrades_explicit_daily_aggregations():
+    query = _plan(
+        "rainfall over 5 days", "Step 1: compute the daily total of precipitation"
+    )
+
+    assert query["daily"] == "precipitation_sum,temperature_2m_mean"
+    assert "hourly" not in query
+    assert query["timezone"] == "auto"
+
+
+def test_plan_resolution_downgrades_long_temperature_series_to_the_daily_mean():
+    url = f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2000-01-01&end_date=2020-12-31&hourly=temperature_2m"
+    endpoints = plan_resolution(
+        APIEndpointResponse(endpoints=[APIEndpoint(url=url)]),
+        DataProcessingType(
+            needed_data="temperature from 2000 to 2020",
+            data_processing_steps="Step 1: Calculate annual average temperature",
+        ),
+        VisualizationType(
+            visualization="Temperature",
+            chart_type="line chart",
+            focus="temperature",
+            visual_elements="line",
+        ),
+    ).endpoints
+
+    query = _query(endpoints[0].url)
+    assert query["daily"] == "temperature_2m_mean"
+    assert "hourly" not in query
+
+
+def test_daily_equivalents_fall_back_to_the_daily_range_without_a_mean():
+    daily_parameters = {"temperature_2m_max": "°C", "temperature_2m_min": "°C"}
+
+    assert _daily_equivalents(
+        "temperature_2m", "°C (°F); Air temperature", daily_parameters, False, False
+    ) == [
+        "temperature_2m_max",
+        "temperature_2m_min",
+    ]
+    # A lone extreme doesn't stand for the series
+    assert (
+        _daily_equivalents(
+            "temperature_2m",
+            "°C (°F); Air temperature",
+            {"temperature_2m_max": "°C"},
+            False,
+            False,
+        )
+        == []
+    )
+
+
+def test_plan_resolution_sets_local_time_when_every_variable_is_daily():
+    url = f"{ARCHIVE}?latitude=35.2&longitude=136.9&start_date=2020-01-01&end_date=2020-01-05&hourly=precipitation"
+    endpoints = plan_resolution(
+        APIEndpointResponse(endpoints=[APIEndpoint(url=url)]),
+        DataProcessingType(
+            needed_data="rainfall", data_processing_steps="Step 1: sum per day"
+        ),
+        VisualizationType(
+            visualization="Rainfall",
+            chart_type="bar chart",
+            focus="rainfall",
+            visual_elements="bars",
+        ),
+    ).endpoints
+
+    query = _query(endpoints[0].url)
+    assert query["daily"] == "precipitation_sum"
+    assert "hourly" not in query
+    assert query["timezone"] == "auto"
+
+
+@pytest.mark.parametrize(
+    "needed_data, steps",
+    [
+        (
+            "Hourly rainfall over 5 days",
+            "Step 1: compute the daily total of precipitation",
+        ),
+        ("rainfall over 5 days", "Step 1: plot the values over 5 days"),
+        ("rainfall and temperature", "Step 1: compare precipitation and temperature"),
+    ],
+)
+def test_plan_resolution_keeps_hourly_data(needed_data, steps):
+    query = _plan(needed_data, steps)
+
+    assert query["hourly"] == "precipitation,temperature_2m"
+    assert "daily" not in query
+
+
+def test_plan_resolution_returns_invalid_endpoints_unchanged():
+    endpoint = APIEndpoint(
+        url="https://example.com/v1/forecast?latitude=1&longitude=2&hourly=temperature_2m"
+    )
+    planned = plan_resolution(
+        APIEndpointResponse(endpoints=[endpoint]),
+        DataProcessingType(
+            needed_data="temperature", data_processing_steps="daily mean"
+        ),
+        VisualizationType(
+            visualization="v", chart_type="line", focus="f", visual_elements="e"
+        ),
+    )
+
+    assert planned.endpoints[0].url == endpoint.url
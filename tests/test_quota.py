@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from app.quota import QuotaExceeded, QuotaScheduler, estimate_request_weight
+
+ARCHIVE = "https://archive-api.open-meteo.com/v1/archive"
+
+
+@pytest.mark.parametrize(
+    "query, weight",
+    [
+        (
+            "latitude=35.25&longitude=137&start_date=2020-01-01&end_date=2020-01-14&daily=temperature_2m_max",
+            1,
+        ),
+        (
+            "latitude=35.25,34.75&longitude=137,135.5&start_date=2020-01-01&end_date=2020-01-14&daily=temperature_2m_max",
+            2,
+        ),
+        (
+            "latitude=35.25&longitude=137&start_date=2020-01-01&end_date=2020-01-28&hourly="
+            + ",".join(f"variable_{i}" for i in range(20)),
+            4,
+        ),
+        (
+            "latitude=35.25&longitude=137&start_date=1990-01-01&end_date=2023-12-31&daily=temperature_2m_max",
+            887,
+        ),
+        ("latitude=35.25&longitude=137&hourly=temperature_2m", 1),
+    ],
+)
+def test_estimate_request_weight(query, weight):
+    assert estimate_request_weight(f"{ARCHIVE}?{query}") == pytest.approx(weight)
+
+
+def test_estimate_request_weight_counts_models():
+    url = "https://climate-api.open-meteo.com/v1/climate?latitude=35&longitude=137&start_date=2030-01-01&end_date=2030-01-14"
+    assert (
+        estimate_request_weight(
+            f"{url}&daily=precipitation_sum&models=MRI_AGCM3_2_S,EC_Earth3P_HR"
+        )
+        == 2
+    )
+
+
+def test_acquire_within_limits_does_not_wait():
+    scheduler = QuotaScheduler({"minute": (60, 10)}, max_wait=1)
+
+    assert scheduler.acquire(4) < 0.05
+    assert scheduler.acquire(6) < 0.05
+    assert scheduler.remaining("minute") == 0
+    assert scheduler.stats()["waits"] == 0
+
+
+def test_acquire_waits_for_the_window_to_free_budget():
+    scheduler = QuotaScheduler({"window": (0.3, 10)}, max_wait=2)
+    scheduler.acquire(8)
+
+    waited = scheduler.acquire(5)
+
+    assert 0.2 < waited < 0.6
+    assert scheduler.stats()["waits"] == 1
+
+
+def test_acquire_rejects_beyond_max_wait():
+    scheduler = QuotaScheduler({"window": (5, 10)}, max_wait=0.1)
+    scheduler.acquire(10)
+
+    with pytest.raises(QuotaExceeded):
+        scheduler.acquire(1)
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_heavy_request_is_sent_once_the_window_is_empty():
+    scheduler = QuotaScheduler(
+        {"minute": (0.3, 600), "day": (86400, 10000)}, max_wait=2
+    )
+
+    assert scheduler.acquire(887) < 0.05
+    assert 0.2 < scheduler.acquire(887) < 0.6
+    assert scheduler.stats()["windows"]["day"]["used"] == 1774
+
+
+def test_requests_are_served_in_arrival_order():
+    scheduler = QuotaScheduler({"window": (0.3, 10)}, max_wait=2)
+    scheduler.acquire(10)
+    order = []
+
+    def acquire(name, weight, delay):
+        time.sleep(delay)
+        scheduler.acquire(weight)
+        order.append(name)
+
+    heavy = threading.Thread(target=acquire, args=("heavy", 10, 0))
+    light = threading.Thread(target=acquire, args=("light", 1, 0.05))
+    heavy.start()
+    light.start()
+    heavy.join()
+    light.join()
+
+    # The light request would fit after the heavy one's window, but waits behind it
+    assert order == ["heavy", "light"]
+
+
+def test_background_request_keeps_the_reserved_share():
+    scheduler = QuotaScheduler({"minute": (60, 10)}, max_wait=0.1)
+
+    with pytest.raises(QuotaExceeded):
+        scheduler.acquire(6, reserved_share=0.5)
+    scheduler.acquire(5, reserved_share=0.5)
+    with pytest.raises(QuotaExceeded):
+        scheduler.acquire(1, reserved_share=0.5)
+    # Requests without a reserve can still use it
+    scheduler.acquire(5)
+
+
+def test_background_request_yields_to_queued_requests():
+    scheduler = QuotaScheduler({"window": (0.3, 10)}, max_wait=2)
+    scheduler.acquire(10)
+    order = []
+
+    def acquire(name, weight, delay, reserved_share):
+        time.sleep(delay)
+        scheduler.acquire(weight, reserved_share=reserved_share)
+        order.append(name)
+
+    background = threading.Thread(target=acquire, args=("background", 2, 0, 0.5))
+    user = threading.Thread(target=acquire, args=("user", 2, 0.05, 0.0))
+    background.start()
+    user.start()
+    background.join()
+    user.join()
+
+    assert order == ["user", "background"]
+    assert scheduler.stats()["queued"] == 0
@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+
+from app import routing
+from app.ai import LLMProvider
+from app.constants import GPT_4o, GPT_4o_MINI, SONNET_3_5
+from app.routing import LLMRouter, ModelRouter
+
+MESSAGES = [{"role": "user", "content": "Is Nagoya getting hotter?"}]
+
+
+class FakeClient:
+    """Client answering with its name, after raising the queued errors"""
+
+    def __init__(self, name: str, errors: list = None, delay: float = 0):
+        self.name = name
+        self.errors = list(errors or [])
+        self.delay = delay
+        self.calls = 0
+
+    def completion(self, messages, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        threading.Event().wait(self.delay)
+        return self.name
+
+
+def _router(
+    openai_client: FakeClient, anthropic_client: FakeClient, **kwargs
+) -> LLMRouter:
+    clients = {
+        LLMProvider.OPENAI: openai_client,
+        LLMProvider.ANTHROPIC: anthropic_client,
+    }
+    return LLMRouter(clients, backoff_base=0, backoff_max=0, **kwargs)
+
+
+def test_transient_errors_are_retried_on_the_same_provider():
+    anthropic_client = FakeClient("anthropic", errors=[TimeoutError(), TimeoutError()])
+    router = _router(FakeClient("openai"), anthropic_client, max_retries=2)
+
+    assert router.completion(MESSAGES) == "anthropic"
+    assert anthropic_client.calls == 3
+    assert router.counts["retries"] == 2
+    assert router.counts["failovers"] == 0
+
+
+def test_calls_fail_over_once_retries_are_exhausted():
+    openai_client = FakeClient("openai")
+    anthropic_client = FakeClient("anthropic", errors=[TimeoutError(), TimeoutError()])
+    router = _router(openai_client, anthropic_client, max_retries=1)
+
+    assert (
+        router.completion(
+            MESSAGES, providers=[LLMProvider.ANTHROPIC, LLMProvider.OPENAI]
+        )
+        == "openai"
+    )
+    assert anthropic_client.calls == 2
+    assert router.counts["openai.failovers"] == 1
+
+
+def test_permanent_errors_fail_over_without_retrying():
+    anthropic_client = FakeClient("anthropic", errors=[ValueError("invalid request")])
+    router = _router(FakeClient("openai"), anthropic_client, max_retries=3)
+
+    assert (
+        router.completion(
+            MESSAGES, providers=[LLMProvider.ANTHROPIC, LLMProvider.OPENAI]
+        )
+        == "openai"
+    )
+    assert anthropic_client.calls == 1
+    assert router.counts["retries"] == 0
+
+
+def test_the_last_error_is_raised_when_no_provider_can_serve_the_call():
+    router = _router(
+        FakeClient("openai", errors=[ValueError("openai down")]),
+        FakeClient("anthropic", errors=[ValueError("anthropic down")]),
+        max_retries=0,
+    )
+
+    with pytest.raises(ValueError, match="openai down"):
+        router.completion(
+            MESSAGES, providers=[LLMProvider.ANTHROPIC, LLMProvider.OPENAI]
+        )
+
+
+def test_slow_calls_are_hedged_with_the_next_provider():
+    router = _router(
+        FakeClient("openai"), FakeClient("anthropic", delay=1), hedge_default_delay=0.05
+    )
+
+    assert (
+        router.completion(
+            MESSAGES, providers=[LLMProvider.ANTHROPIC, LLMProvider.OPENAI], hedge=True
+        )
+        == "openai"
+    )
+    assert router.counts["openai.hedge_wins"] == 1
+
+
+def test_stage_models_over_the_cost_ceiling_are_tried_last(monkeypatch):
+    monkeypatch.setattr(routing, "estimate_tokens", lambda messages: 10_000)
+    model_router = ModelRouter(
+        {"summary": {"models": [SONNET_3_5, GPT_4o, GPT_4o_MINI], "max_cost": 0.01}}
+    )
+
+    assert model_router.select("summary", MESSAGES, max_tokens=500) == [
+        GPT_4o_MINI,
+        SONNET_3_5,
+        GPT_4o,
+    ]
+
+
+def test_stage_calls_fail_over_between_the_models_of_the_stage(monkeypatch):
+    monkeypatch.setattr(routing, "estimate_tokens", lambda messages: 100)
+    model_router = ModelRouter({"summary": {"models": [SONNET_3_5, GPT_4o_MINI]}})
+    router = _router(
+        FakeClient("openai"),
+        FakeClient("anthropic", errors=[ValueError("overloaded")]),
+        model_router=model_router,
+    )
+
+    assert router.completion(MESSAGES, stage="summary", max_tokens=100) == "openai"
+    assert model_router.stats()["summary"]["models"][SONNET_3_5]["selected"] == 1
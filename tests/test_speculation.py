@@ -0,0 +1,68 @@
+import time
+
+from app import speculation
+from app.models import VisualizationNeed, VisualizationType
+from app.speculation import SpeculationBudget, SpeculativeClassifier
+
+MESSAGE = "Nagoya summers feel hotter than when I was a kid, is that true?"
+DETAILS = VisualizationType(
+    visualization="Summer temperatures",
+    chart_type="line chart",
+    focus="trend",
+    visual_elements="line",
+)
+
+
+def _stub_stages(monkeypatch, need_visualization: int, calls: list) -> None:
+    def classify(message):
+        # Escalated to the LLM classifier, which summarizes the topic
+        time.sleep(0.05)
+        return VisualizationNeed.model_validate(
+            {
+                "need_visualization": need_visualization,
+                "topic_of_interest": "temperature trends",
+            }
+        )
+
+    def determine_visualization_type(
+        prompt, topic_of_interest, persona, complexity_level
+    ):
+        calls.append(topic_of_interest)
+        return DETAILS
+
+    monkeypatch.setattr(speculation, "classify_visualization_need", classify)
+    monkeypatch.setattr(
+        speculation, "set_complexity_level", lambda persona: ("LVL1", "LVL2")
+    )
+    monkeypatch.setattr(
+        speculation, "determine_visualization_type", determine_visualization_type
+    )
+    monkeypatch.setattr(speculation, "pre_classifier_gate", None)
+
+
+def test_speculation_is_committed_when_the_classifier_returns_another_topic(
+    monkeypatch,
+):
+    calls = []
+    _stub_stages(monkeypatch, 1, calls)
+    classifier = SpeculativeClassifier(budget=SpeculationBudget())
+
+    viz_need, prepared = classifier.classify(MESSAGE, "Climate Scientist")
+
+    assert viz_need.topic_of_interest == "temperature trends"
+    assert prepared.complexity_levels == ("LVL1", "LVL2")
+    assert prepared.visualization_details == DETAILS
+    assert calls == [MESSAGE]
+    assert classifier.budget.stats()["committed"] == 1
+    assert classifier.budget.stats()["wasted_calls"] == 0
+
+
+def test_speculation_is_wasted_when_no_visualization_is_needed(monkeypatch):
+    _stub_stages(monkeypatch, 0, [])
+    classifier = SpeculativeClassifier(budget=SpeculationBudget())
+
+    viz_need, prepared = classifier.classify(MESSAGE, "Climate Scientist")
+    classifier._executor.shutdown(wait=True)
+
+    assert prepared is None
+    assert classifier.budget.stats()["wasted"] == 1
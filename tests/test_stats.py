@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.stats import compute_stats, numeric_columns
+
+
+def _frame(with_missing: bool) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "time": pd.date_range("2020-01-01", periods=200, freq="D").strftime(
+                "%Y-%m-%d"
+            ),
+            "temperature_2m_max": rng.normal(20, 5, 200),
+            "precipitation_sum": rng.gamma(1, 3, 200),
+            "weather_code": rng.integers(0, 99, 200),
+            "is_day": rng.integers(0, 2, 200).astype(bool),
+        }
+    )
+    if with_missing:
+        df.loc[rng.choice(200, 40, replace=False), "temperature_2m_max"] = np.nan
+        df.loc[:9, "precipitation_sum"] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("with_missing", [False, True])
+def test_compute_stats_matches_describe(with_missing):
+    df = _frame(with_missing)
+    described = df[numeric_columns(df)].describe()
+
+    stats = {column_stats.column: column_stats for column_stats in compute_stats(df)}
+
+    assert list(stats) == ["temperature_2m_max", "precipitation_sum", "weather_code"]
+    for column, column_stats in stats.items():
+        assert column_stats.count == described.loc["count", column]
+        assert column_stats.mean == pytest.approx(described.loc["mean", column])
+        assert column_stats.std == pytest.approx(described.loc["std", column])
+        assert column_stats.min == pytest.approx(described.loc["min", column])
+        assert column_stats.max == pytest.approx(described.loc["max", column])
+        assert df[column].iloc[column_stats.min_position] == column_stats.min
+        assert df[column].iloc[column_stats.max_position] == column_stats.max
+
+
+@pytest.mark.parametrize("with_missing", [False, True])
+def test_compute_stats_slope_matches_least_squares(with_missing):
+    df = _frame(with_missing)
+
+    for column_stats in compute_stats(df):
+        series = df[column_stats.column]
+        valid = series.notna().to_numpy()
+        positions = np.arange(len(series))[valid]
+        slope = np.polyfit(positions, series.to_numpy(dtype=float)[valid], 1)[0]
+
+        assert column_stats.slope == pytest.approx(slope)
+        assert column_stats.first == series.dropna().iloc[0]
+        assert column_stats.last == series.dropna().iloc[-1]
+        assert column_stats.trend_change == pytest.approx(
+            slope * (positions[-1] - positions[0])
+        )
+
+
+def test_compute_stats_skips_empty_columns():
+    df = pd.DataFrame(
+        {"time": ["2020-01-01", "2020-01-02"], "a": [np.nan, np.nan], "b": [1.0, 3.0]}
+    )
+
+    assert [column_stats.column for column_stats in compute_stats(df)] == ["b"]
+    assert compute_stats(df.iloc[:0]) == []
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models import NormalizedOpenMeteoData, VisualizationType
+from app.prompts import LVL0_VIZ_PROMPT, LVL2_VIZ_PROMPT
+from app.templates import match_template
+
+
+def _daily_data(*variables: str, latitude: float = 35.25) -> NormalizedOpenMeteoData:
+    times = pd.date_range("2015-01-01", "2019-12-31", freq="D")
+    daily = pd.DataFrame({"time": times.strftime("%Y-%m-%d")})
+    for i, variable in enumerate(variables):
+        daily[variable] = np.linspace(0, 10, len(times)) + i
+    metadata = pd.DataFrame([{"latitude": latitude, "longitude": 137.0}])
+    return NormalizedOpenMeteoData(
+        metadata=metadata, hourly_data=pd.DataFrame(), daily_data=daily
+    )
+
+
+def _details(visualization: str, chart_type: str = "line chart") -> VisualizationType:
+    return VisualizationType(
+        visualization=visualization,
+        chart_type=chart_type,
+        focus="yearly trend",
+        visual_elements="line",
+    )
+
+
+def _variable(details: VisualizationType, data: list, **kwargs):
+    match = match_template(details, data, **kwargs)
+    return (
+        None
+        if match is None
+        else match.params.get("variable", match.params.get("variables"))
+    )
+
+
+def test_average_temperature_uses_the_daily_mean():
+    data = [
+        _daily_data("temperature_2m_max", "temperature_2m_min", "temperature_2m_mean")
+    ]
+
+    assert (
+        _variable(_details("Average temperature over the years"), data)
+        == "temperature_2m_mean"
+    )
+
+
+def test_average_temperature_over_daily_extremes_needs_generated_code():
+    data = [_daily_data("temperature_2m_max", "temperature_2m_min")]
+
+    assert match_template(_details("Average temperature over the years"), data) is None
+
+
+def test_requested_extreme_is_drawn():
+    data = [_daily_data("temperature_2m_max", "temperature_2m_min")]
+
+    assert (
+        _variable(_details("Maximum temperature over the years"), data)
+        == "temperature_2m_max"
+    )
+
+
+def test_variable_without_aggregation_is_ambiguous_between_extremes():
+    data = [_daily_data("temperature_2m_max", "temperature_2m_min")]
+
+    assert match_template(_details("Temperature over the years"), data) is None
+
+
+def test_location_comparison_draws_every_mentioned_variable():
+    data = [
+        _daily_data("temperature_2m_mean", "precipitation_sum"),
+        _daily_data("temperature_2m_mean", "precipitation_sum", latitude=34.75),
+    ]
+
+    assert _variable(
+        _details("Compare temperature and precipitation between cities"), data
+    ) == ["temperature_2m_mean", "precipitation_sum"]
+
+
+@pytest.mark.parametrize(
+    "visualization, processing_steps",
+    [
+        ("Average summer temperature over the years", None),
+        ("Average temperature over the years in Fahrenheit", None),
+        ("Average temperature over the years", ["Step 1: keep the days above 30°C"]),
+        (
+            "Average temperature over the years",
+            ["Step 1: count the number of hot days per year"],
+        ),
+    ],
+)
+def test_processing_the_templates_would_drop_needs_generated_code(
+    visualization, processing_steps
+):
+    data = [_daily_data("temperature_2m_mean")]
+
+    assert (
+        match_template(_details(visualization), data, processing_steps=processing_steps)
+        is None
+    )
+
+
+def test_templates_only_serve_simple_charts():
+    data = [_daily_data("temperature_2m_mean")]
+    details = _details("Average temperature over the years")
+
+    assert match_template(details, data, complexity_level=LVL0_VIZ_PROMPT) is not None
+    assert match_template(details, data, complexity_level=LVL2_VIZ_PROMPT) is None
+    assert match_template(details, data, previous_code="fig = go.Figure()") is None
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from app.context import PipelineContext
+from app.utils import SingleFlight
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def fetch(url):
+        calls.append(url)
+        started.set()
+        time.sleep(0.2)
+        return {"url": url}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("a", fetch, "a")))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(
+        target=lambda: results.append(flight.do("a", fetch, "a"))
+    )
+    follower.start()
+    leader.join()
+    follower.join()
+
+    assert calls == ["a"]
+    assert results[0] is results[1]
+    # Once the call is done, the next one runs again
+    assert flight.do("a", fetch, "a") == {"url": "a"}
+    assert calls == ["a", "a"]
+
+
+def test_single_flight_shares_the_exception():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("API down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("a", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_single_flight_follower_waits_no_longer_than_its_stage():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 1
+
+    leader = threading.Thread(target=flight.do, args=("a", slow))
+    leader.start()
+    started.wait()
+    try:
+        context = PipelineContext.with_timeout(0.2)
+        with pytest.raises(TimeoutError):
+            with context.stage("fetch"):
+                flight.do("a", slow)
+    finally:
+        release.set()
+        leader.join()
@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+from app.quota import estimate_request_weight
+from app.warmup import _chunk_urls, _concatenate
+
+URL = (
+    "https://archive-api.open-meteo.com/v1/archive?daily=precipitation_sum,temperature_2m_mean"
+    "&end_date=2020-12-31&latitude=35.25&longitude=137.0&start_date=2001-01-01&timezone=auto"
+)
+
+
+def _query(url: str) -> dict:
+    return dict(parse_qsl(urlsplit(url).query))
+
+
+def _response(url: str) -> dict:
+    """Response of the API to a daily request, each value being the day number of its date"""
+    query = _query(url)
+    start, end = date.fromisoformat(query["start_date"]), date.fromisoformat(
+        query["end_date"]
+    )
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    daily = {"time": [day.isoformat() for day in days]}
+    for variable in query["daily"].split(","):
+        daily[variable] = [day.toordinal() for day in days]
+    return {
+        "latitude": 35.25,
+        "longitude": 137.0,
+        "daily_units": {"time": "iso8601"},
+        "daily": daily,
+    }
+
+
+def test_chunks_fit_the_budget_and_cover_the_range():
+    chunks = _chunk_urls(URL, budget=100)
+
+    assert len(chunks) > 1
+    assert all(estimate_request_weight(chunk) <= 100 for chunk in chunks)
+    ranges = [
+        (_query(chunk)["start_date"], _query(chunk)["end_date"]) for chunk in chunks
+    ]
+    assert ranges[0][0] == "2001-01-01"
+    assert ranges[-1][1] == "2020-12-31"
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert date.fromisoformat(start) == date.fromisoformat(end) + timedelta(days=1)
+    # Only the dates change
+    assert all(
+        {**_query(chunk), "start_date": "", "end_date": ""}
+        == {**_query(URL), "start_date": "", "end_date": ""}
+        for chunk in chunks
+    )
+
+
+def test_series_within_the_budget_are_fetched_whole():
+    assert _chunk_urls(URL, budget=estimate_request_weight(URL)) == [URL]
+
+
+def test_concatenated_chunks_give_back_the_whole_series():
+    joined = _concatenate([_response(chunk) for chunk in _chunk_urls(URL, budget=100)])
+
+    assert joined == _response(URL)